@@ -29,9 +29,8 @@ class ArtNet():
         content.append(struct.pack('<H', net << 8 | subnet << 4 | universe))
         # Length of DMX Data, High Byte First
         content.append(struct.pack('>H', len(dmxdata)))
-        # append the actual DMX Data
-        for d in dmxdata:
-            content.append(struct.pack('B', d))
+        # append the actual DMX Data, this can be a list or a numpy uint8 array
+        content.append(bytes(bytearray(dmxdata)))
         # stitch it together
         content = b''.join(content)
         # send
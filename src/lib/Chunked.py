@@ -0,0 +1,278 @@
+import os
+import struct
+import time
+import zlib
+import numpy as np
+
+try:
+    import lz4.frame
+except ImportError:
+    # this is optional, it is only needed for lz4 compression
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    # this is optional, it is only needed for zstd compression
+    zstandard = None
+
+####################################################################################################
+# This implements an append-only binary file format for continuous recordings. The file starts
+# with a header, followed by a sequence of chunks, followed by an index of all chunks.
+#
+# header: magic, version, nchans, fsample, compression, length of the labels, labels separated by newlines
+# chunk:  magic, number of bytes, begsample, nsamples, followed by the timestamps as float64 and
+#         the samples x channels as float32 in row-major order, i.e. all channels of the first
+#         sample followed by all channels of the next sample, which are compressed together
+# index:  magic, number of chunks, followed by (offset, begsample, nsamples) for each chunk
+# footer: offset of the index, magic
+#
+# The index is written when the file is closed. If the recording was interrupted, the reader
+# reconstructs the index by stepping through the chunk headers.
+####################################################################################################
+
+headerformat = '<8sIIxxxxd8sI'
+chunkformat  = '<4sIQI'
+indexformat  = '<4sQ'
+footerformat = '<Q8s'
+indexdtype   = np.dtype([('offset', '<u8'), ('begsample', '<u8'), ('nsamples', '<u8')])
+
+headermagic = b'EEGSYNTH'
+chunkmagic  = b'CHNK'
+indexmagic  = b'INDX'
+footermagic = b'INDXEND.'
+version     = 1
+
+
+def compress(buf, compression):
+    if compression == 'none':
+        return buf
+    elif compression == 'zlib':
+        return zlib.compress(buf, 1)
+    elif compression == 'lz4':
+        return lz4.frame.compress(buf)
+    elif compression == 'zstd':
+        return zstandard.ZstdCompressor(level=1).compress(buf)
+
+
+def decompress(buf, compression):
+    if compression == 'none':
+        return buf
+    elif compression == 'zlib':
+        return zlib.decompress(buf)
+    elif compression == 'lz4':
+        return lz4.frame.decompress(buf)
+    elif compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(buf)
+
+
+def checkcompression(compression):
+    if compression not in ('none', 'zlib', 'lz4', 'zstd'):
+        raise ValueError('unsupported compression ' + compression)
+    if compression == 'lz4' and lz4 is None:
+        raise ImportError('lz4 compression requires the lz4 package')
+    if compression == 'zstd' and zstandard is None:
+        raise ImportError('zstd compression requires the zstandard package')
+
+####################################################################################################
+
+class ChunkedWriter():
+    def __init__(self, fname=None, chunksize=1024, compression='none'):
+        self.fname = None
+        self.fid = None
+        self.nchans = None
+        self.fsample = None
+        self.labels = None
+        self.chunksize = chunksize      # in samples
+        self.compression = compression
+        self.nsamples = 0               # number of samples written to disk
+        self.index = []
+        self.data = []                  # samples that are waiting to be written
+        self.timestamps = []
+        self.pending = 0
+        if fname:
+            self.open(fname)
+
+    def open(self, fname):
+        checkcompression(self.compression)
+        self.fid = open(fname, 'wb')
+        self.fname = fname
+
+    def writeHeader(self, nchans, fsample, labels=None):
+        if labels is None or len(labels) < nchans:
+            labels = [str(i) for i in range(nchans)]
+        self.nchans = nchans
+        self.fsample = fsample
+        self.labels = list(labels)
+        labels = '\n'.join(self.labels).encode()
+        self.fid.write(struct.pack(headerformat, headermagic, version, nchans, fsample, self.compression.encode(), len(labels)))
+        self.fid.write(labels)
+
+    def writeBlock(self, data, timestamp=None):
+        # the data should be a samples x channels array
+        # the timestamp is the time of the first sample, the following ones are computed from the sampling rate
+        data = np.asarray(data, dtype=np.float32).reshape(-1, self.nchans)
+        if timestamp is None:
+            timestamp = time.time() - (len(data) - 1) / self.fsample
+        self.data.append(data)
+        self.timestamps.append(timestamp + np.arange(len(data)) / self.fsample)
+        self.pending += len(data)
+        if self.pending >= self.chunksize:
+            self.flush()
+
+    def flush(self):
+        # write all pending samples as a single chunk
+        if self.pending == 0:
+            return
+        data = np.concatenate(self.data)
+        timestamps = np.concatenate(self.timestamps).astype('<f8')
+        buf = compress(timestamps.tobytes() + data.astype('<f4').tobytes(), self.compression)
+        self.index.append((self.fid.tell(), self.nsamples, len(data)))
+        self.fid.write(struct.pack(chunkformat, chunkmagic, len(buf), self.nsamples, len(data)))
+        self.fid.write(buf)
+        self.nsamples += len(data)
+        self.data = []
+        self.timestamps = []
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        offset = self.fid.tell()
+        index = np.array(self.index, dtype=indexdtype)
+        self.fid.write(struct.pack(indexformat, indexmagic, len(index)))
+        self.fid.write(index.tobytes())
+        self.fid.write(struct.pack(footerformat, offset, footermagic))
+        self.fid.close()
+        self.fid = None
+        self.fname = None
+        self.index = []
+        self.nsamples = 0
+
+####################################################################################################
+
+class ChunkedReader():
+    def __init__(self, fname=None):
+        self.fname = None
+        self.fid = None
+        self.nchans = None
+        self.fsample = None
+        self.labels = None
+        self.compression = None
+        self.index = None
+        self.cache = (None, None, None)     # the most recently decoded chunk
+        if fname:
+            self.open(fname)
+
+    def open(self, fname):
+        self.fid = open(fname, 'rb')
+        self.fname = fname
+        self.readHeader()
+        self.readIndex()
+
+    def close(self):
+        self.fid.close()
+        self.fid = None
+        self.fname = None
+        self.index = None
+        self.cache = (None, None, None)
+
+    def readHeader(self):
+        self.fid.seek(0)
+        magic, fileversion, self.nchans, self.fsample, compression, nbytes = struct.unpack(headerformat, self.fid.read(struct.calcsize(headerformat)))
+        if magic != headermagic or fileversion != version:
+            raise IOError('unsupported file format')
+        self.compression = compression.rstrip(b'\0').decode()
+        checkcompression(self.compression)
+        self.labels = self.fid.read(nbytes).decode().split('\n')
+        self.offset = self.fid.tell()       # the first chunk starts here
+        return (self.nchans, self.fsample, self.labels)
+
+    def readIndex(self):
+        filesize = os.path.getsize(self.fname)
+        footersize = struct.calcsize(footerformat)
+        if filesize - footersize >= self.offset:
+            self.fid.seek(filesize - footersize)
+            offset, magic = struct.unpack(footerformat, self.fid.read(footersize))
+            if magic == footermagic:
+                self.fid.seek(offset)
+                magic, count = struct.unpack(indexformat, self.fid.read(struct.calcsize(indexformat)))
+                self.index = np.frombuffer(self.fid.read(count * indexdtype.itemsize), dtype=indexdtype)
+                return self.index
+
+        # the file was not closed properly, reconstruct the index from the chunk headers
+        index = []
+        offset = self.offset
+        chunksize = struct.calcsize(chunkformat)
+        while offset + chunksize <= filesize:
+            self.fid.seek(offset)
+            magic, nbytes, begsample, nsamples = struct.unpack(chunkformat, self.fid.read(chunksize))
+            if magic != chunkmagic or offset + chunksize + nbytes > filesize:
+                break
+            index.append((offset, begsample, nsamples))
+            offset += chunksize + nbytes
+        self.index = np.array(index, dtype=indexdtype)
+        return self.index
+
+    def readChunk(self, chunk):
+        if self.cache[0] == chunk:
+            return self.cache[1], self.cache[2]
+        self.fid.seek(int(self.index['offset'][chunk]))
+        magic, nbytes, begsample, nsamples = struct.unpack(chunkformat, self.fid.read(struct.calcsize(chunkformat)))
+        buf = decompress(self.fid.read(nbytes), self.compression)
+        timestamps = np.frombuffer(buf, dtype='<f8', count=nsamples)
+        data = np.frombuffer(buf, dtype='<f4', offset=8 * nsamples).reshape(nsamples, self.nchans)
+        self.cache = (chunk, timestamps, data)
+        return timestamps, data
+
+    def readChunks(self, begsample, endsample):
+        # find the chunks that contain the requested samples
+        if endsample < begsample or len(self.index) == 0:
+            return np.zeros(0), np.zeros((0, self.nchans), dtype=np.float32)
+        begchunk = np.searchsorted(self.index['begsample'], begsample, side='right') - 1
+        endchunk = np.searchsorted(self.index['begsample'], endsample, side='right') - 1
+        timestamps = []
+        data = []
+        for chunk in range(max(begchunk, 0), endchunk + 1):
+            t, d = self.readChunk(chunk)
+            timestamps.append(t)
+            data.append(d)
+        offset = begsample - int(self.index['begsample'][max(begchunk, 0)])
+        timestamps = np.concatenate(timestamps)[offset:(offset + endsample - begsample + 1)]
+        data = np.concatenate(data)[offset:(offset + endsample - begsample + 1)]
+        return timestamps, data
+
+    def readSamples(self, channel, begsample, endsample):
+        # the channel can be a single index, in which case a vector is returned
+        # or a list of indices, in which case a samples x channels array is returned
+        timestamps, data = self.readChunks(begsample, endsample)
+        return data[:, channel]
+
+    def readTimestamps(self, begsample, endsample):
+        timestamps, data = self.readChunks(begsample, endsample)
+        return timestamps
+
+####################################################################################################
+# the following are a number of helper functions to make the behaviour of this reader
+# the same as the EDFReader
+####################################################################################################
+
+    def getSignalTextLabels(self):
+        return self.labels
+
+    def getNSignals(self):
+        return self.nchans
+
+    def getSignalFreqs(self):
+        return np.array([self.fsample] * self.nchans)
+
+    def getNSamples(self):
+        if len(self.index):
+            nsamples = int(self.index['begsample'][-1] + self.index['nsamples'][-1])
+        else:
+            nsamples = 0
+        return np.array([nsamples] * self.nchans)
+
+    def readSignal(self, chanindx):
+        begsample = 0
+        endsample = self.getNSamples()[0] - 1
+        return self.readSamples(chanindx, begsample, endsample)
@@ -0,0 +1,88 @@
+import re
+import numpy as np
+
+####################################################################################################
+# This maps the control values from Redis onto a DMX frame. The channels are specified in the input
+# section of the ini file as channel001 up to channel512, the scale and offset sections can specify
+# a number or a Redis key for each channel. The mapping is determined once, after which the Redis
+# keys of all channels are fetched in a single request for every frame, and the values are scaled,
+# limited and converted to bytes all at once.
+
+
+def tofloat(val):
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class DMXFrame():
+    """
+    frame = DMX.DMXFrame(patch, size=None, minsize=0)
+    frame.update()  - get the values from Redis, returns the indices of the channels that changed
+    frame.data      - the frame as numpy uint8 array, which can be converted with bytes(frame.data)
+    frame.clear()   - set all channels to zero
+
+    The size of the frame is determined by the last channel in the ini file, unless specified.
+    """
+
+    def __init__(self, patch, size=None, minsize=0):
+        self.patch = patch
+
+        channels = []
+        for item in patch.config.items('input'):
+            match = re.fullmatch('channel([0-9]{3})', item[0])
+            if match and 1 <= int(match.group(1)) <= 512:
+                channels.append(int(match.group(1)) - 1)
+
+        if size == None:
+            # the last channel determines the size
+            size = max(channels + [-1]) + 1
+        self.size = max(size, minsize)
+        self.data = np.zeros(self.size, dtype=np.uint8)
+
+        # the rows contain the input value, the scale and the offset of each channel
+        self.default = np.array([np.nan, 255., 0.])[:, np.newaxis] * np.ones((1, self.size))
+        self.constant = self.default.copy()
+        self.keys = []      # the Redis keys that are fetched for each frame
+        self.index = []     # the position of their values in the constant array
+
+        for chanindx in channels:
+            if chanindx >= self.size:
+                continue
+            chanstr = "channel%03d" % (chanindx + 1)
+            for row, section in enumerate(['input', 'scale', 'offset']):
+                source, parsed = patch.parse(section, chanstr, False, float)
+                if source == 'args':
+                    self.constant[row, chanindx] = parsed
+                elif source == 'ini':
+                    value, key = parsed[0]
+                    if key == None:
+                        self.constant[row, chanindx] = value
+                    else:
+                        self.keys.append(key)
+                        self.index.append(row * self.size + chanindx)
+        self.index = np.array(self.index, dtype=int)
+
+        # in reactive mode the loop should also wake up when these change
+        patch.watch(self.keys)
+
+    def update(self):
+        values = self.constant.copy()
+        if len(self.keys):
+            values.flat[self.index] = [tofloat(val) for val in self.patch.redis.mget(self.keys)]
+            # the scale and offset fall back to their default when not present in Redis
+            missing = np.isnan(values)
+            values[missing] = self.default[missing]
+
+        # the channels without input value remain as they are
+        present = np.logical_not(np.isnan(values[0]))
+        frame = self.data.copy()
+        frame[present] = np.clip(values[1, present] * values[0, present] + values[2, present], 0, 255).astype(np.uint8)
+
+        changed = np.flatnonzero(frame != self.data)
+        self.data = frame
+        return changed
+
+    def clear(self):
+        self.data = np.zeros(self.size, dtype=np.uint8)
@@ -15,8 +15,16 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import sys
 import time
 
+# the lib directory contains shared code
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(path, ".."))
+
+from lib.RedisPipeline import pipeline
+
 
 ###################################################################################################
 class client():
@@ -32,9 +40,20 @@ class client():
     def publish(self, key, val):
         return 'OK'
 
+    def mget(self, keys, *args):
+        if isinstance(keys, str):
+            keys = [keys]
+        return [None] * (len(keys) + len(args))
+
+    def mset(self, mapping):
+        return True
+
     def pubsub(self):
         return pubsub()
 
+    def pipeline(self, transaction=False):
+        return pipeline(self)
+
     def exists(self, key):
         return False
 
@@ -47,6 +66,9 @@ class pubsub():
     def subscribe(self, channel):
         pass
 
+    def psubscribe(self, pattern):
+        pass
+
     def listen(self):
         time.sleep(1)
         return []
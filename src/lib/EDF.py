@@ -1,6 +1,4 @@
-from copy import deepcopy
 from math import ceil, floor
-from struct import pack, unpack
 import calendar
 import datetime
 import numpy as np
@@ -19,6 +17,28 @@ def padtrim(buf, num):
     # convert output from char to bytes
     return retval.encode()
 
+def encode(raw, data_size):
+    # convert the values into the raw bytes for the data section
+    if data_size==2:
+        # 16-bit little-endian integers
+        return np.asarray(raw, dtype=np.int16).astype('<i2').tobytes()
+    else:
+        # 24-bit little-endian integers, the most significant byte is dropped
+        raw = np.asarray(raw, dtype=np.int32).astype('<i4')
+        return raw.view(np.uint8).reshape(-1, 4)[:, 0:3].tobytes()
+
+def decode(buf, data_size):
+    # convert the raw bytes from the data section into integers
+    # the input is a uint8 array in which the last dimension has the bytes of all samples
+    if data_size==2:
+        # 16-bit little-endian integers
+        return np.ascontiguousarray(buf).view('<i2')
+    else:
+        # 24-bit little-endian integers, these need to be sign-extended
+        buf = buf.reshape(buf.shape[:-1] + (-1, 3)).astype(np.int32)
+        raw = buf[..., 0] | (buf[..., 1] << 8) | (buf[..., 2] << 16)
+        return (raw ^ 0x800000) - 0x800000
+
 ####################################################################################################
 # the EDF header is represented as a tuple of (meas_info, chan_info)
 # meas_info should have ['record_length', 'magic', 'hour', 'subject_id', 'recording_id', 'n_records', 'month', 'subtype', 'second', 'nchan', 'data_size', 'data_offset', 'lowpass', 'year', 'highpass', 'day', 'minute']
@@ -26,41 +46,36 @@ def padtrim(buf, num):
 ####################################################################################################
 
 class EDFWriter():
-    def __init__(self, fname=None):
+    def __init__(self, fname=None, buffersize=-1):
         self.fname = None
+        self.fid   = None
         self.meas_info = None
         self.chan_info = None
         self.calibrate = None
         self.offset    = None
         self.n_records = 0
         if fname:
-            self.open(fname)
-
-    def open(self, fname):
-        with open(fname, 'wb') as fid:
-            assert(fid.tell() == 0)
+            self.open(fname, buffersize)
+
+    def open(self, fname, buffersize=-1):
+        # the file remains open while writing, the data is written to disk in chunks of buffersize bytes
+        # a buffersize of -1 uses the default buffering, 0 writes each block to disk immediately
+        if buffersize==0:
+            self.fid = open(fname, 'wb', buffering=0)
+        else:
+            self.fid = open(fname, 'wb', buffering=max(buffersize, -1))
+        assert(self.fid.tell() == 0)
         self.fname = fname
 
+    def flush(self):
+        self.fid.flush()
+
     def close(self):
-        # it is still needed to update the number of records in the header
-        # this requires copying the whole file content
-        meas_info = self.meas_info
-        chan_info = self.chan_info
-        # update the n_records value in the file
-        tempname = self.fname + '.bak'
-        os.rename(self.fname, tempname)
-        with open(tempname, 'rb') as fid1:
-            assert(fid1.tell() == 0)
-            with open(self.fname, 'wb') as fid2:
-                assert(fid2.tell() == 0)
-                fid2.write(fid1.read(236))
-                fid1.read(8)                                    # skip this part
-                fid2.write(padtrim(str(self.n_records), 8))     # but write this instead
-                fid2.write(fid1.read(meas_info['data_offset'] - 236 - 8))
-                blocksize = np.sum(chan_info['n_samps']) * meas_info['data_size']
-                for block in range(self.n_records):
-                    fid2.write(fid1.read(blocksize))
-        os.remove(tempname)
+        # update the n_records value in the header, which starts at byte 236
+        self.fid.seek(236)
+        self.fid.write(padtrim(str(self.n_records), 8))
+        self.fid.close()
+        self.fid   = None
         self.fname = None
         self.meas_info = None
         self.chan_info = None
@@ -76,65 +91,70 @@ class EDFWriter():
         chan_size = 256 * meas_info['nchan']
         # note that the file is opened in binary mode, but the initial header is largely text
         # the padtrim function also converts the text to bytes
-        with open(self.fname, 'wb') as fid:
-            assert(fid.tell() == 0)
-
-            # fill in the missing or incomplete information
-            if not 'subject_id' in meas_info:
-                meas_info['subject_id'] = ''
-            if not 'recording_id' in meas_info:
-                meas_info['recording_id'] = ''
-            if not 'subtype' in meas_info:
-                meas_info['subtype'] = 'edf'
-            nchan = meas_info['nchan']
-            if not 'ch_names' in chan_info or len(chan_info['ch_names'])<nchan:
-                chan_info['ch_names'] = [str(i) for i in range(nchan)]
-            if not 'transducers' in chan_info or len(chan_info['transducers'])<nchan:
-                chan_info['transducers'] = ['' for i in range(nchan)]
-            if not 'units' in chan_info or len(chan_info['units'])<nchan:
-                chan_info['units'] = ['' for i in range(nchan)]
-
-            if meas_info['subtype'] in ('24BIT', 'bdf'):
-                meas_info['data_size'] = 3  # 24-bit (3 byte) integers
+        fid = self.fid
+        fid.seek(0)
+        fid.truncate()
+
+        # fill in the missing or incomplete information
+        if not 'subject_id' in meas_info:
+            meas_info['subject_id'] = ''
+        if not 'recording_id' in meas_info:
+            meas_info['recording_id'] = ''
+        if not 'subtype' in meas_info:
+            # this is consistent with the reader, which uses the file extension
+            if os.path.splitext(self.fname)[1][1:].lower()=='bdf':
+                meas_info['subtype'] = 'bdf'
             else:
-                meas_info['data_size'] = 2  # 16-bit (2 byte) integers
-
-            fid.write(padtrim('0', 8))
-            fid.write(padtrim(meas_info['subject_id'], 80))
-            fid.write(padtrim(meas_info['recording_id'], 80))
-            fid.write(padtrim('{:0>2d}.{:0>2d}.{:0>2d}'.format(meas_info['day'], meas_info['month'], meas_info['year']), 8))
-            fid.write(padtrim('{:0>2d}.{:0>2d}.{:0>2d}'.format(meas_info['hour'], meas_info['minute'], meas_info['second']), 8))
-            fid.write(padtrim(str(meas_size + chan_size), 8))
-            fid.write(' '.encode() * 44)
-            fid.write(padtrim(str(-1), 8))  # the final n_records should be inserted on byte 236
-            fid.write(padtrim(str(meas_info['record_length']), 8))
-            fid.write(padtrim(str(meas_info['nchan']), 4))
-
-            # ensure that these are all np arrays rather than lists
-            for key in ['physical_min', 'transducers', 'physical_max', 'digital_max', 'ch_names', 'n_samps', 'units', 'digital_min']:
-                chan_info[key] = np.asarray(chan_info[key])
-
-            for i in range(meas_info['nchan']):
-                fid.write(padtrim(    chan_info['ch_names'][i], 16))
-            for i in range(meas_info['nchan']):
-                fid.write(padtrim(    chan_info['transducers'][i], 80))
-            for i in range(meas_info['nchan']):
-                fid.write(padtrim(    chan_info['units'][i], 8))
-            for i in range(meas_info['nchan']):
-                fid.write(padtrim(str(chan_info['physical_min'][i]), 8))
-            for i in range(meas_info['nchan']):
-                fid.write(padtrim(str(chan_info['physical_max'][i]), 8))
-            for i in range(meas_info['nchan']):
-                fid.write(padtrim(str(chan_info['digital_min'][i]), 8))
-            for i in range(meas_info['nchan']):
-                fid.write(padtrim(str(chan_info['digital_max'][i]), 8))
-            for i in range(meas_info['nchan']):
-                fid.write(' '.encode() * 80) # prefiltering
-            for i in range(meas_info['nchan']):
-                fid.write(padtrim(str(chan_info['n_samps'][i]), 8))
-            for i in range(meas_info['nchan']):
-                fid.write(' '.encode() * 32) # reserved
-            meas_info['data_offset'] = fid.tell()
+                meas_info['subtype'] = 'edf'
+        nchan = meas_info['nchan']
+        if not 'ch_names' in chan_info or len(chan_info['ch_names'])<nchan:
+            chan_info['ch_names'] = [str(i) for i in range(nchan)]
+        if not 'transducers' in chan_info or len(chan_info['transducers'])<nchan:
+            chan_info['transducers'] = ['' for i in range(nchan)]
+        if not 'units' in chan_info or len(chan_info['units'])<nchan:
+            chan_info['units'] = ['' for i in range(nchan)]
+
+        if meas_info['subtype'] in ('24BIT', 'bdf'):
+            meas_info['data_size'] = 3  # 24-bit (3 byte) integers
+        else:
+            meas_info['data_size'] = 2  # 16-bit (2 byte) integers
+
+        fid.write(padtrim('0', 8))
+        fid.write(padtrim(meas_info['subject_id'], 80))
+        fid.write(padtrim(meas_info['recording_id'], 80))
+        fid.write(padtrim('{:0>2d}.{:0>2d}.{:0>2d}'.format(meas_info['day'], meas_info['month'], meas_info['year']), 8))
+        fid.write(padtrim('{:0>2d}.{:0>2d}.{:0>2d}'.format(meas_info['hour'], meas_info['minute'], meas_info['second']), 8))
+        fid.write(padtrim(str(meas_size + chan_size), 8))
+        fid.write(' '.encode() * 44)
+        fid.write(padtrim(str(-1), 8))  # the final n_records should be inserted on byte 236
+        fid.write(padtrim(str(meas_info['record_length']), 8))
+        fid.write(padtrim(str(meas_info['nchan']), 4))
+
+        # ensure that these are all np arrays rather than lists
+        for key in ['physical_min', 'transducers', 'physical_max', 'digital_max', 'ch_names', 'n_samps', 'units', 'digital_min']:
+            chan_info[key] = np.asarray(chan_info[key])
+
+        for i in range(meas_info['nchan']):
+            fid.write(padtrim(    chan_info['ch_names'][i], 16))
+        for i in range(meas_info['nchan']):
+            fid.write(padtrim(    chan_info['transducers'][i], 80))
+        for i in range(meas_info['nchan']):
+            fid.write(padtrim(    chan_info['units'][i], 8))
+        for i in range(meas_info['nchan']):
+            fid.write(padtrim(str(chan_info['physical_min'][i]), 8))
+        for i in range(meas_info['nchan']):
+            fid.write(padtrim(str(chan_info['physical_max'][i]), 8))
+        for i in range(meas_info['nchan']):
+            fid.write(padtrim(str(chan_info['digital_min'][i]), 8))
+        for i in range(meas_info['nchan']):
+            fid.write(padtrim(str(chan_info['digital_max'][i]), 8))
+        for i in range(meas_info['nchan']):
+            fid.write(' '.encode() * 80) # prefiltering
+        for i in range(meas_info['nchan']):
+            fid.write(padtrim(str(chan_info['n_samps'][i]), 8))
+        for i in range(meas_info['nchan']):
+            fid.write(' '.encode() * 32) # reserved
+        meas_info['data_offset'] = fid.tell()
 
         self.meas_info = meas_info
         self.chan_info = chan_info
@@ -147,28 +167,31 @@ class EDFWriter():
               self.offset[ch]    = 0;
 
     def writeBlock(self, data):
+        # the data can be a channels x samples array, or a list with one vector per channel
         meas_info = self.meas_info
         chan_info = self.chan_info
-        with open(self.fname, 'ab') as fid:
-            assert(fid.tell() > 0)
-            for i in range(meas_info['nchan']):
-                raw = deepcopy(data[i])
-                raw = np.asarray(raw, dtype=np.float64)
-
-                assert(len(raw)==chan_info['n_samps'][i])
-                if min(raw)<chan_info['physical_min'][i]:
-                    warnings.warn('Value exceeds physical_min: ' + str(min(raw)) );
-                if max(raw)>chan_info['physical_max'][i]:
-                    warnings.warn('Value exceeds physical_max: '+ str(max(raw)));
-
-                raw -= self.offset[i]  # FIXME I am not sure about the order of calibrate and offset
-                raw /= self.calibrate[i]
-
-                raw = np.asarray(raw, dtype=np.int16)
-                buf = [pack('h', x) for x in raw]
-                for val in buf:
-                    fid.write(val)
-            self.n_records += 1
+        if isinstance(data, np.ndarray) and data.ndim==2:
+            assert(data.shape[0]==meas_info['nchan'])
+            assert(all(data.shape[1]==chan_info['n_samps']))
+            raw = np.array(data, dtype=np.float64).reshape(-1)
+        else:
+            assert(len(data)==meas_info['nchan'])
+            assert(all([len(data[i])==chan_info['n_samps'][i] for i in range(meas_info['nchan'])]))
+            raw = np.concatenate([np.asarray(data[i], dtype=np.float64) for i in range(meas_info['nchan'])])
+
+        # the calibration is expanded to one value per sample in the record
+        physical_min = np.repeat(chan_info['physical_min'], chan_info['n_samps'])
+        physical_max = np.repeat(chan_info['physical_max'], chan_info['n_samps'])
+        if any(raw<physical_min):
+            warnings.warn('Value exceeds physical_min: ' + str(min(raw[raw<physical_min])) );
+        if any(raw>physical_max):
+            warnings.warn('Value exceeds physical_max: '+ str(max(raw[raw>physical_max])));
+
+        raw -= np.repeat(self.offset, chan_info['n_samps'])  # FIXME I am not sure about the order of calibrate and offset
+        raw /= np.repeat(self.calibrate, chan_info['n_samps'])
+
+        self.fid.write(encode(raw, meas_info['data_size']))
+        self.n_records += 1
 
 ####################################################################################################
 
@@ -179,6 +202,8 @@ class EDFReader():
         self.chan_info = None
         self.calibrate = None
         self.offset    = None
+        self.data      = None   # memory-mapped data section, records x bytes
+        self.start     = None   # the byte offset of each channel in a record
         if fname:
             self.open(fname)
 
@@ -195,6 +220,8 @@ class EDFReader():
         self.chan_info = None
         self.calibrate = None
         self.offset    = None
+        self.data      = None
+        self.start     = None
 
     def readHeader(self):
         # the following is copied over from MNE-Python and subsequently modified
@@ -302,37 +329,60 @@ class EDFReader():
 
         self.meas_info = meas_info
         self.chan_info = chan_info
+
+        # map the data section of the file into memory, this does not read anything yet
+        # each row contains one record, in which the samples of all channels follow each other
+        blocksize = int(np.sum(chan_info['n_samps'])) * meas_info['data_size']
+        n_records = min(meas_info['n_records'], int((os.path.getsize(self.fname) - meas_info['data_offset']) / blocksize))
+        self.start = np.concatenate(([0], np.cumsum(chan_info['n_samps']))) * meas_info['data_size']
+        if n_records>0:
+            self.data = np.memmap(self.fname, dtype=np.uint8, mode='r', offset=meas_info['data_offset'], shape=(n_records, blocksize))
+        else:
+            self.data = np.zeros((0, blocksize), dtype=np.uint8)
+
         return (meas_info, chan_info)
 
     def readBlock(self, block):
         assert(block>=0)
-        meas_info = self.meas_info
-        chan_info = self.chan_info
         data = []
-        with open(self.fname, 'rb') as fid:
-            assert(fid.tell() == 0)
-            blocksize = np.sum(chan_info['n_samps']) * meas_info['data_size']
-            fid.seek(meas_info['data_offset'] + block * blocksize)
-            for i in range(meas_info['nchan']):
-                buf = fid.read(chan_info['n_samps'][i]*meas_info['data_size'])
-                raw = np.asarray(unpack('<{}h'.format(chan_info['n_samps'][i]), buf), dtype=np.float32)
-                raw *= self.calibrate[i]
-                raw += self.offset[i]  # FIXME I am not sure about the order of calibrate and offset
-                data.append(raw)
+        for i in range(self.meas_info['nchan']):
+            raw = decode(self.data[block, self.start[i]:self.start[i+1]], self.meas_info['data_size']).astype(np.float32)
+            raw *= self.calibrate[i]
+            raw += self.offset[i]  # FIXME I am not sure about the order of calibrate and offset
+            data.append(raw)
         return data
 
     def readSamples(self, channel, begsample, endsample):
-        meas_info = self.meas_info
-        chan_info = self.chan_info
-        n_samps = chan_info['n_samps'][channel]
+        # the channel can be a single index, in which case a vector is returned
+        # or a list of indices, in which case a samples x channels array is returned
+        if np.isscalar(channel):
+            return self.readSamples([channel], begsample, endsample)[:, 0]
+        channel = np.asarray(channel, dtype=int)
+        n_samps = self.chan_info['n_samps'][channel]
+        if any(n_samps != n_samps[0]):
+            raise AssertionError('unequal SignalFreqs')
+        n_samps = int(n_samps[0])
+        data_size = self.meas_info['data_size']
         begblock = int(floor((begsample) / n_samps))
         endblock = int(floor((endsample) / n_samps))
-        data = self.readBlock(begblock)[channel]
-        for block in range(begblock+1, endblock+1):
-            data = np.append(data, self.readBlock(block)[channel])
+
+        # only the records that contain the requested samples are read from the file
+        records = self.data[begblock:(endblock+1)]
+        if all(np.diff(channel)==1) and all(np.diff(self.start[channel])==n_samps*data_size):
+            # the channels are adjacent in each record, so they can be sliced in one step
+            raw = records[:, self.start[channel[0]]:self.start[channel[-1]+1]]
+            raw = decode(raw, data_size).reshape(len(records), len(channel), n_samps)
+        else:
+            raw = np.stack([decode(records[:, self.start[i]:self.start[i+1]], data_size) for i in channel], axis=1)
+
+        # concatenate the records and select the requested samples
+        raw = raw.transpose(0, 2, 1).reshape(-1, len(channel))
         begsample -= begblock*n_samps
         endsample -= begblock*n_samps
-        return data[begsample:(endsample+1)]
+        data = raw[begsample:(endsample+1)].astype(np.float32)
+        data *= self.calibrate[channel]
+        data += self.offset[channel]  # FIXME I am not sure about the order of calibrate and offset
+        return data
 
 ####################################################################################################
 # the following are a number of helper functions to make the behaviour of this EDFReader
@@ -353,8 +403,9 @@ class EDFReader():
         return self.chan_info['n_samps'] * self.meas_info['n_records']
 
     def readSignal(self, chanindx):
+        # this also accepts a list of channels, in which case a samples x channels array is returned
         begsample = 0
-        endsample = self.chan_info['n_samps'][chanindx] * self.meas_info['n_records'] - 1
+        endsample = np.min(self.chan_info['n_samps'][chanindx]) * self.meas_info['n_records'] - 1
         return self.readSamples(chanindx, begsample, endsample)
 
 ####################################################################################################
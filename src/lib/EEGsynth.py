@@ -33,9 +33,14 @@ for i, dir in enumerate(sys.path):
         continue
 
 import configparser
+import ast
 import argparse
 import time
 import threading
+import collections
+import queue
+import heapq
+import traceback
 import math
 import numpy as np
 from scipy.signal import firwin, butter, bessel, lfilter, lfiltic, iirnotch
@@ -68,8 +73,9 @@ class patch():
     where the name and path point to the ini file. You can also
     pass the --inifile option on the command-line.
 
-    The following method sets and publishes the value to Redis
+    The following methods set and publish one or multiple values to Redis
       patch.setvalue(key, value)
+      patch.setvalues({key: value, ...})
 
     The following method gets the value (as a string) from the command-line
     arguments or from the ini file
@@ -81,6 +87,19 @@ class patch():
       patch.getint(section, item, multiple=False, default=None)
       patch.getstring(section, item, multiple=False, default=None)
 
+    The options are parsed only once. The following method gets the values of all
+    Redis keys that were used by getfloat and getint in a single request, this is
+    called by monitor.loop() on every iteration of the loop. Only the thread that runs the
+    loop uses these values, other threads get the values directly from Redis
+      patch.fetch()
+
+    The following method is used at the end of the loop instead of time.sleep(delay).
+    With the reactive option in the general section it waits until one of the Redis keys
+    that were used by getfloat and getint, or that were explicitly watched, is published.
+    It returns the keys that changed, with the loop running at most once per delay.
+      patch.wait(delay, timeout=1)
+      patch.watch(keys)
+
     The formatting of options on the command-line should be like this
       --section-item value
 
@@ -113,6 +132,7 @@ class patch():
         parser.add_argument("--general-debug", default=None, help="general debug")
         parser.add_argument("--general-delay", default=None, help="general delay")
         parser.add_argument("--general-logging", default=None, help="general logging")
+        parser.add_argument("--general-reactive", default=None, help="general reactive")
         args = parser.parse_args()
 
         config = configparser.ConfigParser(inline_comment_prefixes=('#', ';'))
@@ -190,6 +210,24 @@ class patch():
         self.config = config
         self.redis = r              # this can be redis, zeromq, fake or dummy
 
+        # these are used by getfloat and getint to speed up repeated calls
+        self.parsed = {}            # the options from the command-line arguments and ini file
+        self.keys = {}              # the Redis keys that are used, as an ordered set
+        self.snapshot = {}          # the values of these keys from the most recent fetch
+        self.snapshot_time = 0
+        self.snapshot_thread = None # the thread that runs the loop and fetches the snapshot
+        self.maxage = 1.0           # in seconds, the snapshot is not used if it is older
+        self.lock = threading.Lock()
+
+        # these are used by wait to run the loop only when the input values change
+        self.reactive = self.getint('general', 'reactive', default=0)
+        self.watched = {}           # additional Redis keys to watch, as an ordered set
+        self.listener = None        # the dispatcher that receives the changes
+        self.listening = []         # the Redis keys that the dispatcher subscribed to
+        self.changed = threading.Event()
+        self.changedkeys = set()
+        self.woken = 0
+
     ####################################################################
     def pubsub(self):
         return self.redis.pubsub()
@@ -208,10 +246,16 @@ class patch():
             return default
 
     ####################################################################
-    def getfloat(self, section, item, multiple=False, default=None):
+    def parse(self, section, item, multiple, convert):
+        # parse the option from the command-line arguments or the ini file, this is only done once
+        # it returns the source and either a value, or a list with (value, key) tuples where the key refers to Redis
+        spec = (section, item, multiple, convert)
+        if spec in self.parsed:
+            return self.parsed[spec]
+
         if section + "_" + item in self.args:
             # get it from the command-line arguments
-            return float(self.args[section + "_" + item])
+            parsed = ('args', convert(self.args[section + "_" + item]))
         elif self.config.has_option(section, item) and len(self.config.get(section, item))>0:
             # get all items from the ini file, there might be one or multiple
             items = self.config.get(section, item)
@@ -233,103 +277,82 @@ class patch():
                 # make a list with a single item
                 items = [items]
 
-            # set the default
-            if multiple and isinstance(default, list):
-                val = [float(x) for x in default]
-            elif default != None:
-                val = [float(default)] * len(items)
-            else:
-                val = [default] * len(items)
-
-            # convert the strings into floating point values
-            for i,item in enumerate(items):
+            values = []
+            for item in items:
                 try:
                     # if it resembles a value, use that
-                    val[i] = float(item)
+                    values.append((convert(item), None))
                 except ValueError:
                     # if it is a string, get the value from Redis
-                    try:
-                        val[i] = float(self.redis.get(item))
-                    except TypeError:
-                        pass
+                    values.append((None, item))
+            parsed = ('ini', values)
         else:
             # the configuration file does not contain the item
-            if multiple and isinstance(default, list):
-                val = [float(x) for x in default]
-            elif multiple and default == None:
-                val = []
-            elif multiple and default != None:
-                val = [float(default)]
-            elif not multiple and default == None:
-                val = default
-            elif not multiple and default != None:
-                val = float(default)
+            parsed = ('default', None)
 
-        if multiple and not isinstance(val, list):
-            # return a list
-            return [val]
-        elif not multiple and isinstance(val, list):
-            # return a single value
-            return val[0]
-        else:
-            return val
+        self.parsed[spec] = parsed
+        return parsed
 
     ####################################################################
-    def getint(self, section, item, multiple=False, default=None):
-        if section + "_" + item in self.args:
-            return int(self.args[section + "_" + item])
-        elif self.config.has_option(section, item) and len(self.config.get(section, item))>0:
-            # get all items from the ini file, there might be one or multiple
-            items = self.config.get(section, item)
+    def lookup(self, key):
+        # get the value from the most recent fetch, or otherwise directly from Redis
+        # the snapshot is only used in the loop that fetched it, other threads such as trigger
+        # handlers get the current value, since they do not know when the snapshot was taken
+        if self.snapshot_thread in (None, threading.get_ident()):
+            if key in self.snapshot and (time.time() - self.snapshot_time) < self.maxage:
+                return self.snapshot[key]
+            with self.lock:
+                # include it in the next fetch
+                self.keys[key] = None
+        return self.redis.get(key)
 
-            if multiple:
-                # convert the items to a list
-                if items.find(",") > -1:
-                    separator = ","
-                elif items.find("-") > -1:
-                    separator = "-"
-                elif items.find("\t") > -1:
-                    separator = "\t"
-                else:
-                    separator = " "
-                items = squeeze(' ', items)        # remove excess whitespace
-                items = squeeze(separator, items)  # remove double separators
-                items = items.split(separator)     # split on the separator
-            else:
-                # make a list with a single item
-                items = [items]
+    ####################################################################
+    def fetch(self):
+        # get the values of all Redis keys that are used by getfloat and getint in a single request
+        with self.lock:
+            keys = list(self.keys)
+        if len(keys)==0:
+            return
+        values = self.redis.mget(keys)
+        self.snapshot = dict(zip(keys, values))
+        self.snapshot_time = time.time()
+        self.snapshot_thread = threading.get_ident()
+
+    ####################################################################
+    def getvalue(self, section, item, multiple, default, convert, convertredis):
+        (source, parsed) = self.parse(section, item, multiple, convert)
 
+        if source == 'args':
+            return parsed
+        elif source == 'ini':
             # set the default
             if multiple and isinstance(default, list):
-                val = [int(x) for x in default]
+                val = [convert(x) for x in default]
             elif default != None:
-                val = [int(default)] * len(items)
+                val = [convert(default)] * len(parsed)
             else:
-                val = [default] * len(items)
+                val = [default] * len(parsed)
 
-            # convert the strings into integer values
-            for i,item in enumerate(items):
-                try:
-                    # if it resembles a value, use that
-                    val[i] = int(item)
-                except ValueError:
-                    # if it is a string, get the value from Redis
+            for i,(value,key) in enumerate(parsed):
+                if key is None:
+                    val[i] = value
+                else:
                     try:
-                        val[i] = int(round(float(self.redis.get(item))))
+                        val[i] = convertredis(self.lookup(key))
                     except TypeError:
                         pass
         else:
             # the configuration file does not contain the item
             if multiple and isinstance(default, list):
-                val = [int(x) for x in default]
+                val = [convert(x) for x in default]
             elif multiple and default == None:
                 val = []
             elif multiple and default != None:
-                val = [int(default)]
+                val = [convert(default)]
             elif not multiple and default == None:
                 val = default
             elif not multiple and default != None:
-                val = int(default)
+                val = convert(default)
 
         if multiple and not isinstance(val, list):
             # return a list
@@ -340,6 +363,14 @@ class patch():
         else:
             return val
 
+    ####################################################################
+    def getfloat(self, section, item, multiple=False, default=None):
+        return self.getvalue(section, item, multiple, default, float, float)
+
+    ####################################################################
+    def getint(self, section, item, multiple=False, default=None):
+        return self.getvalue(section, item, multiple, default, int, roundint)
+
     ####################################################################
     def getstring(self, section, item, multiple=False, default=None):
         if section + "_" + item in self.args:
@@ -390,7 +421,55 @@ class patch():
             return self.config.has_option(section, item)
 
     ####################################################################
-    def setvalue(self, item, val, duration=0):
+    def watch(self, keys):
+        # also wake up when these Redis keys are published, e.g. when they are not used by getfloat or getint
+        with self.lock:
+            for key in keys:
+                self.watched[key] = None
+
+    ####################################################################
+    def notify(self, item):
+        # this is called by the dispatcher when one of the Redis keys is published
+        with self.lock:
+            self.changedkeys.add(item['channel'])
+            if item['channel'] in self.snapshot:
+                self.snapshot[item['channel']] = item['data']
+        self.changed.set()
+
+    ####################################################################
+    def wait(self, delay, timeout=1):
+        if not self.reactive:
+            time.sleep(delay)
+            return None
+
+        with self.lock:
+            keys = list(dict.fromkeys(list(self.keys) + list(self.watched)))
+        if keys != self.listening:
+            # subscribe to the keys that are currently used, this is only needed when they change
+            if self.listener != None:
+                self.listener.stop()
+            self.listener = dispatcher(self)
+            for key in keys:
+                self.listener.subscribe(key, self.notify)
+            self.listener.start()
+            self.listening = keys
+            # changes that happened while subscribing would otherwise be missed
+            self.changed.set()
+
+        # do not run the loop more often than once per delay, the changes in the meantime are combined
+        naptime = self.woken + delay - time.monotonic()
+        if naptime > 0:
+            time.sleep(naptime)
+        self.changed.wait(timeout)
+        self.changed.clear()
+        self.woken = time.monotonic()
+        with self.lock:
+            changedkeys = self.changedkeys
+            self.changedkeys = set()
+        return changedkeys
+
+    ####################################################################
+    def pythonvalue(self, val):
         # map numpy types onto plain Python types, see https://github.com/eegsynth/eegsynth/issues/429
         if isinstance(val, (np.float32, np.float64)):
             val = float(val)
@@ -398,11 +477,31 @@ class patch():
             val = int(val)
         elif isinstance(val, np.bool):
             val = bool(val)
+        return val
+
+    def setvalue(self, item, val, duration=0):
+        val = self.pythonvalue(val)
         self.redis.set(item, val)      # set it as control channel
         self.redis.publish(item, val)  # send it as trigger
+        if item in self.snapshot:
+            # subsequent calls to getfloat and getint should return the new value
+            self.snapshot[item] = val
         if duration > 0:
             # switch off after a certain amount of time
-            threading.Timer(duration, self.setvalue, args=[item, 0.]).start()
+            getscheduler().schedule(duration, self.setvalue, args=[item, 0.])
+
+    def setvalues(self, mapping):
+        # this is like setvalue, but for multiple items that are sent in a single round trip
+        mapping = {item: self.pythonvalue(val) for item, val in mapping.items()}
+        pipe = self.redis.pipeline(transaction=False)
+        for item, val in mapping.items():
+            pipe.set(item, val)        # set it as control channel
+            pipe.publish(item, val)    # send it as trigger
+        pipe.execute()
+        for item, val in mapping.items():
+            if item in self.snapshot:
+                # subsequent calls to getfloat and getint should return the new value
+                self.snapshot[item] = val
 
 ###################################################################################################
 class monitor():
@@ -509,6 +608,10 @@ Press Ctrl-C to stop this module.
     def loop(self, feedback=1.0, duration=None):
         now = time.time()
 
+        if self.patch:
+            # get the values of the Redis keys that are used as parameters in a single request
+            self.patch.fetch()
+
         if self.loop_time is None:
             self.success("starting loop...")
             self.loop_time = now
@@ -598,6 +701,327 @@ Press Ctrl-C to stop this module.
             self.logger.log(logging.TRACE, " ".join(map(format, args)))
 
 
+###################################################################################################
+class pacer():
+    """Class to play back samples at a fixed rate. The moment at which each block is due
+    is computed from a monotonic clock and the number of samples that were played since the
+    start, so that small errors in the timing of the loop do not accumulate over time.
+
+    pacer.wait()           - sleep until the next sample is due, returns the number of samples that are due
+    pacer.advance(n)       - to be called after n samples have been played
+    pacer.reset(rate)      - start counting again, e.g. after a pause or when the rate changes
+    pacer.statistics()     - returns the achieved rate and the mean and standard deviation of the lateness
+    """
+
+    def __init__(self, rate):
+        self.lateness = collections.deque(maxlen=1000)
+        self.reset(rate)
+
+    def reset(self, rate=None):
+        if rate != None:
+            self.rate = rate
+        # the counting starts at the next call to wait()
+        self.start = None
+        self.count = 0
+        self.achieved = 0.
+        self.lateness.clear()
+
+    def wait(self):
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+        deadline = self.start + self.count / self.rate
+        if now < deadline:
+            time.sleep(deadline - now)
+            now = time.monotonic()
+        self.lateness.append(now - deadline)
+        if now > self.start:
+            # the samples that were played so far, relative to the time it took
+            self.achieved = self.count / (now - self.start)
+        # the sample at the deadline and all that became due since then
+        return int((now - deadline) * self.rate) + 1
+
+    def advance(self, n):
+        self.count += n
+
+    def statistics(self):
+        if len(self.lateness) == 0:
+            return (0., 0., 0.)
+        return (self.achieved, np.mean(self.lateness), np.std(self.lateness))
+
+
+###################################################################################################
+class dispatcher(threading.Thread):
+    """Class to receive the messages on multiple Redis channels over a single connection and
+    to pass them on to the callback functions that are registered for these channels. Callbacks
+    that take long are executed by a shared pool of worker threads, the others are executed
+    directly by the thread that receives the messages. The messages on a channel are always
+    handled by the same worker, hence the slow callbacks for a channel are executed in order.
+
+    dispatcher = EEGsynth.dispatcher(patch, monitor=None, workers=4)
+    dispatcher.subscribe(channel, callback, slow=False)  - the callback is called with the message as argument
+    dispatcher.start()                                   - start receiving messages
+    dispatcher.stop()                                    - stop and wait for the threads to finish
+
+    All channels should be subscribed to prior to calling start().
+    """
+
+    def __init__(self, patch, monitor=None, workers=4):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.patch = patch
+        self.monitor = monitor
+        self.callbacks = {}
+        # each dispatcher has its own channel to unblock the Redis listen command
+        self.unblock = 'DISPATCHER_UNBLOCK_' + uuid(8)
+        # each worker has its own queue
+        self.queues = [queue.Queue() for i in range(workers)]
+        self.workers = [threading.Thread(target=self.work, args=[q], daemon=True) for q in self.queues]
+        self.assigned = {}  # the queue of the worker that handles each channel
+        self.running = True
+
+    def subscribe(self, channel, callback, slow=False):
+        if not channel in self.callbacks:
+            self.callbacks[channel] = []
+        self.callbacks[channel].append((callback, slow))
+        if slow and not channel in self.assigned:
+            # the channels are distributed over the workers
+            self.assigned[channel] = self.queues[len(self.assigned) % len(self.queues)]
+
+    def start(self):
+        if any([slow for callbacks in self.callbacks.values() for callback, slow in callbacks]):
+            # the workers are only needed for the slow callbacks
+            for worker in self.workers:
+                worker.start()
+        threading.Thread.start(self)
+
+    def stop(self):
+        self.running = False
+        self.patch.publish(self.unblock, 1)
+        for q in self.queues:
+            q.put(None)
+        if self.is_alive():
+            self.join()
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.join()
+
+    def call(self, callback, item):
+        try:
+            callback(item)
+        except Exception as e:
+            if self.monitor == None:
+                raise
+            self.monitor.error('error while handling %s: %s' % (item['channel'], e))
+
+    def work(self, jobs):
+        while True:
+            job = jobs.get()
+            if job == None:
+                break
+            self.call(*job)
+
+    def run(self):
+        pubsub = self.patch.pubsub()
+        pubsub.subscribe(self.unblock)
+        for channel in self.callbacks:
+            pubsub.subscribe(channel)
+        while self.running:
+            for item in pubsub.listen():
+                if not self.running:
+                    break
+                if not item['type'] == 'message' or not item['channel'] in self.callbacks:
+                    continue
+                for callback, slow in self.callbacks[item['channel']]:
+                    if slow:
+                        self.assigned[item['channel']].put((callback, item))
+                    else:
+                        self.call(callback, item)
+
+
+###################################################################################################
+class event():
+    """Class for a function call that is scheduled to be executed at a later moment, see scheduler
+    """
+
+    def __init__(self, deadline, function, args):
+        self.deadline = deadline
+        self.function = function
+        self.args = args
+        self.active = True
+
+    def cancel(self):
+        self.active = False
+
+    def __lt__(self, other):
+        return self.deadline < other.deadline
+
+
+###################################################################################################
+class scheduler(threading.Thread):
+    """Class to execute function calls after a certain delay. All scheduled calls are kept in a
+    heap that is sorted on the deadline and are executed in a single thread, rather than using a
+    separate thread for each, as with threading.Timer. The deadlines are computed from a monotonic
+    clock.
+
+    scheduler.schedule(delay, function, args=[])  - returns an event that can be cancelled
+    scheduler.cancel(event)                       - cancel the event, this is the same as event.cancel()
+    scheduler.statistics()                        - returns the number of pending events and the mean and maximum lateness
+    scheduler.stop()                              - stop the thread, pending events are not executed
+
+    The scheduler that is shared by all code in the process is returned by
+      EEGsynth.getscheduler()
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.heap = []
+        self.condition = threading.Condition()
+        self.lateness = collections.deque(maxlen=1000)
+        self.running = True
+
+    def schedule(self, delay, function, args=[]):
+        this = event(time.monotonic() + delay, function, args)
+        with self.condition:
+            heapq.heappush(self.heap, this)
+            if self.heap[0] is this:
+                # the thread should wake up earlier than it planned
+                self.condition.notify()
+        return this
+
+    def cancel(self, this):
+        # the event remains in the heap but will be skipped
+        this.cancel()
+
+    def statistics(self):
+        with self.condition:
+            pending = len([this for this in self.heap if this.active])
+        if len(self.lateness) == 0:
+            return (pending, 0., 0.)
+        return (pending, np.mean(self.lateness), np.max(self.lateness))
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                this = None
+                while self.running and this == None:
+                    # remove the cancelled events from the top of the heap
+                    while len(self.heap) and not self.heap[0].active:
+                        heapq.heappop(self.heap)
+                    if len(self.heap) == 0:
+                        self.condition.wait()
+                    elif self.heap[0].deadline > time.monotonic():
+                        self.condition.wait(self.heap[0].deadline - time.monotonic())
+                    else:
+                        this = heapq.heappop(self.heap)
+                if not self.running:
+                    break
+                this.active = False
+            # the function is called outside the lock, it might schedule another event
+            self.lateness.append(time.monotonic() - this.deadline)
+            try:
+                this.function(*this.args)
+            except Exception:
+                traceback.print_exc()
+
+
+def getscheduler():
+    # the scheduler is started when it is needed for the first time, after that it is shared
+    global _scheduler
+    with _schedulerlock:
+        if _scheduler == None:
+            _scheduler = scheduler()
+            _scheduler.start()
+    return _scheduler
+
+_scheduler = None
+_schedulerlock = threading.Lock()
+
+
+###################################################################################################
+class expression():
+    """Class for one or multiple equations that are parsed and compiled once, after which they
+    can be evaluated many times with different values for the variables. Only numbers, the
+    variables, arithmetic, comparison and logical operators, and a limited set of functions
+    are allowed in the equations.
+
+    equations = EEGsynth.expression(equations, variables, functions={})
+    equations.evaluate(values)  - returns a list with the result of each equation, the values of the variables are passed as a dictionary
+    equations.names             - the variables that are used in the equations
+    equations.errors            - the index and exception of the equations that failed in the last evaluation
+
+    All equations are evaluated together. If one of them fails, they are evaluated one by one
+    and the result of the failing ones is nan.
+    """
+
+    def __init__(self, equations, variables, functions={}):
+        if isinstance(equations, str):
+            equations = [equations]
+        self.equations = list(equations)
+        self.variables = list(variables)
+        self.names = []
+        self.errors = []
+
+        # these are the only functions and constants that can be used in the equations
+        self.scope = {'__builtins__': {}}
+        self.scope.update({'abs': abs, 'min': min, 'max': max, 'round': round, 'int': int, 'float': float})
+        self.scope.update({'log': np.log, 'log2': np.log2, 'log10': np.log10, 'exp': np.exp, 'power': np.power, 'sqrt': np.sqrt})
+        self.scope.update({'mean': np.mean, 'median': np.median, 'var': np.var, 'std': np.std, 'mod': np.mod})
+        self.scope.update({'compress': compress, 'limit': limit, 'rescale': rescale, 'normalizerange': normalizerange, 'normalizestandard': normalizestandard})
+        self.scope.update({'nan': np.nan, 'inf': np.inf, 'pi': np.pi})
+        self.scope.update(functions)
+
+        body = []
+        for equation in self.equations:
+            try:
+                tree = ast.parse(equation.strip(), mode='eval')
+            except SyntaxError:
+                raise ValueError('invalid equation: %s' % equation)
+            self.check(tree, equation)
+            body.append(tree.body)
+        self.code = [compile(ast.Expression(node), '<equation>', 'eval') for node in body]
+        # all equations are also compiled into a single tuple, so that they can be evaluated at once
+        tree = ast.fix_missing_locations(ast.Expression(ast.Tuple(body, ast.Load())))
+        self.combined = compile(tree, '<equations>', 'eval')
+
+    def check(self, tree, equation):
+        allowed = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Call, ast.keyword, ast.Name, ast.Constant, ast.Tuple, ast.List, ast.Load, ast.operator, ast.unaryop, ast.boolop, ast.cmpop)
+        for node in ast.walk(tree):
+            if not isinstance(node, allowed):
+                raise ValueError('%s is not allowed in equation: %s' % (type(node).__name__, equation))
+            if isinstance(node, ast.Call) and not isinstance(node.func, ast.Name):
+                raise ValueError('invalid function call in equation: %s' % equation)
+            if isinstance(node, ast.Name):
+                if node.id in self.variables:
+                    if not node.id in self.names:
+                        self.names.append(node.id)
+                elif not node.id in self.scope or node.id == '__builtins__':
+                    raise ValueError('unknown name %s in equation: %s' % (node.id, equation))
+
+    def evaluate(self, values):
+        self.errors = []
+        try:
+            return [float(val) for val in eval(self.combined, self.scope, values)]
+        except Exception:
+            pass
+        result = []
+        for index, code in enumerate(self.code):
+            try:
+                result.append(float(eval(code, self.scope, values)))
+            except Exception as e:
+                result.append(np.nan)
+                self.errors.append((index, e))
+        return result
+
+
 ###################################################################################################
 class RedisLogger(logging.Handler):
     """Class to send logging messages to Redis
@@ -717,6 +1141,10 @@ def compress(xval, lo=0.5, hi=0.5, range=1.0):
 
         return yval
 
+####################################################################
+def roundint(xval):
+    return int(round(float(xval)))
+
 ####################################################################
 def normalizerange(xval, min, max):
     min = float(min)
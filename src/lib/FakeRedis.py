@@ -15,8 +15,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import sys
 import threading
 import time
+import fnmatch
+
+# the lib directory contains shared code
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(path, ".."))
+
+from lib.RedisPipeline import pipeline
 
 store = {}
 latest = None
@@ -44,9 +53,22 @@ class client():
         store[key] = val
         latest = key
 
+    def mget(self, keys, *args):
+        if isinstance(keys, str):
+            keys = [keys]
+        return [self.get(key) for key in list(keys) + list(args)]
+
+    def mset(self, mapping):
+        for key, val in mapping.items():
+            self.set(key, val)
+        return True
+
     def pubsub(self):
         return pubsub()
 
+    def pipeline(self, transaction=False):
+        return pipeline(self)
+
     def exists(self, key):
         return key in store
 
@@ -54,13 +76,17 @@ class client():
 class pubsub():
     def __init__(self):
         self.subscribed = []
+        self.patterns = []
 
     def subscribe(self, key):
         self.subscribed.append(key)
 
+    def psubscribe(self, pattern):
+        self.patterns.append(pattern)
+
     def listen(self):
         global store, latest
-        while not latest in self.subscribed:
+        while not latest in self.subscribed and not any([fnmatch.fnmatchcase(str(latest), x) for x in self.patterns]):
             time.sleep(0.1)
         item = dict()
         item['type'] = 'message'
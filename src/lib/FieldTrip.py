@@ -91,13 +91,20 @@ wordSize = [1, 1, 2, 4, 8, 1, 2, 4, 8, 4, 8]
 dataType = [-1, 5, 1, 6, 2, -1, -1, 7, 3, 8, 4, 9, 10]
 
 
+def sharedname(port):
+    """
+    Returns the name of the shared memory segment of the buffer server on the given port.
+    """
+    return 'fieldtrip_%d' % port
+
+
 def serialize(A):
     """
     Returns FieldTrip data type and string representation of the given
     object, if possible.
     """
     if isinstance(A, str):
-        return (0, A)
+        return (0, A.encode('utf-8'))
 
     if isinstance(A, numpy.ndarray):
         dt = A.dtype
@@ -110,11 +117,11 @@ def serialize(A):
 
         if A.flags['C_CONTIGUOUS']:
             # great, just use the array's buffer interface
-            return (ft, A.tostring())
+            return (ft, A.tobytes())
 
         # otherwise, we need a copy to C order
         AC = A.copy('C')
-        return (ft, AC.tostring())
+        return (ft, AC.tobytes())
 
     if isinstance(A, int):
         return (DATATYPE_INT32, struct.pack('i', A))
@@ -188,20 +195,20 @@ class Event:
         sv = value_numel * wordSize[value_type]
 
         if bsiz + 32 > bufsize or st + sv > bsiz:
-             IOError(
+            raise IOError(
                 'Invalid event definition -- does not fit in given buffer')
 
         raw_type = buf[32:32 + st]
         raw_value = buf[32 + st:32 + st + sv]
 
         if type_type == 0:
-            self.type = raw_type
+            self.type = raw_type.decode('utf-8')
         else:
             self.type = numpy.ndarray(
                 (type_numel), dtype=numpyType[type_type], buffer=raw_type)
 
         if value_type == 0:
-            self.value = raw_value
+            self.value = raw_value.decode('utf-8')
         else:
             self.value = numpy.ndarray(
                 (value_numel), dtype=numpyType[value_type], buffer=raw_value)
@@ -217,13 +224,13 @@ class Event:
         if type_type == DATATYPE_UNKNOWN:
             return None
         type_size = len(type_buf)
-        type_numel = type_size / wordSize[type_type]
+        type_numel = type_size // wordSize[type_type]
 
         value_type, value_buf = serialize(self.value)
         if value_type == DATATYPE_UNKNOWN:
             return None
         value_size = len(value_buf)
-        value_numel = value_size / wordSize[value_type]
+        value_numel = value_size // wordSize[value_type]
 
         bufsize = type_size + value_size
 
@@ -244,10 +251,13 @@ class Client:
     def __init__(self):
         self.isConnected = False
         self.sock = []
+        self.shared = None
 
-    def connect(self, hostname, port=1972):
+    def connect(self, hostname, port=1972, shared=False):
         """
-        connect(hostname [, port]) -- make a connection, default port is 1972.
+        connect(hostname [, port, shared]) -- make a connection, default port is 1972.
+        With shared=True and a server on the local host, the header and data are read
+        from shared memory if the server makes them available, otherwise over TCP.
         """
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -255,6 +265,9 @@ class Client:
         self.sock.setblocking(True)
         self.isConnected = True
 
+        if shared and hostname in ('localhost', '127.0.0.1') and RingBuffer.shared_memory is not None:
+            self.shared = RingBuffer.SharedReader(sharedname(port))
+
     def disconnect(self):
         """disconnect() -- close a connection."""
 
@@ -262,6 +275,9 @@ class Client:
             self.sock.close()
             self.sock = []
             self.isConnected = False
+        if self.shared is not None:
+            self.shared.detach()
+            self.shared = None
 
     def sendRaw(self, request):
         """Send all bytes of the string 'request' out to socket."""
@@ -299,21 +315,87 @@ class Client:
             raise IOError('Bad response from buffer server - disconnecting')
 
         if bufsize > 0:
-            payload = self.sock.recv(bufsize)
-            while len(payload) < bufsize:
-                payload += self.sock.recv(bufsize - len(payload))
+            # receive directly into the payload, this avoids repeated concatenation
+            payload = bytearray(bufsize)
+            view = memoryview(payload)
+            nr = 0
+            while nr < bufsize:
+                n = self.sock.recv_into(view[nr:], bufsize - nr)
+                if n == 0:
+                    self.disconnect()
+                    raise IOError('Connection closed by buffer server')
+                nr += n
         else:
             payload = None
         return (command, bufsize, payload)
 
+    def pipeline(self, requests):
+        """
+        pipeline(requests) -- send multiple requests back to back and collect the
+        responses in the same order. Each request is a (command, payload) tuple,
+        the payload can be None. Returns a list of (status, bufsize, payload).
+        This costs a single round trip to the server rather than one per request.
+        """
+
+        buf = b''
+        for command, payload in requests:
+            if payload is None:
+                buf += struct.pack('HHI', VERSION, command, 0)
+            else:
+                buf += struct.pack('HHI', VERSION, command, len(payload)) + payload
+        self.sendRaw(buf)
+
+        return [self.receiveResponse() for request in requests]
+
+    def waitData(self, index, timeout):
+        """
+        waitData(indices, timeout) -- wait until the data samples are available and
+        retrieve them together with the header, all in a single round trip. The
+        'indices' argument must be a tuple or list with inclusive, zero-based
+        start/end indices, the timeout is in milliseconds. Returns a Header object
+        and a Numpy array, or None for the data if it is not available in time.
+        """
+
+        if self.shared is not None and self.shared.attach():
+            H = self.getHeader()
+            if H.nSamples > int(index[1]):
+                # the data is already available in shared memory, no need to wait
+                return (H, self.getData(index))
+
+        (wait, hdr, dat) = self.pipeline([
+            (WAIT_DAT, struct.pack('III', int(index[1]), 0xFFFFFFFF, int(timeout))),
+            (GET_HDR, None),
+            (GET_DAT, struct.pack('II', int(index[0]), int(index[1]))),
+        ])
+        if wait[0] != WAIT_OK:
+            raise IOError('Wait request failed.')
+        return (self.parseHeader(*hdr), self.parseData(*dat))
+
     def getHeader(self):
         """
         getHeader() -- grabs header information from the buffer an returns
         it as a Header object.
         """
 
+        if self.shared is not None:
+            hdr = self.shared.readheader()
+            if hdr is not None:
+                H = Header()
+                H.nChannels = hdr['nchans']
+                H.nSamples = hdr['count']
+                H.nEvents = hdr['nevents']
+                H.fSample = hdr['fsample']
+                H.dataType = numpyType.index(numpy.dtype(hdr['dtype']).name, 1)
+                return H
+
         self.sendRequest(GET_HDR)
-        (status, bufsize, payload) = self.receiveResponse()
+        return self.parseHeader(*self.receiveResponse())
+
+    def parseHeader(self, status, bufsize, payload):
+        """
+        parseHeader(status, bufsize, payload) -- convert the response to a GET_HDR
+        request into a Header object.
+        """
 
         if status == GET_ERR:
             return None
@@ -408,15 +490,26 @@ class Client:
         start/end indices.
         """
 
+        if self.shared is not None and index is not None:
+            try:
+                D = self.shared.read(int(index[0]), int(index[1]) + 1)
+            except RuntimeError:
+                return None
+            if D is not None:
+                return D
+
         if index is None:
-            request = struct.pack('HHI', VERSION, GET_DAT, 0)
+            self.sendRequest(GET_DAT)
         else:
-            indS = int(index[0])
-            indE = int(index[1])
-            request = struct.pack('HHIII', VERSION, GET_DAT, 8, indS, indE)
-        self.sendRaw(request)
+            self.sendRequest(GET_DAT, struct.pack('II', int(index[0]), int(index[1])))
+        return self.parseData(*self.receiveResponse())
+
+    def parseData(self, status, bufsize, payload):
+        """
+        parseData(status, bufsize, payload) -- convert the response to a GET_DAT
+        request into a Numpy array, samples in rows.
+        """
 
-        (status, bufsize, payload) = self.receiveResponse()
         if status == GET_ERR:
             return None
 
@@ -485,11 +578,11 @@ class Client:
         if isinstance(E, Event):
             buf = E.serialize()
         else:
-            buf = ''
+            buf = b''
             num = 0
             for e in E:
                 if not(isinstance(e, Event)):
-                    raise 'Element %i in given list is not an Event' % num
+                    raise TypeError('Element %i in given list is not an Event' % num)
                 buf = buf + e.serialize()
                 num = num + 1
 
@@ -575,6 +668,11 @@ class Server():
         self.D = None
         self.E = None
         self.length = 600       # in seconds, ring buffer length
+        self.filename = None    # optional file in which the ring buffer is stored on disk
+        self.resumed = False    # whether the ring buffer was restored from disk and has not received a new header
+        self.shared = False     # whether the ring buffer is stored in shared memory for local clients
+        self.port = None
+        self.maxevents = 100000 # number of events in the ring buffer
         self.timeout = 1        # in seconds, this should be 0 if you want to loop over multiple servers
         self.keepalive = True   # whether to raise errors or keep running
 
@@ -590,6 +688,7 @@ class Server():
         lsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         lsock.bind((hostname, port))
+        self.port = port
         lsock.listen()
         print(f'Listening on {(hostname, port)}')
         lsock.setblocking(False)
@@ -597,6 +696,38 @@ class Server():
         self.sel.register(lsock, selectors.EVENT_READ, data = None)
         self.isConnected = True
 
+        if self.filename and not self.shared:
+            # continue with the data from the previous session
+            self.resume()
+
+
+    def resume(self):
+        """
+        resume() -- restore the header and data from the ring buffer on disk.
+        """
+
+        hdr = RingBuffer.readheader(self.filename)
+        if hdr is None:
+            return
+        try:
+            dataType = numpyType.index(numpy.dtype(hdr['dtype']).name, 1)
+        except ValueError:
+            return
+        if hdr['length'] != int(hdr['fsample'] * self.length):
+            print('Cannot resume from %s, the ring buffer length differs' % self.filename)
+            return
+
+        self.H = Header()
+        self.H.nChannels = hdr['nchans']
+        self.H.nSamples = hdr['count']
+        self.H.fSample = hdr['fsample']
+        self.H.dataType = dataType
+        self.flush_data()
+        self.D = RingBuffer.SampleBuffer(hdr['length'], hdr['nchans'], hdr['dtype'], filename=self.filename, fsample=hdr['fsample'], resume=True)
+        self.E = None
+        self.resumed = True
+        print('Resumed ring buffer with %d samples from %s' % (self.D.count, self.filename))
+
 
     def disconnect(self):
         if not self.isConnected:
@@ -609,6 +740,15 @@ class Server():
         self.sel.close()
         self.sel = None
         self.isConnected = False
+        self.flush_data()
+
+
+    def flush_data(self):
+        # this also releases the shared memory
+        if self.D != None:
+            self.D.close()
+            self.D = None
+        self.resumed = False
 
 
     def accept_wrapper(self, sock):
@@ -622,11 +762,22 @@ class Server():
         conn, addr = sock.accept()  # Should be ready to read
         print(f'Accepted connection from {addr}')
         conn.setblocking(False)
-        data = types.SimpleNamespace(addr=addr, inb=b'', outb=b'')
+        data = types.SimpleNamespace(addr=addr, inb=bytearray(), outb=[], outoffset=0, wait=None)
         events = selectors.EVENT_READ
         self.sel.register(conn, events, data=data)
 
 
+    def close_connection(self, key):
+        print(f'Closing connection to {key.data.addr}')
+        self.sel.unregister(key.fileobj)
+        key.fileobj.close()
+        # discard the pending input, output and WAIT_DAT request
+        key.data.inb.clear()
+        key.data.outb.clear()
+        key.data.outoffset = 0
+        key.data.wait = None
+
+
     def service_request(self, key, mask):
         if not self.isConnected:
             if self.keepalive:
@@ -639,153 +790,312 @@ class Server():
         data = key.data
 
         if mask & selectors.EVENT_READ:
+            # read whatever is available, but at least try to complete the current message
+            bufsize = 65536
+            if len(data.inb) >= 8:
+                (version, command, msgsize) = struct.unpack('HHI', data.inb[0:8])
+                bufsize = max(bufsize, 8 + msgsize - len(data.inb))
             try:
-                message = sock.recv(8)
+                message = sock.recv(bufsize)
+            except BlockingIOError:
+                return
             except:
                 if self.keepalive:
                     print('Cannot read message.')
-                    message = [] # this will be handled further down
+                    message = b'' # this will be handled further down
                 else:
                     raise IOError('Cannot read message.')
 
-            if message and len(message)==8:
-                (version, command, bufsize) = struct.unpack('HHI', message[0:8])
-                if version != VERSION:
-                    if self.keepalive:
-                        print('Incompatible version.')
-                        return
-                    else:
-                        raise RuntimeError('Incompatible version.')
+            if not message:
+                # the connection was closed by the client
+                self.close_connection(key)
+                return
+
+            data.inb += message
+            self.process_input(key)
+            if sock.fileno() < 0:
+                # the connection was closed while handling the input
+                return
+
+        if mask & selectors.EVENT_WRITE:
+            self.flush_output(key)
+
+
+    def process_input(self, key):
+        """
+        process_input(key) -- handle all complete messages that have been received on
+        the connection. Partial messages remain in the input buffer until the rest arrives.
+        """
+
+        data = key.data
+        # requests following a pending WAIT_DAT are handled once it has been answered
+        while data.wait is None and len(data.inb) >= 8:
+            (version, command, bufsize) = struct.unpack('HHI', data.inb[0:8])
+            if version != VERSION:
+                # the remainder of the stream cannot be interpreted any more
+                if self.keepalive:
+                    print('Incompatible version.')
+                    self.close_connection(key)
+                    return
+                else:
+                    raise RuntimeError('Incompatible version.')
+
+            if len(data.inb) < 8 + bufsize:
+                # wait for the remainder of the message
+                break
+
+            payload = bytes(data.inb[8:8 + bufsize])
+            del data.inb[0:8 + bufsize]
+            self.handle_request(key, command, bufsize, payload)
+
+
+    def send_response(self, key, response):
+        """
+        send_response(key, response) -- queue the response for sending, this can be
+        a single buffer or a list of buffers that are sent back-to-back.
+        """
+
+        if key.fileobj.fileno() < 0:
+            # the connection has been closed in the meantime
+            return
+        if isinstance(response, list):
+            key.data.outb.extend(response)
+        else:
+            key.data.outb.append(response)
+        self.flush_output(key)
+        # the output that could not be sent right away should not change when the ring buffer
+        # is written to, hence the views on the ring buffer are copied, but only once
+        for i, x in enumerate(key.data.outb):
+            if isinstance(x, memoryview):
+                key.data.outb[i] = bytes(x)
+
 
+    def flush_output(self, key):
+        """
+        flush_output(key) -- write as much of the pending output as the socket accepts
+        without blocking. The connection is registered for write events as long as
+        there is output remaining.
+        """
+
+        sock = key.fileobj
+        data = key.data
+
+        if sock.fileno() < 0:
+            # the connection has been closed in the meantime
+            return
+
+        if data.outb:
+            # the first buffer might already have been sent in part
+            pending = [memoryview(data.outb[0])[data.outoffset:]] + data.outb[1:512]
+            try:
+                if hasattr(sock, 'sendmsg'):
+                    # scatter-gather write of the pending buffers, this avoids concatenating them
+                    nbytes = sock.sendmsg(pending)
+                else:
+                    nbytes = sock.send(pending[0])
+            except BlockingIOError:
+                nbytes = 0
+            except:
+                if self.keepalive:
+                    print('Cannot send response.')
+                    self.close_connection(key)
+                    return
+                else:
+                    raise IOError('Cannot send response.')
+            # remove what has been sent, keep track of how far the first buffer has been sent
+            while nbytes > 0:
+                if nbytes >= len(data.outb[0]) - data.outoffset:
+                    nbytes -= len(data.outb.pop(0)) - data.outoffset
+                    data.outoffset = 0
+                else:
+                    data.outoffset += nbytes
+                    nbytes = 0
+
+        if data.outb:
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE
+        else:
+            events = selectors.EVENT_READ
+        if self.sel.get_key(sock).events != events:
+            self.sel.modify(sock, events, data=data)
+
+
+    def handle_request(self, key, command, bufsize, payload):
+        data = key.data
+
+        if command in (PUT_HDR_NORESPONSE, PUT_DAT_NORESPONSE, PUT_EVT_NORESPONSE):
+            # handle it like the corresponding request, but do not send a response
+            command = command - PUT_HDR_NORESPONSE + PUT_HDR
+            respond = False
+        else:
+            respond = True
+
+        if command == PUT_HDR:
+            self.H = Header()
+            (self.H.nChannels, self.H.nSamples, self.H.nEvents, self.H.fSample, self.H.dataType, bufsize) = struct.unpack('IIIfII', payload[0:24])
+            if self.resumed and self.H.dataType < len(numpyType):
+                # the ring buffer that was restored from disk can be continued if it has the same layout
+                compatible = (self.D.buffer.shape[1], self.D.buffer.dtype, self.D.length) == (self.H.nChannels, numpy.dtype(numpyType[self.H.dataType]), int(self.H.fSample * self.length))
+            else:
+                compatible = False
+            if compatible:
+                print('Continuing the resumed ring buffer with %d samples' % self.D.count)
+                self.H.nSamples = self.D.count
+                self.H.nEvents = 0
+                self.D.setevents(0)
+            else:
+                self.flush_data()  # this flushes the data
+            self.resumed = False
+            self.E = None  # this flushes the events
+            response = struct.pack('HHI', VERSION, PUT_OK, 0)
+            if respond:
+                self.send_response(key, response)
+
+        elif command == PUT_DAT:
+            if self.H == None or len(payload) < 16:
+                response = struct.pack('HHI', VERSION, PUT_ERR, 0)
+            else:
+                (nchans, nsamples, data_type, bufsize) = struct.unpack('IIII', payload[0:16])
+                # inconsistent data is reported to the client rather than raised, so that the server keeps running
+                if nchans != self.H.nChannels or data_type != self.H.dataType or data_type >= len(wordSize):
+                    print('Incorrect number of channels or data type.')
+                    response = struct.pack('HHI', VERSION, PUT_ERR, 0)
+                elif bufsize != len(payload) - 16 or bufsize != nchans * nsamples * wordSize[data_type]:
+                    print('Incorrect data size.')
+                    response = struct.pack('HHI', VERSION, PUT_ERR, 0)
+                else:
+                    if self.D == None:
+                        if self.shared:
+                            shared = sharedname(self.port)
+                        else:
+                            shared = None
+                        self.D = RingBuffer.SampleBuffer(int(self.H.fSample * self.length), self.H.nChannels, numpyType[self.H.dataType], filename=self.filename, fsample=self.H.fSample, shared=shared)
+                        self.D.setevents(self.H.nEvents)
+                        print('Initialized ring buffer with %d samples' % self.D.length)
+                    self.D.append(payload[16:])
+                    self.H.nSamples += nsamples
+                    response = struct.pack('HHI', VERSION, PUT_OK, 0)
+            # send the response to PUT_DAT
+            if respond:
+                self.send_response(key, response)
+            # the new data might satisfy pending WAIT_DAT requests
+            self.check_wait()
+
+        elif command == PUT_EVT:
+            if self.H != None:
+                if self.E == None:
+                    nbytes = self.maxevents * 128
+                    self.E = RingBuffer.EventBuffer(self.maxevents, nbytes)
+                    print('Initialized event buffer with %d events' % self.maxevents)
                 try:
-                    payload = sock.recv(bufsize)
-                except:
-                    if self.keepalive:
-                        print('Cannot read payload.')
-                        return
-                    else:
-                        raise IOError('Cannot read payload.')
-
-                if command == PUT_HDR:
-                    self.H = Header()
-                    self.D = None  # this flushes the data
-                    self.E = None  # this flushes the events
-                    (self.H.nChannels, self.H.nSamples, self.H.nEvents, self.H.fSample, self.H.dataType, bufsize) = struct.unpack('IIIfII', payload[0:24])
+                    self.H.nEvents += self.E.append(payload)
+                    if self.D != None:
+                        self.D.setevents(self.H.nEvents)
                     response = struct.pack('HHI', VERSION, PUT_OK, 0)
-                    sock.send(response)
-
-                elif command == PUT_DAT:
-                    if self.H != None:
-                        (nchans, nsamples, data_type, bufsize) = struct.unpack('IIII', payload[0:16])
-                        if nchans != self.H.nChannels:
-                            raise RuntimeError('Incorrect number of channels')
-                        if data_type != self.H.dataType:
-                            raise RuntimeError('Incorrect data type')
-                        if self.D == None:
-                            nbytes = int(self.H.nChannels * self.H.fSample * self.length * wordSize[self.H.dataType])
-                            self.D = RingBuffer.RingBuffer(nbytes)
-                            print('Initialized ring buffer with %d bytes' % nbytes)
-                        self.D.append(payload[16:])
-                        self.H.nSamples += nsamples
-                        response = struct.pack('HHI', VERSION, PUT_OK, 0)
-                    else:
-                        response = struct.pack('HHI', VERSION, PUT_ERR, 0)
-                    # send the response to PUT_DAT
-                    sock.send(response)
-
-                elif command == PUT_EVT:
-                    print('PUT_EVT not implemented')
+                except RuntimeError:
                     response = struct.pack('HHI', VERSION, PUT_ERR, 0)
-                    sock.send(response)
-
-                elif command == GET_HDR:
-                    if self.H != None:
-                        response = struct.pack('HHI', VERSION, GET_OK, 24)
-                        response += struct.pack('IIIfII', self.H.nChannels, self.H.nSamples, self.H.nEvents, self.H.fSample, self.H.dataType, 0)
-                    else:
-                        response = struct.pack('HHI', VERSION, GET_ERR, 0)
-                    # send the response to GET_HDR
-                    sock.send(response)
-
-                elif command == GET_DAT:
-                    if self.H != None and self.D != None and bufsize == 8:
-                        (begsample, endsample) = struct.unpack('II', payload[0:8]) # this uses inclusive, zero-based start/end indices
-                        begbyte = int(begsample * self.H.nChannels * wordSize[self.H.dataType])
-                        endbyte = int((endsample+1) * self.H.nChannels * wordSize[self.H.dataType])
-                        nbytes = endbyte - begbyte
-                        try:
-                            response = struct.pack('HHI', VERSION, GET_OK, nbytes+16)
-                            response += struct.pack('IIII', self.H.nChannels, endsample-begsample+1, self.H.dataType, nbytes)
-                            response += self.D.read(begbyte, endbyte) # this uses exclusive, zer0-based start/end indices
-                        except Exception as e:
-                            response = struct.pack('HHI', VERSION, GET_ERR, 0)
-                    else:
-                        response = struct.pack('HHI', VERSION, GET_ERR, 0)
-                    # send the response to GET_DAT
-                    sock.send(response)
-
-                elif command == GET_EVT:
-                    print('GET_EVT not implemented')
-                    response = struct.pack('HHI', VERSION, GET_ERR, 0)
-                    sock.send(response)
-
-                elif command == FLUSH_HDR:
-                    if self.H != None:
-                        self.H = None
-                        self.D = None  # this also flushes the data
-                        self.E = None  # this also flushes the events
-                        response = struct.pack('HHI', VERSION, FLUSH_OK, 0)
-                    else:
-                        response = struct.pack('HHI', VERSION, FLUSH_ERR, 0)
-                    # send the response to FLUSH_HDR
-                    sock.send(response)
-
-                elif command == FLUSH_DAT:
-                    if self.D != None:
-                        self.D = None
-                        response = struct.pack('HHI', VERSION, FLUSH_OK, 0)
-                    else:
-                        response = struct.pack('HHI', VERSION, FLUSH_ERR, 0)
-                    # send the response to FLUSH_DAT
-                    sock.send(response)
-
-                elif command == FLUSH_EVT:
-                    if E != None:
-                        E = None
-                        response = struct.pack('HHI', VERSION, FLUSH_OK, 0)
-                    else:
-                        response = struct.pack('HHI', VERSION, FLUSH_ERR, 0)
-                    # send the response to FLUSH_EVT
-                    sock.send(response)
-
-                elif command == WAIT_DAT:
-                    if self.H != None and bufsize == 12:
-                        (nsamples, nevents, timeout) = struct.unpack('III', payload[0:12])
-                        timeout /= 1000.0  # in seconds
-                        start = time.time()
-                        response = struct.pack('HHI', VERSION, WAIT_ERR, 0)
-                        while time.time() < (start + timeout):
-                            if self.H.nSamples >= nsamples or self.H.nEvents >= nevents:
-                                response = struct.pack('HHI', VERSION, WAIT_OK, 8)
-                                response += struct.pack('II', self.H.nSamples, self.H.nEvents)
-                                break
-                            else:
-                                time.sleep(0.010)
-                    else:
-                        response = struct.pack('HHI', VERSION, WAIT_ERR, 0)
-                    # send the response to WAIT_DAT
-                    sock.send(response)
+            else:
+                response = struct.pack('HHI', VERSION, PUT_ERR, 0)
+            # send the response to PUT_EVT
+            if respond:
+                self.send_response(key, response)
+            # new events might satisfy pending WAIT_DAT requests
+            self.check_wait()
+
+        elif command == GET_HDR:
+            if self.H != None:
+                response = struct.pack('HHI', VERSION, GET_OK, 24)
+                response += struct.pack('IIIfII', self.H.nChannels, self.H.nSamples, self.H.nEvents, self.H.fSample, self.H.dataType, 0)
+            else:
+                response = struct.pack('HHI', VERSION, GET_ERR, 0)
+            # send the response to GET_HDR
+            self.send_response(key, response)
 
+        elif command == GET_DAT:
+            if self.H != None and self.D != None and bufsize == 8:
+                (begsample, endsample) = struct.unpack('II', payload[0:8]) # this uses inclusive, zero-based start/end indices
+                try:
+                    dat = self.D.read(begsample, endsample+1) # this uses exclusive, zero-based start/end indices
+                    nbytes = len(dat)
+                    response = struct.pack('HHI', VERSION, GET_OK, nbytes+16)
+                    response += struct.pack('IIII', self.H.nChannels, endsample-begsample+1, self.H.dataType, nbytes)
+                    # the header and the data are sent without concatenating them
+                    response = [response, dat]
+                except Exception as e:
+                    response = struct.pack('HHI', VERSION, GET_ERR, 0)
+            else:
+                response = struct.pack('HHI', VERSION, GET_ERR, 0)
+            # send the response to GET_DAT
+            self.send_response(key, response)
+
+        elif command == GET_EVT:
+            if self.H != None and self.E != None and self.E.count > 0:
+                if bufsize == 8:
+                    (begevent, endevent) = struct.unpack('II', payload[0:8]) # this uses inclusive, zero-based start/end indices
                 else:
-                    # unrecognized command
-                    print('Command not implemented')
-                    response = struct.pack('HHI', VERSION, 0, 0)
-                    sock.send(response)
-
+                    # return all events that are available
+                    (begevent, endevent) = (self.E.available(), self.E.count - 1)
+                try:
+                    events = self.E.read(begevent, endevent+1) # this uses exclusive, zero-based start/end indices
+                    response = struct.pack('HHI', VERSION, GET_OK, len(events))
+                    response += events
+                except Exception as e:
+                    response = struct.pack('HHI', VERSION, GET_ERR, 0)
+            else:
+                response = struct.pack('HHI', VERSION, GET_ERR, 0)
+            # send the response to GET_EVT
+            self.send_response(key, response)
+
+        elif command == FLUSH_HDR:
+            if self.H != None:
+                self.H = None
+                self.flush_data()  # this also flushes the data
+                self.E = None  # this also flushes the events
+                response = struct.pack('HHI', VERSION, FLUSH_OK, 0)
+            else:
+                response = struct.pack('HHI', VERSION, FLUSH_ERR, 0)
+            # send the response to FLUSH_HDR
+            self.send_response(key, response)
+            # pending WAIT_DAT requests cannot be satisfied any more
+            self.check_wait()
+
+        elif command == FLUSH_DAT:
+            if self.D != None:
+                self.flush_data()
+                response = struct.pack('HHI', VERSION, FLUSH_OK, 0)
             else:
-                print(f'Closing connection to {data.addr}')
-                self.sel.unregister(sock)
-                sock.close()
+                response = struct.pack('HHI', VERSION, FLUSH_ERR, 0)
+            # send the response to FLUSH_DAT
+            self.send_response(key, response)
+
+        elif command == FLUSH_EVT:
+            if self.E != None:
+                self.E = None
+                self.H.nEvents = 0
+                if self.D != None:
+                    self.D.setevents(self.H.nEvents)
+                response = struct.pack('HHI', VERSION, FLUSH_OK, 0)
+            else:
+                response = struct.pack('HHI', VERSION, FLUSH_ERR, 0)
+            # send the response to FLUSH_EVT
+            self.send_response(key, response)
+
+        elif command == WAIT_DAT:
+            if self.H != None and bufsize == 12:
+                (nsamples, nevents, timeout) = struct.unpack('III', payload[0:12])
+                # park the request on this connection, it is answered by check_wait()
+                # as soon as it can be satisfied or when it times out
+                data.wait = (nsamples, nevents, time.monotonic() + timeout / 1000.0)
+                self.check_wait(key)
+            else:
+                response = struct.pack('HHI', VERSION, WAIT_ERR, 0)
+                # send the response to WAIT_DAT
+                self.send_response(key, response)
+
+        else:
+            # unrecognized command
+            print('Command not implemented')
+            response = struct.pack('HHI', VERSION, 0, 0)
+            self.send_response(key, response)
 
 
     def loop(self):
@@ -797,9 +1107,62 @@ class Server():
                 raise RuntimeError('Not connected.')
 
         # the timeout is used to return control to the main loop once in a while
-        events = self.sel.select(timeout = self.timeout)
+        timeout = self.timeout
+        deadline = self.next_deadline()
+        if deadline is not None:
+            # do not wait longer than needed to answer pending WAIT_DAT requests
+            timeout = max(0, min(timeout, deadline - time.monotonic()))
+        events = self.sel.select(timeout = timeout)
         for key, mask in events:
             if key.data is None:
                 self.accept_wrapper(key.fileobj)
             else:
                 self.service_request(key, mask)
+
+        # answer the WAIT_DAT requests that have timed out
+        self.check_wait()
+
+
+    def next_deadline(self):
+        # returns the time at which the first pending WAIT_DAT request times out
+        deadline = None
+        for key in self.sel.get_map().values():
+            if key.data is not None and key.data.wait is not None:
+                if deadline is None or key.data.wait[2] < deadline:
+                    deadline = key.data.wait[2]
+        return deadline
+
+
+    def check_wait(self, key=None):
+        """
+        check_wait([key]) -- send the response to the pending WAIT_DAT requests
+        that can be satisfied or that have timed out. This considers all
+        connections, or only the specified one.
+        """
+
+        if key is None:
+            keys = list(self.sel.get_map().values())
+            resume = True
+        else:
+            keys = [key]
+            resume = False
+
+        now = time.monotonic()
+        for key in keys:
+            if key.data is None or key.data.wait is None:
+                continue
+            (nsamples, nevents, deadline) = key.data.wait
+            if self.H == None:
+                # the header has been flushed while waiting
+                response = struct.pack('HHI', VERSION, WAIT_ERR, 0)
+            elif self.H.nSamples > nsamples or self.H.nEvents > nevents or now >= deadline:
+                # the thresholds have been exceeded or the request has timed out
+                response = struct.pack('HHI', VERSION, WAIT_OK, 8)
+                response += struct.pack('II', self.H.nSamples, self.H.nEvents)
+            else:
+                continue
+            key.data.wait = None
+            self.send_response(key, response)
+            if resume:
+                # continue with the requests that arrived while waiting
+                self.process_input(key)
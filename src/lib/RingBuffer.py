@@ -1,3 +1,24 @@
+import os
+import struct
+import time
+import numpy
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    # this requires Python 3.8 or later
+    shared_memory = None
+
+# the header of a ring buffer that is stored on disk or in shared memory, the samples follow at an offset of 64 bytes
+# the sequence number is odd while the buffer is being written to, readers use it as a seqlock
+fileheader = numpy.dtype([('magic', 'S8'), ('nchans', '<u8'), ('length', '<u8'), ('count', '<u8'), ('fsample', '<f8'), ('dtype', 'S8'), ('nevents', '<u8'), ('seq', '<u8')])
+fileformat = '<8sQQQd8sQQ'
+fileoffset = 64
+
+# the shared memory segments that were created by this process, only these are registered with the resource tracker
+created = set()
+
+
 class RingBuffer:
     """
     Class that implements a ring or cyclic buffer that automatically wraps around.
@@ -15,24 +36,21 @@ class RingBuffer:
         """
         if len(data)>self.length:
             # remove the part of the data that does not fit anyway
-            self.count += int(len(data)/self.length)*self.length
+            self.count += len(data) - self.length
             data = data[-self.length:]
 
         begbyte = self.count % self.length
-        endbyte = (self.count + len(data) - 1) % self.length + 1
+        endbyte = begbyte + len(data)
 
-        if endbyte<begbyte:
+        if endbyte>self.length:
             # insert the first section towards the end
-            numbytes = self.length - begbyte + 1
+            numbytes = self.length - begbyte
             self.buffer[begbyte:self.length] = data[0:numbytes]
             # insert the second section at the start
-            self.buffer[0:endbyte] = data[numbytes:]
-        elif endbyte>begbyte:
+            self.buffer[0:endbyte-self.length] = data[numbytes:]
+        else:
             # simply insert the data
             self.buffer[begbyte:endbyte] = data
-        else:
-            # there is nothing to insert
-            pass
         self.count += len(data)
 
     def read(self, begbyte, endbyte):
@@ -51,6 +69,9 @@ class RingBuffer:
             raise RuntimeError('Cannot read past the end of the available data.')
         elif endbyte<begbyte:
             raise RuntimeError('Invalid selection.')
+        elif endbyte==begbyte:
+            # the selection is empty
+            return b''
         begbyte = begbyte % self.length
         endbyte = (endbyte - 1) % self.length + 1
     
@@ -59,3 +80,364 @@ class RingBuffer:
         else:
             data = self.buffer[begbyte:endbyte]
         return data
+
+
+class SampleBuffer:
+    """
+    Class that implements a ring buffer for multichannel data that automatically wraps around.
+    The samples are stored in a 2-D numpy array (samples x channels) and it has the methods
+    append() and read(). Reading returns a memoryview on the underlying array, the data is
+    only copied if the selection wraps around the end of the buffer.
+
+    If a filename is specified, the array is memory-mapped to that file. This allows for a
+    long history with bounded resident memory. With resume=True the samples that are
+    already present in a compatible file are retained.
+
+    If a shared memory name is specified, the array is allocated in a shared memory segment
+    with that name, which can be read by other processes using SharedReader. This takes
+    precedence over the filename.
+    """
+
+    def __init__(self, nsamples, nchans, dtype, filename=None, fsample=0., resume=False, shared=None):
+        self.length = nsamples
+        self.count = 0
+        self.header = None
+        self.shm = None
+
+        dtype = numpy.dtype(dtype)
+        if shared is not None:
+            nbytes = fileoffset + nsamples * nchans * dtype.itemsize
+            try:
+                self.shm = shared_memory.SharedMemory(name=shared, create=True, size=nbytes)
+            except FileExistsError:
+                # this remained from a previous session that was not closed properly
+                stale = shared_memory.SharedMemory(name=shared)
+                stale.close()
+                stale.unlink()
+                self.shm = shared_memory.SharedMemory(name=shared, create=True, size=nbytes)
+            created.add(self.shm.name)
+            self.header = numpy.ndarray((1,), dtype=fileheader, buffer=self.shm.buf, offset=0)
+            self.buffer = numpy.ndarray((nsamples, nchans), dtype=dtype, buffer=self.shm.buf, offset=fileoffset)
+        elif filename is None:
+            self.buffer = numpy.zeros((nsamples, nchans), dtype=dtype)
+            return
+        elif resume:
+            hdr = readheader(filename)
+            if hdr is None or hdr['nchans'] != nchans or hdr['length'] != nsamples or hdr['dtype'] != dtype.str:
+                raise RuntimeError('Cannot resume from %s' % filename)
+        else:
+            # create a new file, it is sparse on most file systems
+            with open(filename, 'wb') as f:
+                f.truncate(fileoffset + nsamples * nchans * dtype.itemsize)
+
+        if self.shm is None:
+            self.header = numpy.memmap(filename, dtype=fileheader, mode='r+', offset=0, shape=(1,))
+            self.buffer = numpy.memmap(filename, dtype=dtype, mode='r+', offset=fileoffset, shape=(nsamples, nchans))
+
+        if resume:
+            self.count = int(self.header['count'][0])
+        else:
+            self.header['nchans'] = nchans
+            self.header['length'] = nsamples
+            self.header['count'] = 0
+            self.header['fsample'] = fsample
+            self.header['dtype'] = dtype.str
+            self.header['nevents'] = 0
+            self.header['seq'] = 0
+            # this is set last, it signals to readers that the header is complete
+            self.header['magic'] = b'FTBUFFER'
+
+    def append(self, data):
+        """
+        append(data) - add samples to the end of the buffer, the data can be a numpy
+        array (samples x channels) or the corresponding bytes.
+        """
+        if not isinstance(data, numpy.ndarray):
+            data = numpy.frombuffer(data, dtype=self.buffer.dtype)
+        data = data.reshape(-1, self.buffer.shape[1])
+
+        if len(data)>self.length:
+            # remove the part of the data that does not fit anyway
+            self.count += len(data) - self.length
+            data = data[-self.length:]
+
+        if self.header is not None:
+            # signal to the readers that the buffer is being written to
+            self.header['seq'] += 1
+
+        begsample = self.count % self.length
+        endsample = begsample + len(data)
+
+        if endsample>self.length:
+            # insert the first section towards the end
+            nsamples = self.length - begsample
+            self.buffer[begsample:self.length] = data[0:nsamples]
+            # insert the second section at the start
+            self.buffer[0:endsample-self.length] = data[nsamples:]
+        else:
+            # simply insert the data
+            self.buffer[begsample:endsample] = data
+        self.count += len(data)
+        if self.header is not None:
+            # keep track of the number of samples in the file or shared memory
+            self.header['count'] = self.count
+            self.header['seq'] += 1
+
+    def setevents(self, nevents):
+        """
+        setevents(nevents) - update the number of events that is shared with the readers.
+        """
+        if self.header is not None:
+            self.header['seq'] += 1
+            self.header['nevents'] = nevents
+            self.header['seq'] += 1
+
+    def close(self):
+        """
+        close() - release the shared memory, readers will notice that it is no longer valid.
+        For a memory-mapped file, the samples are written to disk and the file is released.
+        """
+        if self.shm is not None:
+            self.header['seq'] += 1
+            self.header['magic'] = b''
+            self.header['seq'] += 1
+            self.header = None
+            self.buffer = None
+            created.discard(self.shm.name)
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+        elif isinstance(self.buffer, numpy.memmap):
+            self.buffer.flush()
+            self.header.flush()
+            self.header = None
+            self.buffer = None
+
+    def read(self, begsample, endsample):
+        """
+        read(begsample, endsample) - read samples from a specific location in the buffer.
+        This uses exclusive, zero-based start/end indices and returns a memoryview.
+        """
+        if self.count>self.length:
+            begavailable = self.count - self.length
+        else:
+            begavailable = 0
+        endavailable = self.count
+
+        if begsample<begavailable:
+            raise RuntimeError('Cannot read before the start of the available data.')
+        elif endsample>endavailable or begsample>endavailable-1:
+            raise RuntimeError('Cannot read past the end of the available data.')
+        elif endsample<begsample:
+            raise RuntimeError('Invalid selection.')
+        nsamples = endsample - begsample
+        begsample = begsample % self.length
+        endsample = begsample + nsamples
+
+        if endsample>self.length:
+            # the selection wraps around, this requires a copy
+            data = numpy.concatenate((self.buffer[begsample:], self.buffer[0:endsample-self.length]))
+        else:
+            data = self.buffer[begsample:endsample]
+        return memoryview(data).cast('B')
+
+
+class SharedReader:
+    """
+    Class that gives read access to a SampleBuffer in shared memory from another process.
+    It has the methods readheader() and read(), which return None if the shared memory is
+    not available, e.g. because the writer has not created it (yet).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.shm = None
+        self.buf = None
+        self.buffer = None
+
+    def attach(self):
+        if self.shm is not None and self.buf[0:8] == b'FTBUFFER':
+            return True
+        self.detach()
+        try:
+            try:
+                shm = shared_memory.SharedMemory(name=self.name, track=False)
+            except TypeError:
+                # before Python 3.13 the resource tracker would remove the segment when this process exits
+                shm = shared_memory.SharedMemory(name=self.name)
+                if shm.name not in created:
+                    # in the process that created it, the registration is shared with the writer and should remain
+                    resource_tracker.unregister(shm._name, 'shared_memory')
+        except (FileNotFoundError, OSError):
+            return False
+        (magic, nchans, length, count, fsample, dtype, nevents, seq) = struct.unpack_from(fileformat, shm.buf, 0)
+        if magic != b'FTBUFFER':
+            shm.close()
+            return False
+        dtype = dtype.rstrip(b'\0').decode('ascii')
+        self.buffer = numpy.ndarray((length, nchans), dtype=dtype, buffer=shm.buf, offset=fileoffset)
+        self.buf = shm.buf
+        self.shm = shm
+        return True
+
+    def detach(self):
+        if self.shm is not None:
+            self.buf = None
+            self.buffer = None
+            self.shm.close()
+            self.shm = None
+
+    def snapshot(self):
+        # wait until the writer is done and return a consistent copy of the header
+        while True:
+            hdr = struct.unpack_from(fileformat, self.buf, 0)
+            seq = hdr[7]
+            if seq % 2 == 0 and struct.unpack_from('<Q', self.buf, 56)[0] == seq:
+                return hdr
+            time.sleep(0)
+
+    def readheader(self):
+        """
+        readheader() - returns a dictionary with the header information, or None.
+        """
+        if not self.attach():
+            return None
+        (magic, nchans, length, count, fsample, dtype, nevents, seq) = self.snapshot()
+        if magic != b'FTBUFFER':
+            return None
+        return {
+            'nchans': nchans,
+            'length': length,
+            'count': count,
+            'fsample': fsample,
+            'dtype': dtype.rstrip(b'\0').decode('ascii'),
+            'nevents': nevents,
+        }
+
+    def read(self, begsample, endsample):
+        """
+        read(begsample, endsample) - read samples from a specific location in the buffer.
+        This uses exclusive, zero-based start/end indices and returns a copy of the data
+        as a numpy array, or None if the shared memory is not available.
+        """
+        if not self.attach():
+            return None
+        (magic, nchans, length, count, fsample, dtype, nevents, seq) = self.snapshot()
+        if begsample<max(count-length, 0):
+            raise RuntimeError('Cannot read before the start of the available data.')
+        elif endsample>count or begsample>count-1:
+            raise RuntimeError('Cannot read past the end of the available data.')
+        elif endsample<begsample:
+            raise RuntimeError('Invalid selection.')
+        first = begsample
+        nsamples = endsample - begsample
+        begsample = begsample % length
+        endsample = begsample + nsamples
+
+        if endsample>length:
+            data = numpy.concatenate((self.buffer[begsample:], self.buffer[0:endsample-length]))
+        else:
+            data = self.buffer[begsample:endsample].copy()
+
+        # the writer might have overwritten the samples while they were being copied
+        (magic, nchans, length, count, fsample, dtype, nevents, seq) = self.snapshot()
+        if magic != b'FTBUFFER' or count - length > first:
+            raise RuntimeError('Cannot read before the start of the available data.')
+        return data
+
+
+def readheader(filename):
+    """
+    readheader(filename) - read the header of a ring buffer that is stored on disk.
+    Returns a dictionary, or None if the file does not exist or is not a ring buffer.
+    """
+    if not os.path.exists(filename) or os.path.getsize(filename) < fileoffset:
+        return None
+    hdr = numpy.fromfile(filename, dtype=fileheader, count=1)[0]
+    if hdr['magic'] != b'FTBUFFER':
+        return None
+    return {
+        'nchans': int(hdr['nchans']),
+        'length': int(hdr['length']),
+        'count': int(hdr['count']),
+        'fsample': float(hdr['fsample']),
+        'dtype': hdr['dtype'].decode('ascii'),
+    }
+
+
+class EventBuffer:
+    """
+    Class that implements a ring buffer for serialized FieldTrip events. The events are
+    stored back-to-back in a byte RingBuffer, and the position of each event is kept
+    in an array, so that a range of events can be read without parsing them again.
+    It has the methods append() and read().
+    """
+
+    def __init__(self, nevents, nbytes):
+        self.buffer = RingBuffer(nbytes)
+        self.offset = numpy.zeros(nevents, dtype=numpy.int64)
+        self.length = nevents
+        self.count = 0
+
+    def append(self, data):
+        """
+        append(bytes) - add one or multiple serialized events to the end of the buffer.
+        Returns the number of events that were added.
+        """
+        # determine the start of each event, the size is stored in the last 4 bytes of the 32-byte event definition
+        start = []
+        pos = 0
+        while pos < len(data):
+            if pos + 32 > len(data):
+                raise RuntimeError('Invalid event definition.')
+            (bufsize,) = struct.unpack('I', data[pos+28:pos+32])
+            if pos + 32 + bufsize > len(data):
+                raise RuntimeError('Invalid event definition.')
+            start.append(pos)
+            pos += 32 + bufsize
+
+        if len(start) > self.length:
+            # remove the events that do not fit anyway
+            data = data[start[-self.length]:]
+            self.buffer.count += start[-self.length]
+            self.count += len(start) - self.length
+            start = [x - start[-self.length] for x in start[-self.length:]]
+
+        index = numpy.arange(self.count, self.count + len(start)) % self.length
+        self.offset[index] = numpy.array(start, dtype=numpy.int64) + self.buffer.count
+        self.buffer.append(data)
+        self.count += len(start)
+        return len(start)
+
+    def available(self):
+        """
+        available() - returns the zero-based index of the first event that can still be read.
+        """
+        begbyte = max(self.buffer.count - self.buffer.length, 0)
+        # older events might have been overwritten in the byte buffer, use a binary search
+        lo = max(self.count - self.length, 0)
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.offset[mid % self.length] < begbyte:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def read(self, begevent, endevent):
+        """
+        read(begevent, endevent) - read the serialized events from a specific location in the buffer.
+        """
+        if begevent < self.available():
+            raise RuntimeError('Cannot read before the start of the available events.')
+        elif endevent > self.count or begevent > self.count - 1:
+            raise RuntimeError('Cannot read past the end of the available events.')
+        elif endevent < begevent:
+            raise RuntimeError('Invalid selection.')
+        begbyte = int(self.offset[begevent % self.length])
+        if endevent < self.count:
+            endbyte = int(self.offset[endevent % self.length])
+        else:
+            endbyte = self.buffer.count
+        return self.buffer.read(begbyte, endbyte)
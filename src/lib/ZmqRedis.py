@@ -16,180 +16,360 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import zmq
+import struct
+import bisect
+import fnmatch
 import threading
 
+# The messages between client and server are multipart. The client sends an empty delimiter, a
+# sequence number, the command and its arguments as separate frames. The server replies with the
+# same delimiter and sequence number, a status frame that is either 'OK' or 'ERR', followed by one
+# or multiple frames with the result, or with the error message if the command failed. Values
+# are prefixed with a single byte that specifies the type: 'i' for a 64-bit integer, 'd' for a
+# 64-bit float and 's' for a UTF-8 string. An empty frame represents a value that does not exist.
+
+###################################################################################################
+class ResponseError(Exception):
+    # this is raised on the client side when the server could not handle the command
+    pass
+
+###################################################################################################
+def encode(val):
+    if val is None:
+        return b''
+    elif isinstance(val, str):
+        return b's' + val.encode('utf-8')
+    elif isinstance(val, bytes):
+        return b's' + val
+    elif isinstance(val, int):
+        return b'i' + struct.pack('<q', val)
+    else:
+        return b'd' + struct.pack('<d', float(val))
+
+###################################################################################################
+def decode(buf):
+    # the values are returned as strings, consistent with a Redis server
+    if len(buf)==0:
+        return None
+    elif buf[0:1]==b'd':
+        return repr(struct.unpack('<d', buf[1:9])[0])
+    elif buf[0:1]==b'i':
+        return repr(struct.unpack('<q', buf[1:9])[0])
+    else:
+        return buf[1:].decode('utf-8')
+
+###################################################################################################
+def prefix(pattern):
+    # returns the literal part of a glob-style pattern up to the first special character
+    for i, c in enumerate(pattern):
+        if c in b'*?[\\':
+            return pattern[:i]
+    return pattern
+
 ###################################################################################################
 class server():
-    def __init__(self, port=5555):
+    def __init__(self, port=5555, notify=False):
         context = zmq.Context()
-        command = context.socket(zmq.REP)
-        command.bind("tcp://*:%d" % (port+0))  # this is the socket for most commands
+        command = context.socket(zmq.ROUTER)
+        command.bind("tcp://*:%d" % (port+0))  # this is the socket for most commands
         publish = context.socket(zmq.PUB)
-        publish.bind("tcp://*:%d" % (port+1))  # this is the socket for publishing
+        publish.bind("tcp://*:%d" % (port+1))  # this is the socket for publishing
         self.command = command
         self.publish = publish
         self.store = {}
+        self.index = []         # sorted list with all keys
+        self.notify = notify    # publish keyspace notifications when a key is set
         self.debug = 0
+        self.handlers = {
+            b'SET': self.set,
+            b'GET': self.get,
+            b'MSET': self.mset,
+            b'MGET': self.mget,
+            b'PUBLISH': self.publish_,
+            b'KEYS': self.keys,
+            b'EXISTS': self.exists,
+            b'CONNECT': self.connect,
+            b'EXEC': self.execute,
+        }
 
     def start(self):
         while True:
-            message = self.command.recv_string()
-            if message.startswith('SET'):
-                if self.debug>1:
-                    print(message)
-                cmd, key, val = message.split(' ', 2)
-                self.store[key] = val
-                self.command.send_string('OK')
-
-            elif message.startswith('GET'):
-                if self.debug>2:
-                    print(message)
-                cmd, key = message.split(' ', 1)
-                if key in self.store:
-                    self.command.send_string(self.store[key])
-                else:
-                    self.command.send_string('')
-
-            elif message.startswith('PUBLISH'):
-                if self.debug>1:
-                    print(message)
-                cmd, key, val = message.split(' ', 2)
-                self.command.send_string('OK')
-                self.publish.send_string('%s %s' % (key, val))
-
-            elif message.startswith('KEYS'):
-                if self.debug>1:
-                    print(message)
-                cmd, pattern = message.split(' ', 1)
-                keys = list(self.store.keys())
-                if pattern == '*':
-                    # return all keys
-                    self.command.send_string(' '.join(keys))
-                elif pattern.startswith('*'):
-                    # return all keys that start with anything and end with the pattern
-                    sel = [i.endswith(pattern[1:]) for i in keys]
-                    keys = [i for i,b in zip(keys, sel) if b]
-                    self.command.send_string(' '.join(keys))
-                elif pattern.endswith('*'):
-                    # return all keys that start with the pattern and end with anything
-                    sel = [i.startswith(pattern[:-1]) for i in keys]
-                    keys = [i for i,b in zip(keys, sel) if b]
-                    self.command.send_string(' '.join(keys))
-                else:
-                    # return no keys
-                    self.command.send_string('')
-
-            elif message.startswith('EXISTS'):
-                if self.debug>1:
-                    print(message)
-                cmd, key = message.split(' ', 1)
-                if key in self.store.keys():
-                    self.command.send_string('1')
-                else:
-                    self.command.send_string('0')
-
-            elif message.startswith('CONNECT'):
+            # the ROUTER socket interleaves the requests from all clients
+            message = self.command.recv_multipart()
+            # identity, delimiter, sequence number, command, arguments
+            address = message[0:3]
+            try:
+                reply = [b'OK'] + self.handle(message[3], message[4:])
+            except Exception as e:
                 if self.debug>0:
-                    print(message)
-                self.command.send_string('1')
+                    print(e)
+                reply = [b'ERR', ('%s: %s' % (type(e).__name__, e)).encode('utf-8', 'replace')]
+            self.command.send_multipart(address + reply)
+
+    def handle(self, cmd, args):
+        if self.debug>1:
+            print(cmd.decode(), ' '.join([x.decode('utf-8', 'replace') for x in args[0:1]]))
+        if cmd not in self.handlers:
+            raise ValueError('unknown command %s' % cmd.decode('utf-8', 'replace'))
+        return self.handlers[cmd](args)
+
+    def store_(self, key, val):
+        if key not in self.store:
+            bisect.insort(self.index, key)
+        self.store[key] = val
+        if self.notify:
+            # this follows the keyspace notifications of Redis
+            self.publish.send_multipart([b'__keyspace@0__:' + key, encode('set')])
+
+    def set(self, args):
+        key, val = args
+        self.store_(key, val)
+        return [b'OK']
+
+    def get(self, args):
+        key, = args
+        return [self.store.get(key, b'')]
+
+    def mset(self, args):
+        for key, val in zip(args[0::2], args[1::2]):
+            self.store_(key, val)
+        return [b'OK']
+
+    def mget(self, args):
+        return [self.store.get(key, b'') for key in args]
+
+    def publish_(self, args):
+        key, val = args
+        self.publish.send_multipart([key, val])
+        return [b'OK']
+
+    def keys(self, args):
+        pattern, = args
+        # only the keys that start with the literal prefix of the pattern have to be considered
+        begin = prefix(pattern)
+        keys = []
+        for i in range(bisect.bisect_left(self.index, begin), len(self.index)):
+            key = self.index[i]
+            if not key.startswith(begin):
+                break
+            keys.append(key)
+        if begin == pattern:
+            return keys[0:1] if keys and keys[0] == pattern else []
+        else:
+            return [key for key in keys if fnmatch.fnmatchcase(key, pattern)]
+
+    def exists(self, args):
+        key, = args
+        if key in self.store:
+            return [b'1']
+        else:
+            return [b'0']
+
+    def connect(self, args):
+        if self.debug>0:
+            print('CONNECT')
+        return [b'1']
+
+    def execute(self, args):
+        # each command is followed by the number of arguments and the arguments
+        # each result is preceded by the number of frames in the result
+        reply = []
+        while args:
+            cmd = args[0]
+            nargs = int(args[1])
+            result = self.handle(cmd, args[2:2+nargs])
+            args = args[2+nargs:]
+            reply += [b'%d' % len(result)] + result
+        return reply
 
 
 ###################################################################################################
 class client():
     def __init__(self, host='localhost', port=5555, timeout=5000):
         context = zmq.Context()
-        socket = context.socket(zmq.REQ)
+        socket = context.socket(zmq.DEALER)
         socket.RCVTIMEO = timeout # in milliseconds
+        socket.LINGER = 0
         socket.connect("tcp://%s:%d" % (host, port))
         self.socket = socket
+        self.host = host
+        self.port = port
         self.debug = 0
         self.timeout = timeout
         self.lock = threading.Lock()
+        self.sequence = 0
+
+    def request(self, cmd, *args):
+        # send the request and wait for the corresponding reply, this returns a list of frames
+        # it raises a ResponseError if the server could not handle the request
+        with self.lock:
+            self.sequence = (self.sequence + 1) % 2**32
+            sequence = struct.pack('<I', self.sequence)
+            self.socket.send_multipart([b'', sequence, cmd] + list(args))
+            while True:
+                reply = self.socket.recv_multipart()
+                if reply[1] == sequence:
+                    break
+                # this is a late reply to an earlier request that timed out
+        if reply[2] != b'OK':
+            raise ResponseError('%s failed: %s' % (cmd.decode('utf-8'), reply[3].decode('utf-8', 'replace')))
+        return reply[3:]
 
     def pubsub(self):
-        return pubsub()
+        return pubsub(host=self.host, port=self.port+1)
+
+    def pipeline(self, transaction=False):
+        return pipeline(self)
 
     def set(self, key, val):
         if self.debug>0:
-            if isinstance(val, str):
-                print("SET %s %s" % (key, val))
-            else:
-                print("SET %s %f" % (key, val))
-        with self.lock:
-            if isinstance(val, str):
-                self.socket.send_string("SET %s %s" % (key, val))
-            else:
-                self.socket.send_string("SET %s %f" % (key, val))
-            status = self.socket.recv_string()
+            print("SET %s %s" % (key, val))
+        self.request(b'SET', key.encode('utf-8'), encode(val))
         return
 
     def get(self, key):
         if self.debug>0:
             print("GET %s" % key)
-        with self.lock:
-            self.socket.send_string("GET %s" % key)
-            val = self.socket.recv_string()
-        if len(val)==0:
-            return None
-        else:
-            return val
+        return decode(self.request(b'GET', key.encode('utf-8'))[0])
+
+    def mset(self, mapping):
+        if self.debug>0:
+            print("MSET %s" % ' '.join(mapping.keys()))
+        args = []
+        for key, val in mapping.items():
+            args += [key.encode('utf-8'), encode(val)]
+        self.request(b'MSET', *args)
+        return True
+
+    def mget(self, keys, *args):
+        # this follows the calling convention of redis-py
+        if isinstance(keys, str):
+            keys = [keys]
+        keys = list(keys) + list(args)
+        if self.debug>0:
+            print("MGET %s" % ' '.join(keys))
+        return [decode(x) for x in self.request(b'MGET', *[key.encode('utf-8') for key in keys])]
 
     def publish(self, key, val):
         if self.debug>0:
-            if isinstance(val, str):
-                print("PUBLISH %s %s" % (key, val))
-            else:
-                print("PUBLISH %s %f" % (key, val))
-        with self.lock:
-            if isinstance(val, str):
-                self.socket.send_string("PUBLISH %s %s" % (key, val))
-            else:
-                self.socket.send_string("PUBLISH %s %f" % (key, val))
-            status = self.socket.recv_string()
-        return status
+            print("PUBLISH %s %s" % (key, val))
+        status = self.request(b'PUBLISH', key.encode('utf-8'), encode(val))
+        return status[0].decode('utf-8')
 
     def exists(self, key):
-        with self.lock:
-            self.socket.send_string("EXISTS %s" % key)
-            val = bool(float(self.socket.recv_string()))
-        return val
+        return self.request(b'EXISTS', key.encode('utf-8'))[0]==b'1'
 
     def keys(self, pattern):
-        with self.lock:
-            self.socket.send_string("KEYS %s" % pattern)
-            val = self.socket.recv_string()
-            val = val.split(' ')
-        return val
+        return [x.decode('utf-8') for x in self.request(b'KEYS', pattern.encode('utf-8'))]
 
     def connect(self):
         # test whether this client is connected to the server
-        with self.lock:
-            try:
-                self.socket.send_string("CONNECT")
-                val = bool(float(self.socket.recv_string()))
-            except:
-                val = False
+        try:
+            val = self.request(b'CONNECT')[0]==b'1'
+        except (zmq.ZMQError, ResponseError):
+            val = False
         return val
 
 
+###################################################################################################
+class pipeline():
+    """Class to send multiple commands to the server in a single round trip, this follows
+    the calling convention of redis-py. The results are returned by execute().
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.commands = []
+
+    def set(self, key, val):
+        self.commands.append((b'SET', [key.encode('utf-8'), encode(val)], lambda x: True))
+        return self
+
+    def get(self, key):
+        self.commands.append((b'GET', [key.encode('utf-8')], lambda x: decode(x[0])))
+        return self
+
+    def mset(self, mapping):
+        args = []
+        for key, val in mapping.items():
+            args += [key.encode('utf-8'), encode(val)]
+        self.commands.append((b'MSET', args, lambda x: True))
+        return self
+
+    def mget(self, keys, *args):
+        if isinstance(keys, str):
+            keys = [keys]
+        keys = list(keys) + list(args)
+        self.commands.append((b'MGET', [key.encode('utf-8') for key in keys], lambda x: [decode(y) for y in x]))
+        return self
+
+    def publish(self, key, val):
+        self.commands.append((b'PUBLISH', [key.encode('utf-8'), encode(val)], lambda x: x[0].decode('utf-8')))
+        return self
+
+    def exists(self, key):
+        self.commands.append((b'EXISTS', [key.encode('utf-8')], lambda x: x[0]==b'1'))
+        return self
+
+    def execute(self):
+        if len(self.commands)==0:
+            return []
+        args = []
+        for cmd, cmdargs, convert in self.commands:
+            args += [cmd, b'%d' % len(cmdargs)] + cmdargs
+        # the commands are discarded, also when the server raises a ResponseError
+        commands, self.commands = self.commands, []
+        reply = self.client.request(b'EXEC', *args)
+        result = []
+        for cmd, cmdargs, convert in commands:
+            n = int(reply[0])
+            result.append(convert(reply[1:1+n]))
+            reply = reply[1+n:]
+        return result
+
+
 ###################################################################################################
 class pubsub():
-    def __init__(self):
+    def __init__(self, host='localhost', port=5556):
         context = zmq.Context()
         socket = context.socket(zmq.SUB)
-        socket.connect("tcp://localhost:5556")
+        socket.connect("tcp://%s:%d" % (host, port))
         self.socket = socket
+        self.channels = set()
+        self.patterns = set()
 
     def subscribe(self, channel):
-        self.socket.setsockopt_string(zmq.SUBSCRIBE, channel)
+        self.channels.add(channel.encode('utf-8'))
+        self.socket.setsockopt(zmq.SUBSCRIBE, channel.encode('utf-8'))
+
+    def psubscribe(self, pattern):
+        # subscribe to all channels that match a glob-style pattern, e.g. __keyspace@0__:spectral.*
+        self.patterns.add(pattern.encode('utf-8'))
+        self.socket.setsockopt(zmq.SUBSCRIBE, prefix(pattern.encode('utf-8')))
 
     def listen(self):
-        message = self.socket.recv_string()
-        key, val = message.split(' ', 1)
-        item = {}
-        item['type'] = 'message'
-        item['channel'] = key
-        item['data'] = val
+        while True:
+            key, val = self.socket.recv_multipart()
+            # the subscription also matches on channels that start with the same name
+            if key in self.channels:
+                item = {}
+                item['type'] = 'message'
+                item['pattern'] = None
+                break
+            matched = [pattern for pattern in self.patterns if fnmatch.fnmatchcase(key, pattern)]
+            if matched:
+                item = {}
+                item['type'] = 'pmessage'
+                item['pattern'] = matched[0].decode('utf-8')
+                break
+        item['channel'] = key.decode('utf-8')
+        item['data'] = decode(val)
         return [item]
 
 
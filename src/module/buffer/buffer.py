@@ -65,16 +65,25 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global delay, port, server
+    global delay, port, length, filename, shared, server
 
     # get the options from the configuration file
     delay = patch.getfloat('general', 'delay', default=0.010)
     port = patch.getint('fieldtrip', 'port', multiple=True)
+    length = patch.getfloat('fieldtrip', 'length', default=600)         # in seconds
+    filename = patch.getstring('fieldtrip', 'file', default=None)       # optional, the port number will be added
+    shared = patch.getint('fieldtrip', 'shared', default=0)>0
 
     server = []
     for p in port:
         monitor.info("starting server on %d" % p)
         s = FieldTrip.Server()
+        s.length = length
+        s.shared = shared
+        if filename:
+            # each server stores its ring buffer in its own file
+            s.filename = '%s_%d.dat' % (os.path.splitext(filename)[0], p)
+            monitor.info("storing ring buffer in %s" % s.filename)
         s.connect(hostname='localhost', port=p)
         s.timeout = 0 # the server main loop should not wait, as it would block the other instances
         server.append(s);
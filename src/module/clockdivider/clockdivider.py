@@ -19,7 +19,6 @@
 
 import os
 import sys
-import threading
 import time
 
 if hasattr(sys, 'frozen'):
@@ -44,35 +43,20 @@ sys.path.append(os.path.join(path, '../../lib'))
 import EEGsynth
 
 
-class TriggerThread(threading.Thread):
+class TriggerHandler():
     def __init__(self, redischannel, rate):
-        threading.Thread.__init__(self)
         self.redischannel = redischannel
         self.rate = rate
         self.key = "d%d.%s" % (rate, redischannel)
         self.count = 0
-        self.running = True
 
-    def stop(self):
-        self.running = False
-
-    def run(self):
-        pubsub = patch.pubsub()
+    def __call__(self, item):
         global count
-        # this message unblocks the Redis listen command
-        pubsub.subscribe('CLOCKDIVIDER_UNBLOCK')
-        # this message triggers the event
-        pubsub.subscribe(self.redischannel)
-        while self.running:
-            for item in pubsub.listen():
-                if not self.running or not item['type'] == 'message':
-                    break
-                if item['channel'] == self.redischannel:
-                    count += 1          # this is for the total count
-                    self.count += 1     # this is for local use
-                    if (self.count % self.rate) == 0:
-                        val = float(item['data'])
-                        patch.setvalue(self.key, val)
+        count += 1          # this is for the total count
+        self.count += 1     # this is for local use
+        if (self.count % self.rate) == 0:
+            val = float(item['data'])
+            patch.setvalue(self.key, val)
 
 
 def _setup():
@@ -97,7 +81,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global channels, dividers, count, triggers, channel, divider, thread
+    global channels, dividers, count, triggers, channel, divider, dispatcher
 
     # get the options from the configuration file
     channels = patch.getstring('clock', 'channel', multiple=True)
@@ -106,15 +90,15 @@ def _start():
     # keep track of the number of received triggers
     count = 0
 
+    # a single background thread receives all triggers and passes them on to the handlers
+    dispatcher = EEGsynth.dispatcher(patch, monitor)
     triggers = []
     for channel in channels:
         for divider in dividers:
-            triggers.append(TriggerThread(channel, divider))
+            triggers.append(TriggerHandler(channel, divider))
+            dispatcher.subscribe(channel, triggers[-1])
             monitor.debug("d%d.%s" % (divider, channel))
-
-    # start the thread for each of the triggers
-    for thread in triggers:
-        thread.start()
+    dispatcher.start()
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -126,7 +110,7 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global channels, dividers, count, triggers, channel, divider, thread
+    global channels, dividers, count, triggers, channel, divider, dispatcher
 
     monitor.update("count", count / len(dividers))
 
@@ -148,13 +132,9 @@ def _loop_forever():
 def _stop():
     '''Stop and clean up and stop on SystemExit, KeyboardInterrupt
     '''
-    global monitor, triggers, r
+    global monitor, dispatcher, r
     monitor.success('Closing threads')
-    for thread in triggers:
-        thread.stop()
-    patch.publish('CLOCKDIVIDER_UNBLOCK', 1)
-    for thread in triggers:
-        thread.join()
+    dispatcher.stop()
 
 
 if __name__ == '__main__':
@@ -19,7 +19,6 @@
 
 import os
 import sys
-import threading
 import time
 
 if hasattr(sys, 'frozen'):
@@ -43,72 +42,58 @@ else:
 sys.path.append(os.path.join(path, '../../lib'))
 import EEGsynth
 
-class TriggerThread(threading.Thread):
+class TriggerHandler():
     def __init__(self, redischannel, rate, lrate):
-        threading.Thread.__init__(self)
         self.redischannel = redischannel
         self.rate = rate
         self.lrate = lrate
         self.key = "x%d.%s" % (rate, redischannel)
         self.previous = None  # keep the time of the previous trigger
         self.interval = None  # estimate the interval between triggers
-        self.running = True
         self.timer = []
 
-    def stop(self):
+    def cancel(self):
         # cancel all timers that are still running
         monitor.debug('flushing %d timers' % len(self.timer))
         for t in self.timer:
             t.cancel()
         self.timer = []
-        self.running = False
 
-    def run(self):
+    def __call__(self, item):
         global count
         global interval
-        pubsub = patch.pubsub()
-        # this message unblocks the Redis listen command
-        pubsub.subscribe('CLOCKMULTIPLIER_UNBLOCK')
-        # this message triggers the event
-        pubsub.subscribe(self.redischannel)
-        while self.running:
-            for item in pubsub.listen():
-                if not self.running or not item['type'] == 'message':
-                    break
-                if item['channel'] == self.redischannel:
-                    now = time.time()
-                    count += 1          # this is for the total count
-
-                    # cancel all timers that are still running
-                    for t in self.timer:
-                        t.cancel()
-                    self.timer = []
-
-                    if self.previous == None:
-                        # it is not yet possible to estimate the interval
-                        self.previous = now
-                        continue
-                    elif self.interval == None:
-                        # this is the first estimate of the interval between triggers
-                        self.interval = now - self.previous
-                        self.previous = now
-                    else:
-                        # update the estimate of the interval between triggers
-                        # the learning rate determines how fast the interval updates (0=never, 1=immediate)
-                        self.interval = (1 - self.lrate) * self.interval + self.lrate * (now - self.previous)
-                        self.previous = now
-
-                    val = float(item['data'])
-
-                    # send the first one immediately
-                    patch.setvalue(self.key, val)
-
-                    # schedule the subsequent ones after some time
-                    for number in range(1, self.rate):
-                        delay = number * (self.interval / self.rate)
-                        t = threading.Timer(delay, patch.setvalue, args=[self.key, val])
-                        t.start()
-                        self.timer.append(t)
+        now = time.monotonic()
+        count += 1          # this is for the total count
+
+        # cancel all timers that are still running
+        for t in self.timer:
+            t.cancel()
+        self.timer = []
+
+        if self.previous == None:
+            # it is not yet possible to estimate the interval
+            self.previous = now
+            return
+        elif self.interval == None:
+            # this is the first estimate of the interval between triggers
+            self.interval = now - self.previous
+            self.previous = now
+        else:
+            # update the estimate of the interval between triggers
+            # the learning rate determines how fast the interval updates (0=never, 1=immediate)
+            self.interval = (1 - self.lrate) * self.interval + self.lrate * (now - self.previous)
+            self.previous = now
+
+        val = float(item['data'])
+
+        # send the first one immediately
+        patch.setvalue(self.key, val)
+
+        # schedule the subsequent ones after some time
+        for number in range(1, self.rate):
+            delay = number * (self.interval / self.rate)
+            t = scheduler.schedule(delay, patch.setvalue, args=[self.key, val])
+            self.timer.append(t)
 
 
 def _setup():
@@ -133,7 +118,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global channels, multipliers, lrate, count, triggers, channel, multiplier, thread
+    global channels, multipliers, lrate, count, triggers, channel, multiplier, dispatcher, scheduler
 
     # get the options from the configuration file
     channels    = patch.getstring('clock', 'channel', multiple=True)
@@ -143,15 +128,18 @@ def _start():
     # for keeping track of the number of received triggers
     count = 0
 
+    # a single thread executes all scheduled triggers
+    scheduler = EEGsynth.getscheduler()
+
+    # a single background thread receives all triggers and passes them on to the handlers
+    dispatcher = EEGsynth.dispatcher(patch, monitor)
     triggers = []
     for channel in channels:
         for multiplier in multipliers:
-            triggers.append(TriggerThread(channel, multiplier, lrate))
+            triggers.append(TriggerHandler(channel, multiplier, lrate))
+            dispatcher.subscribe(channel, triggers[-1])
             monitor.debug("x%d.%s" % (multiplier, channel))
-
-    # start the thread for each of the triggers
-    for thread in triggers:
-        thread.start()
+    dispatcher.start()
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -163,10 +151,15 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global channels, multipliers, lrate, count, triggers, channel, multiplier, thread
+    global channels, multipliers, lrate, count, triggers, channel, multiplier, dispatcher, scheduler, pending, lateness, maxlateness
 
     monitor.update("count", count / len(multipliers))
 
+    # report how well the scheduled triggers keep up with their deadlines
+    pending, lateness, maxlateness = scheduler.statistics()
+    monitor.update('pending', pending, level='debug')
+    monitor.update('lateness', round(1000 * lateness, 1), level='debug')
+
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
         print('LOCALS: ' + ', '.join(locals().keys()))
@@ -185,14 +178,12 @@ def _loop_forever():
 def _stop():
     '''Stop and clean up on SystemExit, KeyboardInterrupt, RuntimeError
     '''
-    global monitor, triggers, r
+    global monitor, triggers, dispatcher, r
 
     monitor.success('Closing threads')
-    for thread in triggers:
-        thread.stop()
-    patch.publish('CLOCKMULTIPLIER_UNBLOCK', 1)
-    for thread in triggers:
-        thread.join()
+    dispatcher.stop()
+    for this in triggers:
+        this.cancel()
 
 
 if __name__ == '__main__':
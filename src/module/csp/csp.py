@@ -169,8 +169,8 @@ def _loop_once():
                 f.open(filename)
 
                 # read all the data from the file
+                data[filenr] = f.readSamples(list(range(nChannels[0])), 0, min(nSamples)-1).T
                 for chanindx in range(nChannels[0]):
-                    data[filenr][chanindx, :] = f.readSignal(chanindx)[0:min(nSamples)]
                     data[filenr, chanindx, :] = data[filenr, chanindx, :] - data[filenr, chanindx, :].mean(axis = 0)
 
                     if hpfreq:
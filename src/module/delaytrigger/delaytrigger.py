@@ -22,7 +22,6 @@
 import os
 import sys
 import time
-import threading
 
 if hasattr(sys, 'frozen'):
     path = os.path.split(sys.executable)[0]
@@ -46,44 +45,34 @@ sys.path.append(os.path.join(path, '../../lib'))
 import EEGsynth
 
 
-class TriggerThread(threading.Thread):
+class TriggerHandler():
     def __init__(self, input, delay, output, value):
-        threading.Thread.__init__(self)
         self.redischannel = input
         self.delay = delay
         self.output = output
         self.value = value
-        self.running = True
         self.timer = []
 
-    def stop(self):
+    def cancel(self):
         # cancel all timers that are still running
         monitor.debug('flushing %d timers' % len(self.timer))
         for t in self.timer:
             t.cancel()
         self.timer = []
-        self.running = False
 
-    def run(self):
+    def __call__(self, item):
         global patch, name, path, monitor, lock
-        pubsub = patch.pubsub()
-        pubsub.subscribe('DELAYTRIGGER_UNBLOCK')   # this message unblocks the Redis listen command
-        pubsub.subscribe(self.redischannel)        # this message triggers the event
-        while self.running:
-            for item in pubsub.listen():
-                if not self.running or not item['type'] == 'message':
-                    break
-                if item['channel'] == self.redischannel:
-                    # schedule the ouput trigger, it gets the specified value
-                    monitor.debug('scheduling %s after %g seconds' % (self.output, self.delay))
-                    if self.value==None:
-                        # send the value of the incoming trigger itself
-                        t = threading.Timer(self.delay, patch.setvalue, args=[self.output, item['data']])
-                    else:
-                        # send the value specified in the ini file
-                        t = threading.Timer(self.delay, patch.setvalue, args=[self.output, self.value])
-                    t.start()
-                    self.timer.append(t)
+        # schedule the ouput trigger, it gets the specified value
+        monitor.debug('scheduling %s after %g seconds' % (self.output, self.delay))
+        if self.value==None:
+            # send the value of the incoming trigger itself
+            t = scheduler.schedule(self.delay, patch.setvalue, args=[self.output, item['data']])
+        else:
+            # send the value specified in the ini file
+            t = scheduler.schedule(self.delay, patch.setvalue, args=[self.output, self.value])
+        # only keep the timers that are still pending
+        self.timer = [x for x in self.timer if x.active]
+        self.timer.append(t)
 
 
 def _setup():
@@ -108,22 +97,24 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global prefix, item, val, input_name, input_variable, output_name, output_variable, lock, trigger, thread
+    global prefix, item, val, input_name, input_variable, output_name, output_variable, lock, trigger, dispatcher, scheduler
 
-    # create the background threads that deal with the input triggers
+    # a single thread executes all delayed triggers
+    scheduler = EEGsynth.getscheduler()
+
+    # a single background thread receives all input triggers and passes them on to the handlers
+    dispatcher = EEGsynth.dispatcher(patch, monitor)
     trigger = []
-    monitor.debug("Setting up threads")
+    monitor.debug("Setting up handlers")
     for item in patch.config.items('input'):
         input = item[1]
         delay = patch.getfloat("delay", item[0])
         output = patch.getstring("output", item[0])
         value = patch.getfloat("value", item[0]) # when not specified this will return None
         monitor.info(input, '->', delay, '->', output)
-        trigger.append(TriggerThread(input, delay, output, value))
-
-    # start the thread for each of the triggers
-    for thread in trigger:
-        thread.start()
+        trigger.append(TriggerHandler(input, delay, output, value))
+        dispatcher.subscribe(input, trigger[-1])
+    dispatcher.start()
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -132,8 +123,19 @@ def _start():
 
 def _loop_once():
     '''Run the main loop once
+    This uses the global variables from setup and start, and adds a set of global variables
     '''
-    pass
+    global patch, name, path, monitor
+    global scheduler, pending, lateness, maxlateness
+
+    # report how well the delayed triggers keep up with their deadlines
+    pending, lateness, maxlateness = scheduler.statistics()
+    monitor.update('pending', pending, level='debug')
+    monitor.update('lateness', round(1000 * lateness, 1), level='debug')
+
+    # there should not be any local variables in this function, they should all be global
+    if len(locals()):
+        print('LOCALS: ' + ', '.join(locals().keys()))
 
 
 def _loop_forever():
@@ -142,19 +144,18 @@ def _loop_forever():
     global monitor, patch
     while True:
         monitor.loop()
+        _loop_once()
         time.sleep(patch.getfloat('general', 'delay'))
 
 
 def _stop():
     '''Stop and clean up on SystemExit, KeyboardInterrupt, RuntimeError
     '''
-    global monitor, trigger, r
+    global monitor, trigger, dispatcher, r
     monitor.success('Closing threads')
-    for thread in trigger:
-        thread.stop()
-    patch.publish('DELAYTRIGGER_UNBLOCK', 1)
-    for thread in trigger:
-        thread.join()
+    dispatcher.stop()
+    for this in trigger:
+        this.cancel()
 
 
 if __name__ == '__main__':
@@ -108,6 +108,9 @@ def _start():
     # this will contain the statistics of the historic_stat values
     historic_stat = {}
 
+    # in reactive mode the input channels are not read with getfloat, hence they should be watched explicitly
+    patch.watch(inputlist)
+
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
         print('LOCALS: ' + ', '.join(locals().keys()))
@@ -198,7 +201,7 @@ def _loop_once():
 def _loop_forever():
     '''Run the main loop forever
     '''
-    global monitor, stepize, elapsed, naptime
+    global monitor, stepize, elapsed, naptime, historic_data
     while True:
         # measure the time to correct for the slip
         start = time.time()
@@ -209,7 +212,12 @@ def _loop_forever():
         # correct for the slip
         elapsed = time.time() - start
         naptime = stepsize - elapsed
-        if naptime>0:
+
+        if np.array_equal(historic_data, np.broadcast_to(historic_data[:, -1:], historic_data.shape), equal_nan=True):
+            # the history is filled with the current values, hence the statistics only change once the input changes
+            # in reactive mode this waits until one of the input values has changed
+            patch.wait(max(naptime, 0))
+        elif naptime>0:
             time.sleep(naptime)
 
 
@@ -44,6 +44,7 @@ else:
 sys.path.append(os.path.join(path, '../../lib'))
 import EEGsynth
 import ArtNet
+import DMX
 
 
 def _setup():
@@ -77,23 +78,14 @@ def _start():
     address = [0, 0, patch.getint('artnet','universe')]
     artnet = ArtNet.ArtNet(ip=patch.getstring('artnet','broadcast'), port=patch.getint('artnet','port'))
 
-    # determine the size of the universe
-    dmxsize = 0
-    chanlist, chanvals = list(map(list, list(zip(*patch.config.items('input')))))
-    for chanindx in range(0, 512):
-        chanstr = "channel%03d" % (chanindx + 1)
-        if chanstr in chanlist:
-            # the last channel determines the size
-            dmxsize = chanindx + 1
-
+    # the mapping of the Redis values onto the DMX channels is determined once
     # FIXME the artnet code fails if the size is smaller than 512
-    dmxsize = 512
+    dmxframe = DMX.DMXFrame(patch, size=512)
+    dmxsize = dmxframe.size
     monitor.info("universe size = %d" % dmxsize)
 
-    # make an empty frame
-    dmxframe = [0] * dmxsize
     # blank out
-    artnet.broadcastDMX(dmxframe, address)
+    artnet.broadcastDMX(dmxframe.data, address)
 
     # keep a timer to send a packet every now and then
     prevtime = time.time()
@@ -109,42 +101,20 @@ def _loop_once():
     '''
     global patch, name, path, monitor
     global address, artnet, dmxsize, dmxframe, prevtime
-    global update, chanindx, chanstr, chanval, scale, offset
-
-    update = False
-
-    # loop over the control values, these are 1-offset in the ini file
-    for chanindx in range(0, dmxsize):
-        chanstr = "channel%03d" % (chanindx + 1)
-        # this returns None when the channel is not present
-        chanval = patch.getfloat('input', chanstr)
-
-        if chanval == None:
-            # the value is not present in Redis, skip it
-            continue
-
-        # the scale and offset options are channel specific
-        scale = patch.getfloat('scale', chanstr, default=255)
-        offset = patch.getfloat('offset', chanstr, default=0)
-        # apply the scale and offset
-        chanval = EEGsynth.rescale(chanval, slope=scale, offset=offset)
-        # ensure that it is within limits
-        chanval = EEGsynth.limit(chanval, lo=0, hi=255)
-        chanval = int(chanval)
-
-        # only update if the value has changed
-        if dmxframe[chanindx] != chanval:
-            monitor.info("DMX channel%03d = %g" % (chanindx, chanval))
-            dmxframe[chanindx] = chanval
-            update = True
-
-    if update:
-        artnet.broadcastDMX(dmxframe, address)
+    global changed, chanindx
+
+    # get all values at once and only send the frame if one of the channels has changed
+    changed = dmxframe.update()
+    for chanindx in changed:
+        monitor.info("DMX channel%03d = %g" % (chanindx + 1, dmxframe.data[chanindx]))
+
+    if len(changed):
+        artnet.broadcastDMX(dmxframe.data, address)
         prevtime = time.time()
 
-    elif (time.time() - prevtime) > 0.5:
-        # send a maintenance frame every 0.5 seconds
-        artnet.broadcastDMX(dmxframe, address)
+    elif (time.time() - prevtime) > patch.getfloat('general', 'refresh', default=0.5):
+        # send a maintenance frame every now and then
+        artnet.broadcastDMX(dmxframe.data, address)
         prevtime = time.time()
 
     # there should not be any local variables in this function, they should all be global
@@ -46,15 +46,16 @@ else:
 # the lib directory contains shared code
 sys.path.append(os.path.join(path, '../../lib'))
 import EEGsynth
+import DMX
 
 
 def sendframe(s, dmxframe):
     # See http://agreeabledisagreements.blogspot.nl/2012/10/a-beginners-guide-to-dmx512-in-python.html
     # See https://www.enttec.com/docs/dmx_usb_pro_api_spec.pdf
     # See https://github.com/itsb/DmxPy
-    packet = [0x7E, 0x06, ((len(dmxframe) + 1) >> 0) & 0xFF, ((len(dmxframe) + 1) >> 8) & 0xFF, 0x00] + dmxframe + [0xE7]
+    packet = bytearray([0x7E, 0x06, ((len(dmxframe) + 1) >> 0) & 0xFF, ((len(dmxframe) + 1) >> 8) & 0xFF, 0x00]) + bytearray(dmxframe) + bytearray([0xE7])
     monitor.debug(packet)
-    s.write(bytearray(packet))
+    s.write(packet)
 
 
 def _setup():
@@ -79,7 +80,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global serialdevice, s, dmxsize, chanlist, chanvals, chanindx, chanstr, dmxframe, prevtime, START_VAL, END_VAL, TX_DMX_PACKET, FRAME_PAD
+    global serialdevice, s, dmxsize, dmxframe, prevtime, START_VAL, END_VAL, TX_DMX_PACKET, FRAME_PAD
 
     # get the options from the configuration file
 
@@ -94,23 +95,14 @@ def _start():
     except:
         raise RuntimeError("cannot connect to serial port")
 
-    # determine the size of the universe
-    dmxsize = 0
-    chanlist, chanvals = list(map(list, list(zip(*patch.config.items('input')))))
-    for chanindx in range(0, 512):
-        chanstr = "channel%03d" % (chanindx + 1)
-        if chanstr in chanlist:
-            # the last channel determines the size
-            dmxsize = chanindx + 1
-
-    # my fixture won't work if the frame size is too small
-    dmxsize = max(dmxsize, 16)
+    # the mapping of the Redis values onto the DMX channels is determined once
+    # the last channel determines the size, but my fixture won't work if the frame size is too small
+    dmxframe = DMX.DMXFrame(patch, minsize=16)
+    dmxsize = dmxframe.size
     monitor.info("universe size = %d" % dmxsize)
 
-    # make an empty frame
-    dmxframe = [0] * dmxsize
     # blank out
-    sendframe(s, dmxframe)
+    sendframe(s, dmxframe.data)
 
     # keep a timer to send a packet every now and then
     prevtime = time.time()
@@ -125,43 +117,21 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global serialdevice, s, dmxsize, chanlist, chanvals, chanindx, chanstr, dmxframe, prevtime
-    global update, chanval, scale, offset
-
-    update = False
-
-    # loop over the control values, these are 1-offset in the ini file
-    for chanindx in range(0, dmxsize):
-        chanstr = "channel%03d" % (chanindx + 1)
-        # this returns None when the channel is not present
-        chanval = patch.getfloat('input', chanstr)
-
-        if chanval == None:
-            # the value is not present in Redis, skip it
-            continue
-
-        # the scale and offset options are channel specific
-        scale = patch.getfloat('scale', chanstr, default=255)
-        offset = patch.getfloat('offset', chanstr, default=0)
-        # apply the scale and offset
-        chanval = EEGsynth.rescale(chanval, slope=scale, offset=offset)
-        # ensure that it is within limits
-        chanval = EEGsynth.limit(chanval, lo=0, hi=255)
-        chanval = int(chanval)
-
-        # only update if the value has changed
-        if dmxframe[chanindx] != chanval:
-            monitor.info("DMX channel%03d = %g" % (chanindx, chanval))
-            dmxframe[chanindx] = chanval
-            update = True
-
-    if update:
-        sendframe(s, dmxframe)
+    global serialdevice, s, dmxsize, dmxframe, prevtime
+    global changed, chanindx
+
+    # get all values at once and only send the frame if one of the channels has changed
+    changed = dmxframe.update()
+    for chanindx in changed:
+        monitor.info("DMX channel%03d = %g" % (chanindx + 1, dmxframe.data[chanindx]))
+
+    if len(changed):
+        sendframe(s, dmxframe.data)
         prevtime = time.time()
 
-    elif (time.time() - prevtime) > 0.5:
-        # send a maintenance frame every 0.5 seconds
-        sendframe(s, dmxframe)
+    elif (time.time() - prevtime) > patch.getfloat('general', 'refresh', default=0.5):
+        # send a maintenance frame every now and then
+        sendframe(s, dmxframe.data)
         prevtime = time.time()
 
     # there should not be any local variables in this function, they should all be global
@@ -176,7 +146,9 @@ def _loop_forever():
     while True:
         monitor.loop()
         _loop_once()
-        time.sleep(patch.getfloat('general', 'delay'))
+        # in reactive mode this waits until one of the input values has changed
+        # but not longer than the interval at which the maintenance frame is sent
+        patch.wait(patch.getfloat('general', 'delay'), timeout=patch.getfloat('general', 'refresh', default=0.5))
 
 
 def _stop():
@@ -154,33 +154,21 @@ def sendMidi(name, code, val):
     outputport.send(msg)
 
 
-class TriggerThread(threading.Thread):
+class TriggerHandler():
     def __init__(self, redischannel, name, code):
-        threading.Thread.__init__(self)
         self.redischannel = redischannel
         self.name = name
         self.code = code
-        self.running = True
-    def stop(self):
-        self.running = False
-    def run(self):
-        pubsub = patch.pubsub()
-        pubsub.subscribe('OUTPUTMIDI_UNBLOCK')  # this message unblocks the redis listen command
-        pubsub.subscribe(self.redischannel)     # this message contains the value of interest
-        while self.running:
-            for item in pubsub.listen():
-                if not self.running or not item['type'] == 'message':
-                    break
-                if item['channel']==self.redischannel:
-                    monitor.trace(item)
-                    # map the Redis values to MIDI values
-                    val = float(item['data'])
-                    # the scale and offset options are channel specific and can be changed on the fly
-                    scale = patch.getfloat('scale', self.name, default=127)
-                    offset = patch.getfloat('offset', self.name, default=0)
-                    val = EEGsynth.rescale(val, slope=scale, offset=offset)
-                    with lock:
-                        sendMidi(self.name, self.code, val)
+    def __call__(self, item):
+        monitor.trace(item)
+        # map the Redis values to MIDI values
+        val = float(item['data'])
+        # the scale and offset options are channel specific and can be changed on the fly
+        scale = patch.getfloat('scale', self.name, default=127)
+        offset = patch.getfloat('offset', self.name, default=0)
+        val = EEGsynth.rescale(val, slope=scale, offset=offset)
+        with lock:
+            sendMidi(self.name, self.code, val)
 
 
 def _setup():
@@ -205,7 +193,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global mididevice, port, previous_note, trigger_name, trigger_code, code, trigger, this, thread, control_name, control_code, previous_val, duration_note, lock, midichannel, monitor, monophonic, offset_duration, offset_velocity, outputport, scale_duration, scale_velocity, velocity_note
+    global mididevice, port, previous_note, trigger_name, trigger_code, code, trigger, this, dispatcher, control_name, control_code, previous_val, duration_note, lock, midichannel, monitor, monophonic, offset_duration, offset_velocity, outputport, scale_duration, scale_velocity, velocity_note
 
     # this is only for debugging, and to check which MIDI devices are accessible
     monitor.info('------ MIDI OUTPUT ------')
@@ -258,17 +246,18 @@ def _start():
         trigger_code.append(None)
 
     # each of the Redis messages is mapped onto a different MIDI message
+    # a single background thread receives all messages and passes them on to the handlers
+    # sending to the MIDI port can block, hence this is done by a worker thread instead of the thread
+    # that receives the messages, a single worker ensures that the messages are sent in order
+    dispatcher = EEGsynth.dispatcher(patch, monitor, workers=1)
     trigger = []
     for name, code in zip(trigger_name, trigger_code):
         if patch.config.has_option('trigger', name):
-            # start the background thread that deals with this note
-            this = TriggerThread(patch.get('trigger', name), name, code)
+            this = TriggerHandler(patch.get('trigger', name), name, code)
+            dispatcher.subscribe(this.redischannel, this, slow=True)
             trigger.append(this)
             monitor.debug(name + ' trigger configured')
-
-    # start the thread for each of the triggers
-    for thread in trigger:
-        thread.start()
+    dispatcher.start()
 
     control_name = []
     control_code = []
@@ -298,7 +287,7 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global mididevice, port, previous_note, trigger_name, trigger_code, code, trigger, this, thread, control_name, control_code, previous_val, duration_note, lock, midichannel, monitor, monophonic, offset_duration, offset_velocity, outputport, scale_duration, scale_velocity, velocity_note
+    global mididevice, port, previous_note, trigger_name, trigger_code, code, trigger, this, dispatcher, control_name, control_code, previous_val, duration_note, lock, midichannel, monitor, monophonic, offset_duration, offset_velocity, outputport, scale_duration, scale_velocity, velocity_note
 
     UpdateParameters()
 
@@ -332,13 +321,9 @@ def _loop_forever():
 def _stop():
     '''Stop and clean up on SystemExit, KeyboardInterrupt, RuntimeError
     '''
-    global monitor, trigger, r
+    global monitor, dispatcher, r
     monitor.success('Closing threads')
-    for thread in trigger:
-        thread.stop()
-    patch.publish('OUTPUTMIDI_UNBLOCK', 1)
-    for thread in trigger:
-        thread.join()
+    dispatcher.stop()
 
 
 if __name__ == '__main__':
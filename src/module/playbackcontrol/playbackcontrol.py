@@ -45,6 +45,7 @@ else:
 sys.path.append(os.path.join(path, '../../lib'))
 import EEGsynth
 import EDF
+import Chunked
 
 
 def _setup():
@@ -69,14 +70,24 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global filename, f, chanindx, channels, channelz, fSample, nSamples, replace, i, s, z, blocksize, begsample, endsample, block
+    global filename, fileformat, f, chanindx, channels, channelz, fSample, nSamples, replace, i, s, z, blocksize, begsample, endsample, block, pace, prefetch, cache, cachebeg, seek
 
     # get the options from the configuration file
     filename = patch.getstring('playback', 'file')
 
     monitor.info("Reading data from " + filename)
 
-    f = EDF.EDFReader()
+    fileformat = patch.getstring('playback', 'format')
+    if fileformat is None:
+        # determine the file format from the file name
+        fileformat = os.path.splitext(filename)[1][1:]
+
+    if fileformat == 'edf':
+        f = EDF.EDFReader()
+    elif fileformat == 'chk':
+        f = Chunked.ChunkedReader()
+    else:
+        raise NotImplementedError('unsupported file format')
     f.open(filename)
 
     monitor.info("NSignals = " + str(f.getNSignals()))
@@ -90,8 +101,8 @@ def _start():
         if f.getNSamples()[chanindx] != f.getNSamples()[0]:
             raise AssertionError('unequal NSamples')
 
-    channels = f.getSignalTextLabels()
-    channelz = f.getSignalTextLabels()
+    channels = list(f.getSignalTextLabels())
+    channelz = list(f.getSignalTextLabels())
 
     fSample = f.getSignalFreqs()[0]
     nSamples = f.getNSamples()[0]
@@ -110,6 +121,17 @@ def _start():
     endsample = blocksize - 1
     block = 0
 
+    # the samples are written according to the sampling rate and the speed
+    pace = EEGsynth.pacer(fSample * patch.getfloat('playback', 'speed'))
+
+    # all channels are read from the file in larger blocks, which are kept in memory
+    prefetch = max(int(patch.getfloat('playback', 'prefetch', default=10) * fSample), 1)
+    cache = None
+    cachebeg = 0
+
+    # the position to seek to, the playback jumps whenever this changes
+    seek = None
+
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
         print('LOCALS: ' + ', '.join(locals().keys()))
@@ -120,8 +142,8 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global filename, f, chanindx, channels, channelz, fSample, nSamples, replace, i, s, z, blocksize, begsample, endsample, block
-    global indx, val, stepsize, elapsed, naptime
+    global filename, fileformat, f, chanindx, channels, channelz, fSample, nSamples, replace, i, s, z, blocksize, begsample, endsample, block, pace, prefetch, cache, cachebeg, seek
+    global val, rate, due, lateness, jitter, position
 
     if endsample > nSamples - 1:
         monitor.info("End of file reached, jumping back to start")
@@ -135,24 +157,53 @@ def _loop_once():
         endsample = blocksize - 1
         block = 0
 
+    position = patch.getfloat('playback', 'seek')
+    if position != None and position != seek:
+        seek = position
+        monitor.info("Seeking to " + str(seek) + " seconds")
+        begsample = min(max(int(seek * fSample), 0), nSamples - 1)
+        endsample = begsample + blocksize - 1
+        block = begsample
+        pace.reset()
+
     if not patch.getint('playback', 'play', default=1):
         monitor.info("Stopped")
+        pace.reset()
         time.sleep(0.1)
         return
 
     if patch.getint('playback', 'pause', default=0):
         monitor.info("Paused")
+        pace.reset()
         time.sleep(0.1)
         return
 
+    # the speed can be changed while playing, a speed of zero means as fast as possible
+    rate = fSample * patch.getfloat('playback', 'speed')
+    if rate != pace.rate:
+        # this also applies when going from zero to non-zero and back to the same speed
+        pace.reset(rate)
+    if rate <= 0:
+        due = 1
+    else:
+        # wait until the next sample is due, if it is late then the samples in between are skipped
+        due = min(pace.wait(), nSamples - endsample)
+        begsample += due - 1
+        endsample += due - 1
+        block += due - 1
+
     monitor.debug("Playing control value", block, 'from', begsample, 'to', endsample)
 
-    for indx in range(len(channelz)):
-        # read one sample for a single channel
-        val = float(f.readSamples(indx, begsample, endsample))
-        patch.setvalue(channelz[indx], val)
+    # get one sample for all channels
+    val = readsample(begsample)
+    patch.setvalues(dict(zip(channelz, val)))
+
+    if rate > 0:
+        pace.advance(due)
+        rate, lateness, jitter = pace.statistics()
+        monitor.update('rate', round(rate, 1), level='debug')
+        monitor.update('jitter', round(1000 * jitter, 1), level='debug')
 
-    stepsize = blocksize / (fSample * patch.getfloat('playback', 'speed'))
     begsample += blocksize
     endsample += blocksize
     block += 1
@@ -162,23 +213,25 @@ def _loop_once():
         print('LOCALS: ' + ', '.join(locals().keys()))
 
 
+def readsample(sample):
+    '''Get the values of all channels at the specified sample, these are read from the file in larger blocks
+    '''
+    global f, nSamples, prefetch, cache, cachebeg
+    if cache is None or sample < cachebeg or sample >= cachebeg + len(cache):
+        cachebeg = sample
+        cache = f.readSamples(list(range(f.getNSignals())), cachebeg, min(cachebeg + prefetch, nSamples) - 1)
+    return cache[sample - cachebeg]
+
+
 def _loop_forever():
     '''Run the main loop forever
     '''
-    global monitor, stepsize, elapsed, naptime
+    global monitor
     while True:
-        # measure the time to correct for the slip
-        start = time.time()
-
+        # the timing is done in _loop_once
         monitor.loop()
         _loop_once()
 
-        elapsed = time.time() - start
-        naptime = stepsize - elapsed
-        if naptime > 0:
-            # this approximates the real time streaming speed
-            time.sleep(naptime)
-
 
 def _stop():
     '''Stop and clean up on SystemExit, KeyboardInterrupt, RuntimeError
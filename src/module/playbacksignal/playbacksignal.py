@@ -25,6 +25,8 @@ import sys
 import time
 import wave
 import struct
+import threading
+import queue
 
 if hasattr(sys, 'frozen'):
     path = os.path.split(sys.executable)[0]
@@ -48,6 +50,103 @@ sys.path.append(os.path.join(path, '../../lib'))
 import EEGsynth
 import FieldTrip
 import EDF
+import Chunked
+
+
+class WAVReader():
+    """This reads blocks of samples from a WAV file, it has the same methods as the EDFReader
+    """
+    def __init__(self, fname, physical_min=-1, physical_max=1):
+        self.f = wave.open(fname, 'r')
+        self.nchans = self.f.getnchannels()
+        self.resolution = self.f.getsampwidth()  # 1, 2 or 4
+        # 8-bit samples are stored as unsigned bytes, ranging from 0 to 255.
+        # 16-bit samples are stored as signed integers in 2's-complement.
+        if self.resolution == 1:
+            self.dtype, self.zero, self.maxint = np.uint8, 128, MAXINT8
+        elif self.resolution == 2:
+            self.dtype, self.zero, self.maxint = np.dtype('<i2'), 0, MAXINT16
+        elif self.resolution == 4:
+            self.dtype, self.zero, self.maxint = np.dtype('<i4'), 0, MAXINT32
+        else:
+            raise NotImplementedError('unsupported resolution')
+        self.calibrate = (physical_max - physical_min) / 2 / float(self.maxint)
+    def getNSignals(self):
+        return self.nchans
+    def getSignalFreqs(self):
+        return np.array([self.f.getframerate()] * self.nchans)
+    def getNSamples(self):
+        return np.array([self.f.getnframes()] * self.nchans)
+    def getSignalTextLabels(self):
+        # there are no channel labels
+        return None
+    def readSamples(self, channel, begsample, endsample):
+        self.f.setpos(begsample)
+        x = np.frombuffer(self.f.readframes(endsample - begsample + 1), dtype=self.dtype).reshape(-1, self.nchans)
+        # convert and calibrate
+        x = x[:, channel].astype(np.float32)
+        x -= self.zero
+        x *= self.calibrate
+        return x
+    def close(self):
+        self.f.close()
+
+
+class ReadAheadThread(threading.Thread):
+    """This reads the blocks from the file in the background and keeps a limited number
+    of them in a queue. It continues at the start of the file when the end is reached.
+    """
+    def __init__(self, f, blocksize, readahead):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.f = f
+        self.channels = list(range(f.getNSignals()))
+        self.nsamples = f.getNSamples()[0]
+        self.blocksize = blocksize
+        self.queue = queue.Queue(maxsize=readahead)
+        self.lock = threading.Lock()
+        self.begsample = 0
+        self.generation = 0     # this is incremented on every seek, older blocks are discarded
+        self.running = True
+    def stop(self):
+        self.running = False
+    def seek(self, begsample):
+        with self.lock:
+            self.generation += 1
+            self.begsample = begsample
+            # remove the blocks that were already read
+            while not self.queue.empty():
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+    def read(self):
+        # returns the first sample and the data of the next block
+        while True:
+            try:
+                generation, begsample, dat = self.queue.get(timeout=1)
+            except queue.Empty:
+                if not self.is_alive():
+                    raise RuntimeError('cannot read from file')
+                continue
+            if generation == self.generation:
+                return begsample, dat
+    def run(self):
+        while self.running:
+            with self.lock:
+                generation = self.generation
+                begsample = self.begsample
+                if begsample + self.blocksize > self.nsamples:
+                    # jump back to the start of the file
+                    begsample = 0
+                self.begsample = begsample + self.blocksize
+            dat = self.f.readSamples(self.channels, begsample, begsample + self.blocksize - 1)
+            while self.running:
+                try:
+                    self.queue.put((generation, begsample, dat), timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
 
 
 def _setup():
@@ -72,7 +171,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global ft_host, ft_port, ft_output, filename, fileformat, MININT8, MAXINT8, MININT16, MAXINT16, MININT32, MAXINT32, stepsize, playback
+    global ft_host, ft_port, ft_output, filename, fileformat, MININT8, MAXINT8, MININT16, MAXINT16, MININT32, MAXINT32, playback
 
     try:
         ft_host = patch.getstring('fieldtrip', 'hostname')
@@ -100,9 +199,6 @@ def _start():
     MININT32 = -np.power(2., 31)
     MAXINT32 = np.power(2., 31) - 1
 
-    # this value will be updated later
-    stepsize = patch.getfloat('playback', 'blocksize') / patch.getfloat('playback', 'speed')
-
     # the playback will start in _loop_once()
     playback = False
 
@@ -112,30 +208,22 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global ft_host, ft_port, ft_output, filename, fileformat, ext, MININT8, MAXINT8, MININT16, MAXINT16, MININT32, MAXINT32, stepsize, playback
-    global f, H, chanindx, labels, A, blocksize, begsample, endsample, block, D
-
-    if playback and endsample > H.nSamples - 1:
-        monitor.info('End of file reached, jumping back to start')
-        begsample = 0
-        endsample = blocksize - 1
-        block = 0
+    global ft_host, ft_port, ft_output, filename, fileformat, ext, MININT8, MAXINT8, MININT16, MAXINT16, MININT32, MAXINT32, playback
+    global f, H, chanindx, labels, reader, pace, blocksize, begsample, endsample, block, D, nblocks, rate, lateness, jitter
 
     if playback and patch.getint('playback', 'rewind', default=0):
         monitor.info('Rewind pressed, jumping back to start of file')
-        begsample = 0
-        endsample = blocksize - 1
-        block = 0
+        reader.seek(0)
 
     if patch.getint('playback', 'pause', default=0):
         monitor.info('Paused')
-        playback = False
+        stopplayback()
         time.sleep(0.1)
         return
 
     if not patch.getint('playback', 'play', default=1):
         monitor.info('Stopped')
-        playback = False
+        stopplayback()
         time.sleep(0.1)
         return
 
@@ -146,70 +234,34 @@ def _loop_once():
         # determine the filename, it may have changed
         filename = patch.getstring('playback', 'file')
 
-        # construct the corresponding EEG header
-        H = FieldTrip.Header()
-
+        # only the header is read here, the data is read while playing
         if fileformat == 'edf':
             f = EDF.EDFReader()
             f.open(filename)
-            for chanindx in range(f.getNSignals()):
-                if f.getSignalFreqs()[chanindx] != f.getSignalFreqs()[0]:
-                    raise AssertionError('unequal SignalFreqs')
-                if f.getNSamples()[chanindx] != f.getNSamples()[0]:
-                    raise AssertionError('unequal NSamples')
-            H.nChannels = len(f.getSignalFreqs())
-            H.fSample = f.getSignalFreqs()[0]
-            H.nSamples = f.getNSamples()[0]
-            H.nEvents = 0
-            H.dataType = FieldTrip.DATATYPE_FLOAT32
-            # the channel labels will be written to the buffer
-            labels = f.getSignalTextLabels()
-            # read all the data from the file
-            A = np.ndarray(shape=(H.nSamples, H.nChannels), dtype=np.float32)
-            for chanindx in range(H.nChannels):
-                monitor.info('reading channel ' + str(chanindx))
-                A[:, chanindx] = f.readSignal(chanindx)
-            f.close()
-
+        elif fileformat == 'chk':
+            f = Chunked.ChunkedReader()
+            f.open(filename)
         elif fileformat == 'wav':
-            try:
-                physical_min = patch.getfloat('playback', 'physical_min')
-            except:
-                physical_min = -1
-            try:
-                physical_max = patch.getfloat('playback', 'physical_max')
-            except:
-                physical_max = 1
-            f = wave.open(filename, 'r')
-            resolution = f.getsampwidth()  # 1, 2 or 4
-            # 8-bit samples are stored as unsigned bytes, ranging from 0 to 255.
-            # 16-bit samples are stored as signed integers in 2's-complement.
-            H.nChannels = f.getnchannels()
-            H.fSample = f.getframerate()
-            H.nSamples = f.getnframes()
-            H.nEvents = 0
-            H.dataType = FieldTrip.DATATYPE_FLOAT32
-            # there are no channel labels
-            labels = None
-            # read all the data from the file
-            x = f.readframes(f.getnframes() * f.getnchannels())
-            f.close()
-            # convert and calibrate
-            if resolution == 2:
-                x = struct.unpack_from('%dh' % f.getnframes() * f.getnchannels(), x)
-                x = np.asarray(x).astype(np.float32).reshape(f.getnframes(), f.getnchannels())
-                y = x / float(MAXINT16)
-            elif resolution == 4:
-                x = struct.unpack_from('%di' % f.getnframes() * f.getnchannels(), x)
-                x = np.asarray(x).astype(np.float32).reshape(f.getnframes(), f.getnchannels())
-                y = x / float(MAXINT32)
-            else:
-                raise NotImplementedError('unsupported resolution')
-            A = y * ((physical_max - physical_min) / 2)
-
+            f = WAVReader(filename, patch.getfloat('playback', 'physical_min', default=-1), patch.getfloat('playback', 'physical_max', default=1))
         else:
             raise NotImplementedError('unsupported file format')
 
+        for chanindx in range(f.getNSignals()):
+            if f.getSignalFreqs()[chanindx] != f.getSignalFreqs()[0]:
+                raise AssertionError('unequal SignalFreqs')
+            if f.getNSamples()[chanindx] != f.getNSamples()[0]:
+                raise AssertionError('unequal NSamples')
+
+        # construct the corresponding EEG header
+        H = FieldTrip.Header()
+        H.nChannels = f.getNSignals()
+        H.fSample = f.getSignalFreqs()[0]
+        H.nSamples = f.getNSamples()[0]
+        H.nEvents = 0
+        H.dataType = FieldTrip.DATATYPE_FLOAT32
+        # the channel labels will be written to the buffer
+        labels = f.getSignalTextLabels()
+
         monitor.debug('nChannels = ' + str(H.nChannels))
         monitor.debug('nSamples = ' + str(H.nSamples))
         monitor.debug('fSample = ' + str(H.fSample))
@@ -218,51 +270,75 @@ def _loop_once():
         ft_output.putHeader(H.nChannels, H.fSample, H.dataType, labels=labels)
 
         blocksize = int(patch.getfloat('playback', 'blocksize') * H.fSample)
-        stepsize = blocksize / (H.fSample * patch.getfloat('playback', 'speed'))
         begsample = 0
         endsample = blocksize - 1
         block = 0
 
+        # start reading the blocks in the background
+        reader = ReadAheadThread(f, blocksize, patch.getint('playback', 'readahead', default=10))
+        reader.start()
+
+        # the blocks are written according to the sampling rate and the speed
+        pace = EEGsynth.pacer(H.fSample * patch.getfloat('playback', 'speed'))
+
     if playback:
-        monitor.info('Playing block ' + str(block) + ' from ' + str(begsample) + ' to ' + str(endsample))
+        # the speed can be changed while playing
+        rate = H.fSample * patch.getfloat('playback', 'speed')
+        if rate != pace.rate:
+            pace.reset(rate)
+
+        # wait until the next block is due, if it is late then multiple blocks are written at once to catch up
+        nblocks = min(int(np.ceil(pace.wait() / blocksize)), reader.queue.maxsize)
+
+        # get the next blocks that were read from file
+        begsample, D = reader.read()
+        if nblocks > 1:
+            D = np.concatenate([D] + [reader.read()[1] for block in range(nblocks - 1)])
+        endsample = begsample + len(D) - 1
+        if begsample < block * blocksize:
+            monitor.info('Jumped back to start of file')
+        block = begsample // blocksize
 
-        # copy the selected samples from the in-memory data
-        D = A[begsample:endsample + 1, :]
+        monitor.info('Playing block ' + str(block) + ' from ' + str(begsample) + ' to ' + str(endsample))
 
         # write the data to the output buffer
         ft_output.putData(D)
+        pace.advance(len(D))
 
-        begsample += blocksize
-        endsample += blocksize
-        block += 1
+        rate, lateness, jitter = pace.statistics()
+        monitor.update('rate', round(rate, 1), level='debug')
+        monitor.update('jitter', round(1000 * jitter, 1), level='debug')
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
         print('LOCALS: ' + ', '.join(locals().keys()))
 
 
+def stopplayback():
+    '''Stop reading from the file, playing starts again from the beginning
+    '''
+    global playback, reader, f
+    if playback:
+        reader.stop()
+        reader.join()
+        f.close()
+    playback = False
+
+
 def _loop_forever():
     '''Run the main loop forever
     '''
-    global monitor, stepsize, elapsed, naptime
+    global monitor
     while True:
-        # measure the time to correct for the slip
-        start = time.time()
-
+        # the timing is done in _loop_once
         monitor.loop()
         _loop_once()
 
-        elapsed = time.time() - start
-        naptime = stepsize - elapsed
-        if naptime > 0:
-            # this approximates the real time streaming speed
-            time.sleep(naptime)
-
 
 def _stop():
     '''Stop and clean up on SystemExit, KeyboardInterrupt, RuntimeError
     '''
-    pass
+    stopplayback()
 
 
 if __name__ == '__main__':
@@ -24,7 +24,6 @@ from PyQt5.QtWidgets import QApplication, QWidget
 import os
 import sys
 import time
-import threading
 import signal
 
 if hasattr(sys, 'frozen'):
@@ -49,30 +48,17 @@ sys.path.append(os.path.join(path, '../../lib'))
 import EEGsynth
 
 
-class TriggerThread(threading.Thread):
+class TriggerHandler():
     def __init__(self, redischannel, image):
-        threading.Thread.__init__(self)
         monitor.info("%s = %s" % (redischannel, image))
         self.redischannel = redischannel
         self.image = QtGui.QPixmap(image)                   # load the image from file
         self.image = self.image.scaled(winwidth, winheight) # scale the image to the window
-        self.running = True
 
-    def stop(self):
-        self.running = False
-
-    def run(self):
+    def __call__(self, item):
         global r, patch, lock, monitor
-        pubsub = patch.pubsub()
-        pubsub.subscribe('PLOTIMAGE_UNBLOCK')  # this message unblocks the redis listen command
-        pubsub.subscribe(self.redischannel)  # this message contains the trigger
-        while self.running:
-            for item in pubsub.listen():
-                if not self.running or not item['type'] == 'message':
-                    break
-                if item['channel'] == self.redischannel:
-                    window.setImage(self.image)
-                    window.paintEvent(None)
+        window.setImage(self.image)
+        window.paintEvent(None)
 
 
 class Window(QWidget):
@@ -123,7 +109,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global delay, winx, winy, winwidth, winheight, input_channel, input_image, app, timer, window, triggers, channel, image, thread
+    global delay, winx, winy, winwidth, winheight, input_channel, input_image, app, timer, window, triggers, channel, image, dispatcher
 
     # get the options from the configuration file
     delay           = patch.getfloat('general', 'delay')
@@ -150,14 +136,14 @@ def _start():
     timer.start(200)
     timer.timeout.connect(_loop_once)
 
+    # a single background thread receives all triggers and passes them on to the handlers
+    dispatcher = EEGsynth.dispatcher(patch, monitor)
     triggers = []
-    # make a trigger thread for each image
+    # make a trigger handler for each image
     for channel, image in zip(input_channel, input_image):
-        triggers.append(TriggerThread(channel, image))
-
-    # start the thread for each of the triggers
-    for thread in triggers:
-        thread.start()
+        triggers.append(TriggerHandler(channel, image))
+        dispatcher.subscribe(channel, triggers[-1])
+    dispatcher.start()
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -181,13 +167,9 @@ def _loop_forever():
 def _stop(*args):
     '''Stop and clean up on SystemExit, KeyboardInterrupt, RuntimeError
     '''
-    global monitor, triggers
+    global monitor, dispatcher
     monitor.success('Closing threads')
-    for thread in triggers:
-        thread.stop()
-    patch.publish('PLOTIMAGE_UNBLOCK', 1)
-    for thread in triggers:
-        thread.join()
+    dispatcher.stop()
     QApplication.quit()
 
 
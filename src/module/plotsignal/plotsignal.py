@@ -77,7 +77,7 @@ def _start():
         ft_port = patch.getint('fieldtrip', 'port')
         monitor.success('Trying to connect to buffer on %s:%i ...' % (ft_host, ft_port))
         ft_input = FieldTrip.Client()
-        ft_input.connect(ft_host, ft_port)
+        ft_input.connect(ft_host, ft_port, shared=patch.getint('fieldtrip', 'shared', default=0)>0)
         monitor.success('Connected to input FieldTrip buffer')
     except:
         raise RuntimeError("cannot connect to input FieldTrip buffer")
@@ -51,29 +51,17 @@ sys.path.append(os.path.join(path, '../../lib'))
 import EEGsynth
 
 
-class TriggerThread(threading.Thread):
+class TriggerHandler():
     def __init__(self, redischannel, number):
-        threading.Thread.__init__(self)
         self.redischannel = redischannel
         self.number = number
-        self.running = True
-    def stop(self):
-        self.running = False
-    def run(self):
-        pubsub = patch.pubsub()
-        pubsub.subscribe('PLOTTRIGGER_UNBLOCK')  # this message unblocks the redis listen command
-        pubsub.subscribe(self.redischannel)      # this message contains the note
-        while self.running:
-            for item in pubsub.listen():
-                if not self.running or not item['type'] == 'message':
-                    break
-                if item['channel']==self.redischannel:
-                    monitor.debug(item)
-                    now = time.time()
-                    val = float(item['data'])
-                    with lock:
-                        # append the time and value as a tuple
-                        data[self.number].append((now, val))
+    def __call__(self, item):
+        monitor.debug(item)
+        now = time.time()
+        val = float(item['data'])
+        with lock:
+            # append the time and value as a tuple
+            data[self.number].append((now, val))
 
 
 def _setup():
@@ -98,7 +86,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global delay, window, value, winx, winy, winwidth, winheight, data, lock, trigger, number, i, this, thread, app, win, timer, plot
+    global delay, window, value, winx, winy, winwidth, winheight, data, lock, trigger, number, i, this, dispatcher, app, win, timer, plot
 
     # get the options from the configuration file
     delay       = patch.getfloat('general', 'delay')            # in seconds
@@ -115,6 +103,8 @@ def _start():
     # this is to prevent two messages from being sent at the same time
     lock = threading.Lock()
 
+    # a single background thread receives all messages and passes them on to the handlers
+    dispatcher = EEGsynth.dispatcher(patch, monitor)
     trigger = []
     number = []
     # each of the gates is mapped onto a different message
@@ -123,16 +113,14 @@ def _start():
         if patch.config.has_option('gate', name):
             number.append(i)
             data[i] = []
-            # start the background thread that deals with this channel
-            this = TriggerThread(patch.get('gate', name), i)
+            this = TriggerHandler(patch.get('gate', name), i)
+            dispatcher.subscribe(this.redischannel, this)
             trigger.append(this)
             monitor.info(name + ' trigger configured')
     if len(trigger)==0:
         monitor.warning('no gates were specified in the ini file')
 
-    # start the thread for each of the notes
-    for thread in trigger:
-        thread.start()
+    dispatcher.start()
 
     # start the graphical user interface
     app = QtWidgets.QApplication(sys.argv)
@@ -172,7 +160,7 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global delay, window, value, winx, winy, winwidth, winheight, data, lock, trigger, number, i, this, thread, app, win, timer, plot
+    global delay, window, value, winx, winy, winwidth, winheight, data, lock, trigger, number, i, this, dispatcher, app, win, timer, plot
 
     monitor.loop()
 
@@ -216,13 +204,9 @@ def _loop_forever():
 def _stop(*args):
     '''Stop and clean up on SystemExit, KeyboardInterrupt, RuntimeError
     '''
-    global monitor, trigger
+    global monitor, dispatcher
     monitor.success('Closing threads')
-    for thread in trigger:
-        thread.stop()
-    patch.publish('PLOTTRIGGER_UNBLOCK', 1)
-    for thread in trigger:
-        thread.join()
+    dispatcher.stop()
     QtWidgets.QApplication.quit()
 
 
@@ -19,7 +19,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from numpy import log, log2, log10, exp, power, sqrt, mean, median, var, std, mod, random
+from numpy import random
 import numpy as np
 import os
 import sys
@@ -46,33 +46,15 @@ else:
 sys.path.append(os.path.join(path, '../../lib'))
 import EEGsynth
 
-# these function names can be used in the equation that gets parsed
-from EEGsynth import compress, limit, rescale, normalizerange, normalizestandard
-
 
 def rand(x):
     # the input variable is ignored
-    return np.asscalar(random.rand(1))
+    return float(random.rand())
 
 
 def randn(x):
     # the input variable is ignored
-    return np.asscalar(random.randn(1))
-
-
-def sanitize(equation):
-    equation.replace(' ', '')
-    equation = equation.replace('(', '( ')
-    equation = equation.replace(')', ' )')
-    equation = equation.replace('+', ' + ')
-    equation = equation.replace('-', ' - ')
-    equation = equation.replace('*', ' * ')
-    equation = equation.replace('/', ' / ')
-    equation = equation.replace(',', ' , ')
-    equation = equation.replace('>', ' > ')
-    equation = equation.replace('<', ' < ')
-    equation = ' '.join(equation.split())
-    return equation
+    return float(random.randn())
 
 
 def _setup():
@@ -97,7 +79,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global input_name, input_variable, output_name, output_equation, variable, equation
+    global input_name, input_variable, output_name, output_equation, variable, equation, equations
 
     if 'initial' in patch.config.sections():
         # assign the initial values
@@ -116,9 +98,6 @@ def _start():
     else:
         output_name, output_equation = ([], [])
 
-    # make the equations robust against sub-string replacements
-    output_equation = [sanitize(equation) for equation in output_equation]
-
     monitor.info('===== input variables =====')
     for name,variable in zip(input_name, input_variable):
         monitor.info(name + ' = ' + variable)
@@ -127,6 +106,12 @@ def _start():
         monitor.info(name + ' = ' + equation)
     monitor.info('============================')
 
+    # the equations are parsed and compiled only once
+    try:
+        equations = EEGsynth.expression(output_equation, input_name, functions={'rand': rand, 'randn': randn})
+    except ValueError as e:
+        raise RuntimeError(str(e))
+
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
         print('LOCALS: ' + ', '.join(locals().keys()))
@@ -137,36 +122,32 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global input_name, input_variable, output_name, output_equation, variable, equation
+    global input_name, input_variable, output_name, output_equation, variable, equation, equations
+    global input_value, output_value, failed, key, val, index, error
 
     monitor.debug('============================')
 
-    input_value = []
+    input_value = {}
     for name in input_name:
-        val = patch.getfloat('input', name, default=np.nan)
-        input_value.append(val)
-
-    for key, equation in zip(output_name, output_equation):
-        # replace the variable names in the equation by the values
-        for name, value in zip(input_name, input_value):
-            if value is None and equation.count(name)>0:
-                monitor.error('Undefined value: %s' % (name))
-            else:
-                equation = equation.replace(name, str(value))
-
-        # try to evaluate the equation
-        try:
-            equation = equation.replace('nan', 'np.nan')
-            equation = equation.replace('inf', 'np.inf')
-            val = eval(equation)
-            val = float(val) # deal with True/False
+        input_value[name] = patch.getfloat('input', name, default=np.nan)
+
+    output_value = equations.evaluate(input_value)
+
+    failed = []
+    for index, error in equations.errors:
+        if not isinstance(error, ZeroDivisionError):
+            # division by zero is not a serious error, the value will be nan
+            monitor.error('Error in evaluation: %s = %s' % (output_name[index], output_equation[index]))
+            failed.append(index)
+
+    for index, (key, equation, val) in enumerate(zip(output_name, output_equation, output_value)):
+        if not index in failed:
             monitor.debug('%s = %s = %g' % (key, equation, val))
             patch.setvalue(key, val)
-        except ZeroDivisionError:
-            # division by zero is not a serious error
-            patch.setvalue(equation[0], np.nan)
-        except:
-            monitor.error('Error in evaluation: %s = %s' % (key, equation))
+
+    # there should not be any local variables in this function, they should all be global
+    if len(locals()):
+        print('LOCALS: ' + ', '.join(locals().keys()))
 
 
 def _loop_forever():
@@ -176,7 +157,8 @@ def _loop_forever():
     while True:
         monitor.loop()
         _loop_once()
-        time.sleep(patch.getfloat('general', 'delay'))
+        # in reactive mode this waits until one of the input values has changed
+        patch.wait(patch.getfloat('general', 'delay'))
 
 
 def _stop():
@@ -76,7 +76,7 @@ def _start():
         ft_port = patch.getint('input_fieldtrip','port')
         monitor.info('Trying to connect to buffer on %s:%i ...' % (ft_host, ft_port))
         ft_input = FieldTrip.Client()
-        ft_input.connect(ft_host, ft_port)
+        ft_input.connect(ft_host, ft_port, shared=patch.getint('input_fieldtrip', 'shared', default=0)>0)
         monitor.info("Connected to input FieldTrip buffer")
     except:
         raise RuntimeError("cannot connect to input FieldTrip buffer")
@@ -186,13 +186,14 @@ def _loop_once():
 
     monitor.loop()
 
-    # determine when we start polling for available data
+    # determine when we start waiting for available data
     start = time.time()
 
-    while endsample>hdr_input.nSamples-1:
-        # wait until there is enough data
-        time.sleep(patch.getfloat('general', 'delay'))
-        hdr_input = ft_input.getHeader()
+    while True:
+        # wait until there is enough data and read it, the header and data are retrieved in the same round trip
+        hdr_input, dat_input = ft_input.waitData([begsample, endsample], 1000*patch.getfloat('general', 'delay'))
+        if dat_input is not None:
+            break
         if (hdr_input.nSamples-1)<(endsample-window):
             raise RuntimeError("buffer reset detected")
         if (time.time()-start)>timeout:
@@ -201,7 +202,7 @@ def _loop_once():
     # determine the start of the actual processing
     start = time.time()
 
-    dat_input  = ft_input.getData([begsample, endsample]).astype(np.float32)
+    dat_input  = dat_input.astype(np.float32)
     dat_output = dat_input
 
     monitor.trace("------------------------------------------------------------")
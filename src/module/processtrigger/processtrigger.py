@@ -19,7 +19,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from numpy import log, log2, log10, exp, power, sqrt, mean, median, var, std, mod
 from numpy import random
 import numpy as np
 import os
@@ -47,100 +46,62 @@ else:
 # the lib directory contains shared code
 sys.path.append(os.path.join(path, '../../lib'))
 import EEGsynth
-# these function names can be used in the equation that gets parsed
-from EEGsynth import compress, limit, rescale, normalizerange, normalizestandard
 
 
 def rand(x):
     # the input variable is ignored
-    return np.asscalar(random.rand(1))
+    return float(random.rand())
 
 
 def randn(x):
     # the input variable is ignored
-    return np.asscalar(random.randn(1))
+    return float(random.randn())
 
 
-def sanitize(equation):
-    equation.replace(' ', '')
-    equation = equation.replace('(', '( ')
-    equation = equation.replace(')', ' )')
-    equation = equation.replace('+', ' + ')
-    equation = equation.replace('-', ' - ')
-    equation = equation.replace('*', ' * ')
-    equation = equation.replace('/', ' / ')
-    equation = equation.replace(',', ' , ')
-    equation = equation.replace('>', ' > ')
-    equation = equation.replace('<', ' < ')
-    equation = ' '.join(equation.split())
-    return equation
-
-
-class TriggerThread(threading.Thread):
+class TriggerHandler():
     def __init__(self, redischannel, trigger):
-        threading.Thread.__init__(self)
         self.redischannel = redischannel
         self.trigger = trigger
-        self.running = True
-
-    def stop(self):
-        self.running = False
 
-    def run(self):
+    def __call__(self, item):
         global r, monitor, patch
-        pubsub = patch.pubsub()
-        pubsub.subscribe('PROCESSTRIGGER_UNBLOCK')  # this message unblocks the Redis listen command
-        pubsub.subscribe(self.redischannel)        # this message triggers the event
-        while self.running:
-            for item in pubsub.listen():
-                if not self.running or not item['type'] == 'message':
-                    break
-                if item['channel'] == self.redischannel:
-                    with lock:
-                        monitor.debug('----- %s ----- ' % (self.redischannel))
-                        input_value = []
-                        for name in input_name:
-                            # get the values of the input variables
-                            val = patch.getfloat('input', name)
-                            monitor.update(name, val)
-                            input_value.append(val)
-
-                        if patch.getint('conditional', self.trigger, default=1) == 0:
-                            continue
-
-                        for key, equation in zip(output_name[self.trigger], output_equation[self.trigger]):
-
-                            # replace the variable names in the equation by the values
-                            for name, value in zip(input_name, input_value):
-                                if value is None and equation.count(name) > 0:
-                                    monitor.error('Undefined value: %s' % (name))
-                                else:
-                                    equation = equation.replace(name, str(value))
-
-                            # also replace the variable name for the trigger by its value
-                            name = self.trigger
-                            value = float(item['data'])
-                            if value is None and equation.count(name) > 0:
-                                monitor.error('Undefined value: %s' % (name))
-                            else:
-                                equation = equation.replace(name, str(value))
-
-                            # try to evaluate each equation
-                            try:
-                                val = eval(equation)
-                                val = float(val)  # deal with True/False
-                                monitor.debug('%s = %s = %g' % (key, equation, val))
-                                patch.setvalue(key, val)
-                            except ZeroDivisionError:
-                                # division by zero is not a serious error
-                                patch.setvalue(equation[0], np.nan)
-                            except:
-                                monitor.error('Error in evaluation: %s = %s' % (key, equation))
-
-                        # send a copy of the original trigger with the given prefix
-                        key = '%s.%s' % (prefix, item['channel'])
-                        val = float(item['data'])
-                        patch.setvalue(key, val)
+        with lock:
+            monitor.debug('----- %s ----- ' % (self.redischannel))
+            input_value = {}
+            for name in input_name:
+                # get the values of the input variables
+                val = patch.getfloat('input', name)
+                monitor.update(name, val)
+                input_value[name] = val
+
+            if patch.getint('conditional', self.trigger, default=1) == 0:
+                return
+
+            # the variable name for the trigger gets its value
+            input_value[self.trigger] = float(item['data'])
+
+            for name in equations[self.trigger].names:
+                if input_value[name] is None:
+                    monitor.error('Undefined value: %s' % (name))
+
+            output_value = equations[self.trigger].evaluate(input_value)
+
+            failed = []
+            for index, error in equations[self.trigger].errors:
+                if not isinstance(error, ZeroDivisionError):
+                    # division by zero is not a serious error, the value will be nan
+                    monitor.error('Error in evaluation: %s = %s' % (output_name[self.trigger][index], output_equation[self.trigger][index]))
+                    failed.append(index)
+
+            for index, (key, equation, val) in enumerate(zip(output_name[self.trigger], output_equation[self.trigger], output_value)):
+                if not index in failed:
+                    monitor.debug('%s = %s = %g' % (key, equation, val))
+                    patch.setvalue(key, val)
+
+            # send a copy of the original trigger with the given prefix
+            key = '%s.%s' % (prefix, item['channel'])
+            val = float(item['data'])
+            patch.setvalue(key, val)
 
 
 def _setup():
@@ -165,7 +126,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global prefix, item, val, input_name, input_variable, output_name, output_equation, variable, equation, lock, trigger, thread
+    global prefix, item, val, input_name, input_variable, output_name, output_equation, equations, variable, equation, lock, trigger, dispatcher
 
     # get the options from the configuration file
     prefix = patch.getstring('output', 'prefix')
@@ -183,13 +144,16 @@ def _start():
     else:
         input_name, input_variable = ([], [])
 
-    # get the output equations for each trigger
+    # get the output equations for each trigger, these are parsed and compiled only once
     output_name = {}
     output_equation = {}
+    equations = {}
     for item in patch.config.items('trigger'):
         output_name[item[0]], output_equation[item[0]] = list(zip(*patch.config.items(item[0])))
-        # make the equations robust against sub-string replacements
-        output_equation[item[0]] = [sanitize(equation) for equation in output_equation[item[0]]]
+        try:
+            equations[item[0]] = EEGsynth.expression(output_equation[item[0]], list(input_name) + [item[0]], functions={'rand': rand, 'randn': randn})
+        except ValueError as e:
+            raise RuntimeError(str(e))
 
     monitor.info('===== input variables =====')
     for name, variable in zip(input_name, input_variable):
@@ -203,16 +167,15 @@ def _start():
     # this is to prevent two triggers from being processed at the same time
     lock = threading.Lock()
 
-    # create the background threads that deal with the triggers
+    # a single background thread receives all triggers and passes them on to the handlers
+    dispatcher = EEGsynth.dispatcher(patch, monitor)
     trigger = []
-    monitor.debug("Setting up threads for each trigger")
+    monitor.debug("Setting up handlers for each trigger")
     for item in patch.config.items('trigger'):
-        trigger.append(TriggerThread(item[1], item[0]))
+        trigger.append(TriggerHandler(item[1], item[0]))
+        dispatcher.subscribe(item[1], trigger[-1])
         monitor.debug(item[0] + " " + item[1] + " OK")
-
-    # start the thread for each of the triggers
-    for thread in trigger:
-        thread.start()
+    dispatcher.start()
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -236,13 +199,9 @@ def _loop_forever():
 def _stop(*args):
     '''Stop and clean up on SystemExit, KeyboardInterrupt, RuntimeError
     '''
-    global monitor, trigger, r
+    global monitor, dispatcher, r
     monitor.success('Closing threads')
-    for thread in trigger:
-        thread.stop()
-    patch.publish('PROCESSTRIGGER_UNBLOCK', 1)
-    for thread in trigger:
-        thread.join()
+    dispatcher.stop()
 
 
 if __name__ == '__main__':
@@ -147,7 +147,8 @@ def _loop_forever():
     while True:
         monitor.loop()
         _loop_once()
-        time.sleep(patch.getfloat('general', 'delay'))
+        # in reactive mode this waits until one of the input values has changed
+        patch.wait(patch.getfloat('general', 'delay'))
 
 
 def _stop(*args):
@@ -48,6 +48,7 @@ else:
 sys.path.append(os.path.join(path, '../../lib'))
 import EEGsynth
 import EDF
+import Chunked
 
 
 def _setup():
@@ -105,7 +106,8 @@ def _loop_once():
     '''
     global patch, name, path, monitor
     global MININT16, MAXINT16, MININT32, MAXINT32, delay, filename, fileformat, filenumber, recording, adjust, maxabs
-    global start, fname, f, ext, blocksize, synchronize, csvwriter, channels, channelz, nchans, sample, replace, i, s, z, physical_min, physical_max, meas_info, chan_info, recstart, D, chan, xval, elapsed
+    global start, fname, f, ext, blocksize, synchronize, csvwriter, channels, channelz, nchans, sample, replace, i, s, z, physical_min, physical_max, meas_info, chan_info, recstart, D, elapsed
+    global rescan, lastscan, key, newkeys
 
     # measure the time to correct for the slip
     start = time.time()
@@ -137,6 +139,9 @@ def _loop_once():
         channels = sorted(patch.redis.keys('*'))
         channelz = sorted(patch.redis.keys('*'))
         nchans = len(channels)
+        # the keys are checked regularly, new keys will be recorded in a new file
+        rescan = patch.getfloat('recording', 'rescan', default=5)
+        lastscan = time.time()
         # this is to keep track of the number of samples written so far
         sample = 0
 
@@ -173,7 +178,7 @@ def _loop_once():
             chan_info['digital_max'] = nchans * [MAXINT16]
             chan_info['ch_names'] = channelz
             chan_info['n_samps'] = nchans * [1]
-            f = EDF.EDFWriter(fname)
+            f = EDF.EDFWriter(fname, buffersize=patch.getint('recording', 'buffersize', default=-1))
             f.writeHeader((meas_info, chan_info))
         elif fileformat == 'wav':
             f = wave.open(fname, 'w')
@@ -189,18 +194,27 @@ def _loop_once():
             f = open(fname, 'w')
             csvwriter = csv.writer(f, delimiter='\t')
             csvwriter.writerow(channelz)
+        elif fileformat == 'chk':
+            # the samples are collected in chunks of approximately one second
+            f = Chunked.ChunkedWriter(fname, chunksize=max(int(1. / delay), 1), compression=patch.getstring('recording', 'compression', default='none'))
+            f.writeHeader(nchans, 1. / delay, channelz)
         else:
             raise NotImplementedError('unsupported file format')
 
+    if recording and rescan > 0 and (time.time() - lastscan) > rescan:
+        lastscan = time.time()
+        key = "{}.synchronize".format(patch.getstring('prefix', 'synchronize'))
+        newkeys = set(patch.redis.keys('*')) - set(channels) - set([key])
+        if len(newkeys):
+            monitor.info("New keys " + ", ".join(sorted(newkeys)) + " - closing " + fname)
+            f.close()
+            recording = False
+            return
+
     if recording:
-        D = []
-        for chan in channels:
-            try:
-                xval = float(patch.redis.get(chan))
-            except:
-                xval = 0.
-            xval = EEGsynth.limit(xval, physical_min, physical_max)
-            D.append([xval])
+        # get the values of all channels in a single request
+        D = np.array([tofloat(xval) for xval in (patch.redis.mget(channels) if nchans else [])], ndmin=2).transpose()
+        D = np.clip(D, physical_min, physical_max)
         sample += 1
 
         if (sample % synchronize) == 0:
@@ -232,6 +246,9 @@ def _loop_once():
             csvwriter.writerow([item for sublist in D for item in sublist])
         elif fileformat == 'tsv':
             csvwriter.writerow([item for sublist in D for item in sublist])
+        elif fileformat == 'chk':
+            # the actual time of each sample is stored, since the timing of the loop is not exact
+            f.writeBlock(np.transpose(D), start)
 
         time.sleep(adjust * delay)
 
@@ -245,6 +262,15 @@ def _loop_once():
         print('LOCALS: ' + ', '.join(locals().keys()))
 
 
+def tofloat(xval):
+    '''Convert the value from Redis, missing or invalid values are recorded as zero
+    '''
+    try:
+        return float(xval)
+    except:
+        return 0.
+
+
 def _loop_forever():
     '''Run the main loop forever
     '''
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-# This module records data from a FieldTrip buffer to an EDF or WAV file
+# This module records data from a FieldTrip buffer to an EDF, WAV, CSV, TSV or chunked binary file
 #
 # This software is part of the EEGsynth project, see <https://github.com/eegsynth/eegsynth>.
 #
@@ -27,6 +27,8 @@ import time
 import wave
 import struct
 import csv
+import threading
+import queue
 
 if hasattr(sys, 'frozen'):
     path = os.path.split(sys.executable)[0]
@@ -50,6 +52,115 @@ sys.path.append(os.path.join(path, '../../lib'))
 import EEGsynth
 import FieldTrip
 import EDF
+import Chunked
+
+
+class WriterThread(threading.Thread):
+    """The data blocks are written to file in the background, so that the main loop can keep
+    up with the FieldTrip buffer while the disk is temporarily slow. Each block is queued
+    together with the file it belongs to, which allows a new file to be opened while the
+    previous one is still being completed.
+    """
+    def __init__(self, queuesize=60, overflow='wait'):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue.Queue(maxsize=queuesize)
+        self.overflow = overflow
+        self.dropped = 0        # number of blocks that were not written
+        self.lag = 0            # in seconds, between reading and writing the most recent block
+        self.f = None
+        self.maxabs = 0
+        self.error = None       # the exception that stopped the thread
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError('cannot write to file: %s' % self.error)
+        elif not self.is_alive():
+            raise RuntimeError('the writer thread has stopped')
+    def put(self, item):
+        # do not wait forever for room in the queue if the thread has stopped
+        while True:
+            self.check()
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+    def write(self, f, fileformat, physical_range, dat, timestamp=None):
+        self.check()
+        item = (f, fileformat, physical_range, dat, timestamp, time.time())
+        if self.overflow == 'drop':
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.dropped += 1
+                monitor.warning('the queue is full, dropping %d samples' % len(dat))
+        else:
+            self.put(item)
+    def close(self, f):
+        # this is never dropped
+        self.put((f, None, None, None, None, time.time()))
+    def stop(self):
+        # the remaining blocks are written before the thread stops
+        if self.is_alive():
+            try:
+                self.put(None)
+            except RuntimeError:
+                pass
+            self.join()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            f, fileformat, physical_range, dat, timestamp, enqueued = item
+            try:
+                if fileformat is None:
+                    f.close()
+                else:
+                    self.writeBlock(f, fileformat, physical_range, dat, timestamp)
+            except Exception as e:
+                monitor.error('cannot write to file: %s' % e)
+                self.error = e
+                break
+            self.lag = time.time() - enqueued
+    def writeBlock(self, f, fileformat, physical_range, dat, timestamp):
+        if not f is self.f:
+            self.f = f
+            self.maxabs = 0
+        if fileformat == 'edf':
+            # the scaling is done in the EDF writer
+            f.writeBlock(np.transpose(dat))
+        elif fileformat == 'wav':
+            self.maxabs = max(np.max(np.abs(dat)), self.maxabs)
+            if monitor.update('maxabs', self.maxabs) and self.maxabs>1:
+                monitor.warning('the signal is clipping')
+            physical_min, physical_max = physical_range
+            # scale the floating point values between -1 and 1
+            y = dat / ((physical_max - physical_min) / 2.)
+            # the values cannot exceed the range from -1 to +1 in an int32 wav file
+            y = np.clip(y, -1.0, 1.0)
+            # scale the floating point values between MININT32 and MAXINT32
+            y = y * ((float(MAXINT32) - float(MININT32)) / 2)
+            # convert them to packed binary int32 data, the samples of all channels are interleaved
+            f.writeframesraw(y.astype('<i4').tobytes())
+        elif fileformat == 'csv' or fileformat == 'tsv':
+            f.writerows(dat)
+        elif fileformat == 'chk':
+            # the timestamp of the first sample is estimated from the moment it was read
+            f.writeBlock(dat, timestamp)
+
+
+class CSVFile():
+    """This combines the file and the csv writer, so that they can be passed together to the writer thread
+    """
+    def __init__(self, fname, delimiter):
+        self.file = open(fname, 'w')
+        self.csvwriter = csv.writer(self.file, delimiter=delimiter)
+    def writerows(self, rows):
+        self.csvwriter.writerows(rows)
+    def close(self):
+        self.file.close()
 
 
 def _setup():
@@ -74,7 +185,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global MININT16, MAXINT16, MININT32, MAXINT32, timeout, filename, fileformat, ft_host, ft_port, ft_input, hdr_input, start, recording, maxabs
+    global MININT16, MAXINT16, MININT32, MAXINT32, timeout, filename, fileformat, ft_host, ft_port, ft_input, hdr_input, start, recording, writer
 
     MININT16 = -np.power(2, 15)
     MAXINT16 = np.power(2, 15) - 1
@@ -115,7 +226,10 @@ def _start():
     monitor.debug(hdr_input.labels)
 
     recording = False
-    maxabs = 0
+
+    # the data is written to file in a separate thread
+    writer = WriterThread(queuesize=patch.getint('recording', 'queuesize', default=60), overflow=patch.getstring('recording', 'overflow', default='wait'))
+    writer.start()
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -127,20 +241,20 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global MININT16, MAXINT16, MININT32, MAXINT32, timeout, filename, fileformat, ft_host, ft_port, ft_input, hdr_input, start, recording, maxabs
-    global fname, f, ext, blocksize, synchronize, csvwriter, physical_min, physical_max, meas_info, chan_info, now, sample, begsample, endsample, startsample, dat, key
+    global MININT16, MAXINT16, MININT32, MAXINT32, timeout, filename, fileformat, ft_host, ft_port, ft_input, hdr_input, start, recording, writer
+    global fname, f, ext, blocksize, synchronize, physical_min, physical_max, meas_info, chan_info, now, sample, begsample, endsample, startsample, dat, key
 
     hdr_input = ft_input.getHeader()
 
     if recording and hdr_input is None:
         monitor.info("Header is empty - closing " + fname)
-        f.close()
+        writer.close(f)
         recording = False
         return
 
     if recording and not patch.getint('recording', 'record'):
         monitor.info("Recording disabled - closing " + fname)
-        f.close()
+        writer.close(f)
         recording = False
         return
 
@@ -150,7 +264,6 @@ def _loop_once():
 
     if not recording and patch.getint('recording', 'record'):
         recording = True
-        maxabs = 0
         # determine the filename, it may have changed
         filename = patch.getstring('recording', 'file')
         # open a new file
@@ -189,7 +302,7 @@ def _loop_once():
             chan_info['ch_names'] = hdr_input.labels
             chan_info['n_samps'] = hdr_input.nChannels * [blocksize]
             monitor.info(chan_info)
-            f = EDF.EDFWriter(fname)
+            f = EDF.EDFWriter(fname, buffersize=patch.getint('recording', 'buffersize', default=-1))
             f.writeHeader((meas_info, chan_info))
         elif fileformat == 'wav':
             f = wave.open(fname, 'w')
@@ -198,11 +311,12 @@ def _loop_once():
             f.setsampwidth(4)  # 1, 2 or 4
             f.setframerate(hdr_input.fSample)
         elif fileformat == 'csv':
-            f = open(fname, 'w')
-            csvwriter = csv.writer(f, delimiter=',')
+            f = CSVFile(fname, delimiter=',')
         elif fileformat == 'tsv':
-            f = open(fname, 'w')
-            csvwriter = csv.writer(f, delimiter='\t')
+            f = CSVFile(fname, delimiter='\t')
+        elif fileformat == 'chk':
+            f = Chunked.ChunkedWriter(fname, chunksize=blocksize, compression=patch.getstring('recording', 'compression', default='none'))
+            f.writeHeader(hdr_input.nChannels, hdr_input.fSample, hdr_input.labels)
         else:
             raise NotImplementedError('unsupported file format')
 
@@ -218,7 +332,7 @@ def _loop_once():
 
     if recording and hdr_input.nSamples < begsample - 1:
         monitor.info("Header was reset - closing " + fname)
-        f.close()
+        writer.close(f)
         recording = False
         return
 
@@ -235,30 +349,11 @@ def _loop_once():
             patch.setvalue(key, endsample - startsample + 1)
         dat = ft_input.getData([begsample, endsample]).astype(np.float64)
         monitor.info("Writing sample " + str(begsample) + " to " + str(endsample) + " as " + str(np.shape(dat)))
-        if fileformat == 'edf':
-            # the scaling is done in the EDF writer
-            f.writeBlock(np.transpose(dat))
-        elif fileformat == 'wav':
-            for x in dat:
-                maxabs = max(max(abs(x)), maxabs)
-                if monitor.update('maxabs', maxabs) and maxabs>1:
-                    monitor.warning('the signal is clipping')
-                # scale the floating point values between -1 and 1
-                y = x / ((physical_max - physical_min) / 2.)
-                # the values cannot exceed the range from -1 to +1 in an int32 wav file
-                y = np.clip(y, -1.0, 1.0)
-                # scale the floating point values between MININT32 and MAXINT32
-                y = y * ((float(MAXINT32) - float(MININT32)) / 2)
-                # convert them to packed binary int32 data
-                z = [int(item) for item in y]
-                f.writeframesraw(wave.struct.pack('i' * len(z), *z))
-                del x, y, z
-        elif fileformat == 'csv':
-            for sample in range(len(dat)):
-                csvwriter.writerow(dat[sample, :])
-        elif fileformat == 'tsv':
-            for sample in range(len(dat)):
-                csvwriter.writerow(dat[sample, :])
+        # the conversion and writing is done in the background
+        writer.write(f, fileformat, (physical_min, physical_max), dat, time.time() - (hdr_input.nSamples - begsample) / hdr_input.fSample)
+        monitor.update('queue', writer.queue.qsize(), level='debug')
+        monitor.update('lag', round(writer.lag, 1), level='debug')
+        monitor.update('dropped', writer.dropped, level='debug')
         begsample += blocksize
         endsample += blocksize
 
@@ -279,13 +374,19 @@ def _loop_forever():
 def _stop(*args):
     '''Stop and clean up on SystemExit, KeyboardInterrupt, RuntimeError
     '''
-    global monitor, ft_input, recording, fname, f
+    global monitor, ft_input, recording, fname, f, writer
     ft_input.disconnect()
     monitor.success('Disconnected from input FieldTrip buffer')
     if recording:
         recording = False
         monitor.info("Closing " + fname)
-        f.close()
+        try:
+            writer.close(f)
+        except RuntimeError:
+            # the writer thread has already stopped because of an error
+            pass
+    # wait for the remaining data to be written
+    writer.stop()
 
 
 if __name__ == '__main__':
@@ -76,7 +76,8 @@ def _start():
     if broker=='zeromq':
         monitor.success('starting the zeromq broker')
         port = patch.getint('zeromq', 'port', default=5555)
-        server = ZmqRedis.server(port=port)
+        notify = patch.getint('zeromq', 'notify', default=0)>0
+        server = ZmqRedis.server(port=port, notify=notify)
 
     elif broker=='redis':
         msg = 'the Redis broker should be started using "redis.sh" or by calling it directly'
@@ -24,6 +24,7 @@ import numpy as np
 import os
 import sys
 import time
+from scipy.signal import lfilter
 
 if hasattr(sys, 'frozen'):
     path = os.path.split(sys.executable)[0]
@@ -70,7 +71,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global ft_host, ft_port, ft_input, timeout, hdr_input, start, channel_items, channame, chanindx, item, prefix, window, begsample, endsample
+    global ft_host, ft_port, ft_input, timeout, hdr_input, start, channel_items, channame, chanindx, item, prefix, window, windows, suffix, maxwindow, ring, sumsq, written, exponential, alpha, zi, begsample, endsample
 
     try:
         ft_host = patch.getstring('fieldtrip', 'hostname')
@@ -107,8 +108,23 @@ def _start():
         chanindx.append(patch.getint('input', item[0]) - 1)  # the channel number
 
     prefix = patch.getstring('output', 'prefix')
-    window = patch.getfloat('processing', 'window')     # in seconds
-    window = int(window * hdr_input.fSample)            # in samples
+    windows = patch.getfloat('processing', 'window', multiple=True)     # in seconds
+    # the first window is written as prefix.channel, additional ones as prefix.channel.<window>ms
+    suffix = [''] + ['.%dms' % round(1000 * window) for window in windows[1:]]
+    windows = [max(int(window * hdr_input.fSample), 1) for window in windows]  # in samples
+    window = windows[0]
+    maxwindow = max(windows)
+
+    # the squared samples of the longest window are kept in a ring, and the sum of squares for each window
+    ring = np.zeros((maxwindow, len(chanindx)))
+    sumsq = np.zeros((len(windows), len(chanindx)))
+    written = 0     # the number of samples that were written to the ring
+
+    # optionally also compute an exponentially weighted rms, this is written as prefix.channel.exponential
+    exponential = patch.getfloat('processing', 'exponential')     # time constant in seconds
+    if exponential:
+        alpha = math.exp(-1. / (exponential * hdr_input.fSample))
+    zi = None
 
     begsample = -1
     endsample = -1
@@ -123,37 +139,69 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global ft_host, ft_port, ft_input, timeout, hdr_input, start, channel_items, channame, chanindx, item, prefix, window, begsample, endsample
-    global dat, rms, i, chanvec, chanval, name, val, key
+    global ft_host, ft_port, ft_input, timeout, hdr_input, start, channel_items, channame, chanindx, item, prefix, window, windows, suffix, maxwindow, ring, sumsq, written, exponential, alpha, zi, begsample, endsample
+    global dat, rms, i, w, first, leaving, emarms, name, val, key
 
     hdr_input = ft_input.getHeader()
     if (hdr_input.nSamples - 1) < endsample:
         raise RuntimeError("buffer reset detected")
-    if hdr_input.nSamples < window:
+    if hdr_input.nSamples < maxwindow:
         # there are not yet enough samples in the buffer
         monitor.info('Waiting for data to arrive...')
         return
 
-    # get the most recent data segment
-    begsample = hdr_input.nSamples - window
+    # get the samples that arrived since the previous iteration, but no more than the longest window
+    begsample = max(endsample + 1, hdr_input.nSamples - maxwindow)
     endsample = hdr_input.nSamples - 1
+    if endsample < begsample:
+        # there is no new data
+        return
     dat = ft_input.getData([begsample, endsample]).astype(np.double)
-    dat = dat[:, chanindx]
-
-    rms = [0.] * len(chanindx)
-    for i, chanvec in enumerate(dat.transpose()):
-        for chanval in chanvec:
-            rms[i] += chanval * chanval
-        if rms[i]>0:
-            # this avoids an occasional "ValueError: math domain error"
-            rms[i] = math.sqrt(rms[i] / window)
-
-    monitor.update("rms", rms)
-
-    for name, val in zip(channame, rms):
-        # send it as control value: prefix.channelX=val
-        key = "%s.%s" % (prefix, name)
-        patch.setvalue(key, val)
+    dat = dat[:, chanindx]**2
+
+    if exponential:
+        # the squared samples are filtered with a first-order IIR filter
+        if zi is None:
+            zi = np.tile(dat[0], (1, 1)) * alpha
+        emarms, zi = lfilter([1 - alpha], [1, -alpha], dat, axis=0, zi=zi)
+        emarms = np.sqrt(emarms[-1])
+
+    if len(dat) == maxwindow:
+        # the ring is filled completely, compute the sums from scratch
+        ring[:] = dat
+        written = 0
+        for i, w in enumerate(windows):
+            sumsq[i] = dat[-w:].sum(axis=0)
+    else:
+        # update the sums with the samples that enter and leave each window
+        first = written
+        for i, w in enumerate(windows):
+            # the samples that leave are either in the ring, or (for short windows) in the new data
+            leaving = ring[np.arange(first - w, first - w + min(len(dat), w)) % maxwindow]
+            if len(dat) > w:
+                leaving = np.concatenate((leaving, dat[0:len(dat) - w]))
+            sumsq[i] += dat.sum(axis=0) - leaving.sum(axis=0)
+        ring[np.arange(first, first + len(dat)) % maxwindow] = dat
+        if (first % maxwindow) + len(dat) >= maxwindow:
+            # recompute the sums once per cycle through the ring, this prevents rounding errors from accumulating
+            for i, w in enumerate(windows):
+                sumsq[i] = ring[np.arange(first + len(dat) - w, first + len(dat)) % maxwindow].sum(axis=0)
+    written = (written + len(dat)) % maxwindow
+
+    rms = np.sqrt(np.maximum(sumsq, 0) / np.array(windows)[:, np.newaxis])
+
+    monitor.update("rms", list(rms[0]))
+
+    for i in range(len(windows)):
+        for name, val in zip(channame, rms[i]):
+            # send it as control value: prefix.channelX=val
+            key = "%s.%s%s" % (prefix, name, suffix[i])
+            patch.setvalue(key, val)
+
+    if exponential:
+        for name, val in zip(channame, emarms):
+            key = "%s.%s.exponential" % (prefix, name)
+            patch.setvalue(key, val)
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -79,119 +79,106 @@ def callback(in_data, frame_count, time_info, status):
     return buf, pyaudio.paContinue
 
 
-class TriggerThread(threading.Thread):
+class TriggerHandler():
     def __init__(self, redischannel, sample):
-        threading.Thread.__init__(self)
         self.redischannel = redischannel
         self.sample = sample
-        self.running = True
 
-    def stop(self):
-        self.running = False
-
-    def run(self):
+    def __call__(self, item):
         global r, monitor, patch, stack, current_channel, current_value
-        pubsub = patch.pubsub()
-        pubsub.subscribe('SAMPLER_UNBLOCK')  # this message unblocks the Redis listen command
-        pubsub.subscribe(self.redischannel)  # this message triggers the event
-        while self.running:
-            for item in pubsub.listen():
-                if not self.running or not item['type'] == 'message':
-                    break
-                if item['channel'] == self.redischannel:
-                    # if value=0, the previous sample is stopped
-                    # if value=N, the Nth sample is played
-                    val = float(item['data'])
-                    scale_data = patch.getfloat('scale', self.redischannel, default=1)
-                    offset_data = patch.getfloat('offset', self.redischannel, default=0)
-                    val = EEGsynth.rescale(val, slope=scale_data, offset=offset_data)
-                    val = int(val)
-
-                    if val == 0:
-                        if current_channel == self.redischannel:
-                            with lock:
-                                stack = np.zeros((0, channels), dtype=np.float32)
-                                current_channel = None
-                                current_value = val
-
-                    elif len(self.sample) >= val:
-                        # update the parameters
-                        scaling = patch.getfloat('audio', 'scaling', default=1)
-                        scaling = EEGsynth.rescale(scaling, slope=scale_scaling, offset=offset_scaling)
-                        monitor.update("scaling", scaling)
-
-                        speed = patch.getfloat('audio', 'speed', default=1)
-                        speed = EEGsynth.rescale(speed, slope=scale_speed, offset=offset_speed)
-                        monitor.update("speed", speed)
-
-                        onset = patch.getfloat('audio', 'onset', default=0)
-                        onset = EEGsynth.rescale(onset, slope=scale_onset, offset=offset_onset)
-                        monitor.update("onset", onset)
-
-                        offset = patch.getfloat('audio', 'offset', default=1)
-                        offset = EEGsynth.rescale(offset, slope=scale_offset, offset=offset_offset)
-                        monitor.update("offset", offset)
-
-                        taper = patch.getfloat('audio', 'taper', default=0)
-                        taper = EEGsynth.rescale(taper, slope=scale_taper, offset=offset_taper)
-                        monitor.update("taper", taper)
-
-                        # read the audio file
-                        filename = self.sample[val - 1]
-                        try:
-                            rate, dat = wavfile.read(filename)
-                            # ensure it is a two-dimensional array with samples*channels
-                            dat = np.reshape(dat, (dat.shape[0], channels))
-                            # trim to the onset/offset and adjust the speed
-                            begsample = round(dat.shape[0] * onset)
-                            endsample = round(dat.shape[0] * offset)
-                            endsample = max(begsample, endsample)
-                            count = round((endsample - begsample) / speed)
-                            selection = np.linspace(begsample, endsample - 1, count).astype(np.int32)
-                            dat = dat[selection]
-                            monitor.info("playing %s for up to %d ms" % (filename, 1000 * dat.shape[0] / rate))
-                        except:
-                            module.warning("cannot load %s" % filename)
-                            continue
-
-                        # deal with empty files or selections
-                        if dat.shape[0] == 0:
-                            dat = np.zeros((1, channels))
-
-                        # scale 8, 16 and 32 bit PCM to float, with values between -1.0 and +1.0
-                        if dat.dtype == np.uint8:
-                            dat = (dat.astype(np.float32) - 127.) / 255.
-                        elif dat.dtype == np.int16:
-                            dat = dat.astype(np.float32) / 32767.
-                        elif dat.dtype == np.int32:
-                            dat = dat.astype(np.float32) / 2147483647.
-
-                        # taper the rising and falling flank
-                        if taper > 0:
-                            n = np.floor(dat.shape[0] * taper / 2).astype(int)
-                            tap = np.concatenate((np.linspace(0, 1, n), np.ones(
-                                dat.shape[0] - 2 * n), np.linspace(1, 0, n))).astype(dat.dtype)
-                            for i in range(channels):
-                                dat[:, i] = np.multiply(dat[:, i], tap)
-
-                        # apply the user-specified scaling
-                        if scaling_method == 'multiply':
-                            dat *= scaling
-                        elif scaling_method == 'divide':
-                            dat /= scaling
-                        elif scaling_method == 'db':
-                            dat *= np.power(10., scaling / 20.)
-
-                        if np.min(dat) < -1 or np.max(dat) > 1:
-                            monitor.warning('WARNING: signal exceeds [-1,+1] range, the audio will clip')
-
-                        with lock:
-                            # replace the current playback stack
-                            stack = dat
-                            current_channel = self.redischannel
-                            current_value = val
-                            # send a trigger to indicate that the sample started playing
-                            patch.setvalue("%s.%s" % (started, current_channel), current_value)
+        # if value=0, the previous sample is stopped
+        # if value=N, the Nth sample is played
+        val = float(item['data'])
+        scale_data = patch.getfloat('scale', self.redischannel, default=1)
+        offset_data = patch.getfloat('offset', self.redischannel, default=0)
+        val = EEGsynth.rescale(val, slope=scale_data, offset=offset_data)
+        val = int(val)
+
+        if val == 0:
+            if current_channel == self.redischannel:
+                with lock:
+                    stack = np.zeros((0, channels), dtype=np.float32)
+                    current_channel = None
+                    current_value = val
+
+        elif len(self.sample) >= val:
+            # update the parameters
+            scaling = patch.getfloat('audio', 'scaling', default=1)
+            scaling = EEGsynth.rescale(scaling, slope=scale_scaling, offset=offset_scaling)
+            monitor.update("scaling", scaling)
+
+            speed = patch.getfloat('audio', 'speed', default=1)
+            speed = EEGsynth.rescale(speed, slope=scale_speed, offset=offset_speed)
+            monitor.update("speed", speed)
+
+            onset = patch.getfloat('audio', 'onset', default=0)
+            onset = EEGsynth.rescale(onset, slope=scale_onset, offset=offset_onset)
+            monitor.update("onset", onset)
+
+            offset = patch.getfloat('audio', 'offset', default=1)
+            offset = EEGsynth.rescale(offset, slope=scale_offset, offset=offset_offset)
+            monitor.update("offset", offset)
+
+            taper = patch.getfloat('audio', 'taper', default=0)
+            taper = EEGsynth.rescale(taper, slope=scale_taper, offset=offset_taper)
+            monitor.update("taper", taper)
+
+            # read the audio file
+            filename = self.sample[val - 1]
+            try:
+                rate, dat = wavfile.read(filename)
+                # ensure it is a two-dimensional array with samples*channels
+                dat = np.reshape(dat, (dat.shape[0], channels))
+                # trim to the onset/offset and adjust the speed
+                begsample = round(dat.shape[0] * onset)
+                endsample = round(dat.shape[0] * offset)
+                endsample = max(begsample, endsample)
+                count = round((endsample - begsample) / speed)
+                selection = np.linspace(begsample, endsample - 1, count).astype(np.int32)
+                dat = dat[selection]
+                monitor.info("playing %s for up to %d ms" % (filename, 1000 * dat.shape[0] / rate))
+            except:
+                monitor.warning("cannot load %s" % filename)
+                return
+
+            # deal with empty files or selections
+            if dat.shape[0] == 0:
+                dat = np.zeros((1, channels))
+
+            # scale 8, 16 and 32 bit PCM to float, with values between -1.0 and +1.0
+            if dat.dtype == np.uint8:
+                dat = (dat.astype(np.float32) - 127.) / 255.
+            elif dat.dtype == np.int16:
+                dat = dat.astype(np.float32) / 32767.
+            elif dat.dtype == np.int32:
+                dat = dat.astype(np.float32) / 2147483647.
+
+            # taper the rising and falling flank
+            if taper > 0:
+                n = np.floor(dat.shape[0] * taper / 2).astype(int)
+                tap = np.concatenate((np.linspace(0, 1, n), np.ones(
+                    dat.shape[0] - 2 * n), np.linspace(1, 0, n))).astype(dat.dtype)
+                for i in range(channels):
+                    dat[:, i] = np.multiply(dat[:, i], tap)
+
+            # apply the user-specified scaling
+            if scaling_method == 'multiply':
+                dat *= scaling
+            elif scaling_method == 'divide':
+                dat /= scaling
+            elif scaling_method == 'db':
+                dat *= np.power(10., scaling / 20.)
+
+            if np.min(dat) < -1 or np.max(dat) > 1:
+                monitor.warning('WARNING: signal exceeds [-1,+1] range, the audio will clip')
+
+            with lock:
+                # replace the current playback stack
+                stack = dat
+                current_channel = self.redischannel
+                current_value = val
+                # send a trigger to indicate that the sample started playing
+                patch.setvalue("%s.%s" % (started, current_channel), current_value)
 
 
 def _setup():
@@ -216,7 +203,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global device, scaling_method, scaling, speed, onset, offset, taper, scale_scaling, scale_speed, scale_onset, scale_offset, scale_taper, offset_scaling, offset_speed, offset_onset, offset_offset, offset_taper, started, finished, p, info, i, devinfo, lock, input_channel, input_sample, rate, dat, channels, stack, current_channel, current_value, trigger, channel, sample, thread, stream
+    global device, scaling_method, scaling, speed, onset, offset, taper, scale_scaling, scale_speed, scale_onset, scale_offset, scale_taper, offset_scaling, offset_speed, offset_onset, offset_offset, offset_taper, started, finished, p, info, i, devinfo, lock, input_channel, input_sample, rate, dat, channels, stack, current_channel, current_value, trigger, channel, sample, dispatcher, stream
 
     # get the options from the configuration file
     device = patch.getint('audio', 'device')
@@ -276,14 +263,15 @@ def _start():
     current_channel = None
     current_value = 0
 
-    # create the background threads that deal with the triggers
+    # a single background thread receives all triggers, the samples are loaded by a pool of workers
+    # the triggers on the same channel are handled by the same worker, so that play and stop remain in order
+    dispatcher = EEGsynth.dispatcher(patch, monitor)
     trigger = []
     for channel, sample in zip(input_channel, input_sample):
         monitor.info(str(channel) + " " + str(sample))
-        trigger.append(TriggerThread(channel, sample))
-
-    for thread in trigger:
-        thread.start()
+        trigger.append(TriggerHandler(channel, sample))
+        dispatcher.subscribe(channel, trigger[-1], slow=True)
+    dispatcher.start()
 
     # open audio stream
     stream = p.open(format=pyaudio.paFloat32,
@@ -319,17 +307,13 @@ def _loop_forever():
 def _stop(*args):
     '''Stop and clean up on SystemExit, KeyboardInterrupt, RuntimeError
     '''
-    global monitor, stream, p, trigger
+    global monitor, stream, p, dispatcher
     monitor.success("Closing stream")
     stream.stop_stream()
     stream.close()
     p.terminate()
     monitor.success("Closing threads")
-    for thread in trigger:
-        thread.stop()
-    patch.publish('SAMPLER_UNBLOCK', 1)
-    for thread in trigger:
-        thread.join()
+    dispatcher.stop()
 
 
 if __name__ == '__main__':
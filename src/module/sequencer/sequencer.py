@@ -48,9 +48,8 @@ sys.path.append(os.path.join(path, '../../lib'))
 import EEGsynth
 
 
-class SequenceThread(threading.Thread):
+class SequenceHandler():
     def __init__(self, redischannel, key):
-        threading.Thread.__init__(self)
         self.redischannel = redischannel
         self.key = key
         self.sequence = []
@@ -59,7 +58,6 @@ class SequenceThread(threading.Thread):
         self.steptime = 0.
         self.prevtime = None
         self.step = 0
-        self.running = True
 
     def setSequence(self, sequence):
         with lock:
@@ -73,53 +71,42 @@ class SequenceThread(threading.Thread):
         with lock:
             self.duration = duration
 
-    def stop(self):
-        self.running = False
-
-    def run(self):
+    def __call__(self, item):
         global r, monitor, patch
-        pubsub = patch.pubsub()
-        pubsub.subscribe('SEQUENCER_UNBLOCK')  # this message unblocks the redis listen command
-        pubsub.subscribe(self.redischannel)    # this message contains the note
-        while self.running:
-            for item in pubsub.listen():
-                if not self.running or not item['type'] == 'message':
-                    break
-                if item['channel'] == self.redischannel:
-                    monitor.debug(item)
-                    now = time.time()
-                    if self.prevtime != None:
-                        self.steptime = now - self.prevtime
-                    self.prevtime = now
-                    if len(self.sequence) > 0:
-                        # the sequence can consist of a list of values or a list of Redis channels
-                        val = self.sequence[self.step % len(self.sequence)]
-
-                        if val[0].isalpha():
-                            # get the value directly from Redis
-                            try:
-                                val = float(patch.redis.get(val))
-                            except:
-                                val = 0.
-                        else:
-                            try:
-                                val = float(val)
-                            except ValueError:
-                                val = 0.
-
-                        # apply the scaling, offset and transpose the note
-                        val = EEGsynth.rescale(val, slope=scale_note, offset=offset_note)
-                        val += self.transpose
-
-                        # send it as sequencer.note with the note as value
-                        patch.setvalue(self.key, val, duration=self.duration * self.steptime)
-                        if val >= 1.:
-                            # send it also as sequencer.noteXXX with value 1.0
-                            key = '%s%03d' % (self.key, round(val))
-                            patch.setvalue(key, 1., duration=self.duration * self.steptime)
-                        monitor.info("step %2d : %s = %g" % (self.step + 1, self.key, val))
-                        # increment to the next step
-                        self.step = (self.step + 1) % len(self.sequence)
+        monitor.debug(item)
+        now = time.time()
+        if self.prevtime != None:
+            self.steptime = now - self.prevtime
+        self.prevtime = now
+        if len(self.sequence) > 0:
+            # the sequence can consist of a list of values or a list of Redis channels
+            val = self.sequence[self.step % len(self.sequence)]
+
+            if val[0].isalpha():
+                # get the value directly from Redis
+                try:
+                    val = float(patch.redis.get(val))
+                except:
+                    val = 0.
+            else:
+                try:
+                    val = float(val)
+                except ValueError:
+                    val = 0.
+
+            # apply the scaling, offset and transpose the note
+            val = EEGsynth.rescale(val, slope=scale_note, offset=offset_note)
+            val += self.transpose
+
+            # send it as sequencer.note with the note as value
+            patch.setvalue(self.key, val, duration=self.duration * self.steptime)
+            if val >= 1.:
+                # send it also as sequencer.noteXXX with value 1.0
+                key = '%s%03d' % (self.key, round(val))
+                patch.setvalue(key, 1., duration=self.duration * self.steptime)
+            monitor.info("step %2d : %s = %g" % (self.step + 1, self.key, val))
+            # increment to the next step
+            self.step = (self.step + 1) % len(self.sequence)
 
 
 def _setup():
@@ -144,7 +131,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global stepsize, clock, prefix, scale_active, scale_transpose, scale_note, scale_duration, offset_active, offset_transpose, offset_note, offset_duration, lock, key, sequencethread
+    global stepsize, clock, prefix, scale_active, scale_transpose, scale_note, scale_duration, offset_active, offset_transpose, offset_note, offset_duration, lock, key, sequencehandler, dispatcher
 
     # get the options from the configuration file
     stepsize = patch.getfloat('general', 'delay')
@@ -168,9 +155,11 @@ def _start():
     # the notes will be sent to Redis using this key
     key = "{}.note".format(prefix)
 
-    # create and start the thread for the output
-    sequencethread = SequenceThread(clock, key)
-    sequencethread.start()
+    # the background thread receives the clock signal and passes it on to the handler for the output
+    sequencehandler = SequenceHandler(clock, key)
+    dispatcher = EEGsynth.dispatcher(patch, monitor)
+    dispatcher.subscribe(clock, sequencehandler)
+    dispatcher.start()
 
     monitor.update('scale_active',     scale_active)
     monitor.update('scale_transpose',  scale_transpose)
@@ -191,7 +180,7 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global stepsize, clock, prefix, scale_active, scale_transpose, scale_note, scale_duration, offset_active, offset_transpose, offset_note, offset_duration, lock, key, sequencethread
+    global stepsize, clock, prefix, scale_active, scale_transpose, scale_note, scale_duration, offset_active, offset_transpose, offset_note, offset_duration, lock, key, sequencehandler, dispatcher
     global active, sequence, transpose, duration, elapsed, naptime
 
     # the active sequence is specified as an integer between 0 and 127
@@ -219,9 +208,9 @@ def _loop_once():
     monitor.update("transpose", transpose)
     monitor.update("duration",  duration)
 
-    sequencethread.setSequence(sequence)
-    sequencethread.setTranspose(transpose)
-    sequencethread.setDuration(duration)
+    sequencehandler.setSequence(sequence)
+    sequencehandler.setTranspose(transpose)
+    sequencehandler.setDuration(duration)
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -250,16 +239,14 @@ def _loop_forever():
 def _stop(*args):
     '''Stop and clean up on SystemExit, KeyboardInterrupt, RuntimeError
     '''
-    global monitor, patch, sequencethread, r
+    global monitor, patch, dispatcher, r
     try:
         monitor.success("Disabling last note")
         patch.setvalue(key, 0.)
     except:
         pass
     monitor.success('Closing threads')
-    sequencethread.stop()
-    patch.publish('SEQUENCER_UNBLOCK', 1)
-    sequencethread.join()
+    dispatcher.stop()
 
 
 if __name__ == '__main__':
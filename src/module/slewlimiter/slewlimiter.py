@@ -66,7 +66,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global prefix, input_name, input_variable, previous_val
+    global prefix, input_name, input_variable, previous_val, settling
 
     # get the options from the configuration file
     prefix = patch.getstring('output', 'prefix')
@@ -78,6 +78,9 @@ def _start():
     for name in input_name:
         previous_val[name] = None
 
+    # this indicates whether the output values are still moving towards the input values
+    settling = False
+
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
         print('LOCALS: ' + ', '.join(locals().keys()))
@@ -88,9 +91,10 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global prefix, input_name, input_variable, previous_val
+    global prefix, input_name, input_variable, previous_val, settling
 
     lrate = patch.getfloat('processing', 'learning_rate', default=1)
+    settling = False
 
     for name, variable in zip(input_name, input_variable):
         key = '%s.%s' % (prefix, variable)
@@ -103,6 +107,8 @@ def _loop_once():
         if previous_val[name] is None:
             # initialize for the first time
             previous_val[name] = val
+        if abs(val - previous_val[name]) > 1e-6 * max(1., abs(val)):
+            settling = True
         val = (1 - lrate) * previous_val[name] + lrate * val
         monitor.update(key, val)
         patch.setvalue(key, val)
@@ -112,11 +118,13 @@ def _loop_once():
 def _loop_forever():
     '''Run the main loop forever
     '''
-    global monitor, patch
+    global monitor, patch, settling
     while True:
         monitor.loop()
         _loop_once()
-        time.sleep(patch.getfloat('general', 'delay'))
+        # in reactive mode this waits until one of the input values has changed
+        # but it should not wait as long as the output values are still moving
+        patch.wait(patch.getfloat('general', 'delay'), timeout=0 if settling else 1)
 
 
 def _stop():
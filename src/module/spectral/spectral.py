@@ -66,14 +66,14 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global ft_host, ft_port, ft_input, timeout, hdr_input, start, channel_items, channame, chanindx, item, prefix, output, begsample, endsample
+    global ft_host, ft_port, ft_input, timeout, hdr_input, start, channel_items, channame, chanindx, item, prefix, output, begsample, endsample, settings
 
     try:
         ft_host = patch.getstring('fieldtrip','hostname')
         ft_port = patch.getint('fieldtrip','port')
         monitor.info('Trying to connect to buffer on %s:%i ...' % (ft_host, ft_port))
         ft_input = FieldTrip.Client()
-        ft_input.connect(ft_host, ft_port)
+        ft_input.connect(ft_host, ft_port, shared=patch.getint('fieldtrip', 'shared', default=0)>0)
         monitor.info("Connected to FieldTrip buffer")
     except:
         raise RuntimeError("cannot connect to FieldTrip buffer")
@@ -110,26 +110,29 @@ def _start():
     begsample = -1
     endsample = -1
 
+    # the spectral estimate is recomputed when the settings change
+    settings = None
+
 
 def _loop_once():
     '''Run the main loop once
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global patch, name, path, monitor
-    global ft_host, ft_port, ft_input, timeout, hdr_input, start, channel_items, channame, chanindx, item, prefix, output, begsample, endsample
-    global scale_window, offset_window, window, taper, frequency, band_items, bandname, bandlo, bandhi, lohi, dat, power, chan, band, meandat, sample, F, i, lo, hi, count, key
+    global ft_host, ft_port, ft_input, timeout, hdr_input, start, channel_items, channame, chanindx, item, prefix, output, begsample, endsample, settings
+    global scale_window, offset_window, window, segment, overlap, segsize, hopsize, nsegments, taper, frequency, band_items, bandname, bandlo, bandhi, lohi, bandmatrix, lo, hi, segments, count, lastend, ends, dat, power, value, i, band, chan, key
 
     scale_window = patch.getfloat('scale', 'window', default=1.)
     offset_window = patch.getfloat('offset', 'window', default=0.)
     window = patch.getfloat('processing', 'window', default=2)
     window = EEGsynth.rescale(window, slope=scale_window, offset=offset_window)
+    # the window is divided in overlapping segments, whose power spectra are averaged (Welch's method)
+    # without segment, the spectrum of the most recent window is computed whenever there is new data
+    segment = patch.getfloat('processing', 'segment')
+    overlap = patch.getfloat('processing', 'overlap', default=0.5)
 
     monitor.update('window', window)
 
-    window = int(round(window * hdr_input.fSample))  # in samples
-    taper = np.hanning(window)
-    frequency = np.fft.fftfreq(window, 1.0 / hdr_input.fSample)
-
     band_items = patch.config.items('band')
     bandname = []
     bandlo   = []
@@ -143,45 +146,81 @@ def _loop_once():
 
     monitor.debug(bandname, bandlo, bandhi)
 
+    if settings != (window, segment, overlap, bandlo, bandhi):
+        # these only need to be computed again when the settings change
+        settings = (window, segment, overlap, bandlo, bandhi)
+        if segment is None:
+            segsize = int(round(window * hdr_input.fSample))                # in samples
+            hopsize = 1                                                     # in samples
+        else:
+            segsize = int(round(min(segment, window) * hdr_input.fSample))  # in samples
+            hopsize = max(int(round(segsize * (1 - overlap))), 1)           # in samples
+        nsegments = int((int(round(window * hdr_input.fSample)) - segsize) / hopsize) + 1
+        taper = np.hanning(segsize)
+        frequency = np.fft.rfftfreq(segsize, 1.0 / hdr_input.fSample)
+
+        # this matrix averages the frequencies within each band
+        bandmatrix = np.zeros((len(frequency), len(bandname)))
+        for i, (lo, hi) in enumerate(zip(bandlo, bandhi)):
+            bandmatrix[np.logical_and(frequency>=lo, frequency<=hi), i] = 1
+        with np.errstate(invalid='ignore'):
+            bandmatrix = bandmatrix / bandmatrix.sum(axis=0)    # empty bands result in nan
+
+        # the power spectra of the most recent segments
+        segments = np.zeros((nsegments, len(frequency), len(chanindx)))
+        count = 0
+        lastend = None
+
     hdr_input = ft_input.getHeader()
     if (hdr_input.nSamples - 1) < endsample:
         raise RuntimeError("buffer reset detected")
-    if hdr_input.nSamples < window:
+    if hdr_input.nSamples < segsize:
         # there are not yet enough samples in the buffer
         monitor.info("Waiting for data...")
         return
 
-    # get the most recent data segment
-    begsample = hdr_input.nSamples - window
-    endsample = hdr_input.nSamples - 1
+    # determine the segments that have not yet been processed, no more than fit in the window
+    if lastend is None:
+        lastend = hdr_input.nSamples - nsegments * hopsize
+    ends = np.arange(lastend + hopsize, hdr_input.nSamples + 1, hopsize)
+    ends = ends[ends >= segsize][-nsegments:]
+    if len(ends) == 0:
+        # there is not yet enough new data for the next segment
+        return
+    lastend = ends[-1]
+
+    # get the data for all new segments at once
+    begsample = ends[0] - segsize
+    endsample = ends[-1] - 1
     dat = ft_input.getData([begsample, endsample]).astype(np.double)
     dat = dat[:, chanindx]
+    dat = np.stack([dat[(end - segsize - begsample):(end - begsample), :] for end in ends])
 
     # demean the data to prevent spectral leakage
-    dat = detrend(dat, axis=0, type='constant')
+    dat = detrend(dat, axis=1, type='constant')
 
     # taper the data
-    dat = dat * taper[:, np.newaxis]
+    dat = dat * taper[np.newaxis, :, np.newaxis]
 
-    # compute the FFT over the sample direction
+    # compute the FFT over the sample direction, the oldest segments in the ring are replaced
+    power = abs(np.fft.rfft(dat, axis=1))**2
+    for i in range(len(ends)):
+        segments[(count + i) % nsegments] = power[i]
+    count += len(ends)
+
+    # average the power over segments
+    power = segments[0:min(count, nsegments)].mean(axis=0)
     if output == 'amplitude':
-        F = abs(np.fft.fft(dat, axis=0))
-    elif output == 'power':
-        F = abs(np.fft.fft(dat, axis=0))**2
+        power = np.sqrt(power)
     elif output == 'db':
-        F = 10*np.log10(abs(np.fft.fft(dat, axis=0)))
+        power = 10*np.log10(np.sqrt(power))
 
-    # this vector contains the spectral estimate for each channel and frequency band
-    value = [np.nan] * len(channame) * len(bandname)
+    # average over the frequencies in each band
+    value = np.dot(power.T, bandmatrix)     # channels x bands
+
+    # the values are ordered by band, and then by channel
+    value = value.T.flatten()
 
-    i = 0
-    for lo,hi in zip(bandlo,bandhi):
-        freqindx = np.logical_and(frequency>=lo, frequency<=hi)
-        for chan in range(F.shape[1]):
-            if freqindx.sum()>0:
-                value[i] = np.mean(F[freqindx, chan])
-            i+=1
-    
     monitor.debug(np.around(value))
 
     i = 0